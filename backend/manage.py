@@ -0,0 +1,363 @@
+"""Maintenance commands for the CarShare backend.
+
+Usage:
+    python manage.py backfill-rollups [--host-id HOST_ID] [--batch-size N]
+    python manage.py backfill-reviewer-names [--batch-size N]
+    python manage.py archive-bookings [--older-than-days N] [--batch-size N]
+    python manage.py rebuild-calendars [--batch-size N]
+    python manage.py normalize-data [--only dates|ratings] [--batch-size N] [--restart]
+"""
+import argparse
+import asyncio
+import re
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from pymongo import ReplaceOne, UpdateMany, UpdateOne # type: ignore
+
+from server import (
+    db, client, booking_rollup_counters, booking_rollup_key, archive_bookings, booking_day_masks,
+    parse_date, rating_summary, BOOKING_ARCHIVE_AFTER_DAYS, LIVE_BOOKING_STATUSES, TERMINAL_BOOKING_STATUSES,
+)
+
+
+async def iter_all_bookings(query: dict, projection: dict, batch_size: int):
+    """Bookings from the hot collection and the archive, each booking once"""
+    # An interrupted archive run can leave a finished booking in both collections; only
+    # finished hot bookings can be archived, so those are the only ids worth remembering
+    finished_ids = set()
+    async for booking in db.bookings.find(query, {**projection, "id": 1, "status": 1}).batch_size(batch_size):
+        if booking.get("status") in TERMINAL_BOOKING_STATUSES:
+            finished_ids.add(booking.get("id"))
+        yield booking
+    async for booking in db.bookings_archive.find(query, {**projection, "id": 1}).batch_size(batch_size):
+        if booking.get("id") not in finished_ids:
+            yield booking
+
+
+async def backfill_rollups(host_id: str = None, batch_size: int = 1000):
+    """Rebuild host_daily_rollups from hot and archived bookings"""
+    started = time.monotonic()
+    query = {"host_id": host_id} if host_id else {}
+
+    # Rollups are keyed by (host, car, day), so this stays small even for long histories
+    rollups = defaultdict(lambda: defaultdict(float))
+    scanned = 0
+    bookings = iter_all_bookings(
+        query,
+        {"_id": 0, "id": 1, "host_id": 1, "car_id": 1, "start_date": 1, "end_date": 1, "total_amount": 1, "status": 1},
+        batch_size
+    )
+    async for booking in bookings:
+        scanned += 1
+        try:
+            key = booking_rollup_key(booking)
+            counters = booking_rollup_counters(booking, booking.get("status"))
+        except (KeyError, ValueError) as e:
+            print(f"Skipping booking {booking.get('id')}: {str(e)}")
+            continue
+
+        totals = rollups[(key["host_id"], key["car_id"], key["day"])]
+        for field, value in counters.items():
+            totals[field] += value
+
+    await db.host_daily_rollups.delete_many(query)
+
+    operations = []
+    written = 0
+    for (rollup_host_id, car_id, day), totals in rollups.items():
+        key = {"host_id": rollup_host_id, "car_id": car_id, "day": day}
+        operations.append(ReplaceOne(key, {
+            **key,
+            "month": day[:7],
+            "bookings": int(totals["bookings"]),
+            "cancellations": int(totals["cancellations"]),
+            "completions": int(totals["completions"]),
+            "earnings": round(totals["earnings"], 2),
+            "rental_days": int(totals["rental_days"]),
+        }, upsert=True))
+        if len(operations) >= batch_size:
+            await db.host_daily_rollups.bulk_write(operations, ordered=False)
+            written += len(operations)
+            operations = []
+    if operations:
+        await db.host_daily_rollups.bulk_write(operations, ordered=False)
+        written += len(operations)
+
+    elapsed = time.monotonic() - started
+    print(f"Scanned {scanned} bookings, wrote {written} rollup documents in {elapsed:.1f}s")
+
+
+async def backfill_reviewer_names(batch_size: int = 1000):
+    """Copy reviewer display names onto reviews written before they were denormalized"""
+    started = time.monotonic()
+    user_ids = await db.reviews.distinct("user_id", {"user_name": {"$in": [None, ""]}})
+
+    updated = 0
+    for i in range(0, len(user_ids), batch_size):
+        chunk = user_ids[i:i + batch_size]
+        users = await db.users.find({"id": {"$in": chunk}}, {"_id": 0, "id": 1, "name": 1}).to_list(len(chunk))
+        operations = [
+            UpdateMany({"user_id": user["id"], "user_name": {"$in": [None, ""]}}, {"$set": {"user_name": user["name"]}})
+            for user in users
+        ]
+        if operations:
+            result = await db.reviews.bulk_write(operations, ordered=False)
+            updated += result.modified_count
+
+    elapsed = time.monotonic() - started
+    print(f"Backfilled reviewer names for {len(user_ids)} users ({updated} reviews) in {elapsed:.1f}s")
+
+
+async def run_archive_bookings(older_than_days: int, batch_size: int):
+    """Move cold completed and cancelled bookings to bookings_archive"""
+    started = time.monotonic()
+    archived = await archive_bookings(older_than_days, batch_size)
+    elapsed = time.monotonic() - started
+    print(f"Archived {archived} bookings older than {older_than_days} days in {elapsed:.1f}s")
+
+
+async def rebuild_calendars(batch_size: int = 1000):
+    """Recompute every car's booked-day bitmaps from live bookings"""
+    started = time.monotonic()
+    calendars = defaultdict(lambda: defaultdict(int))
+    scanned = 0
+    # Only live bookings hold days; the archive only ever receives completed and
+    # cancelled bookings, so it has nothing to contribute
+    cursor = db.bookings.find(
+        {"status": {"$in": LIVE_BOOKING_STATUSES}},
+        {"_id": 0, "id": 1, "car_id": 1, "start_date": 1, "end_date": 1}
+    ).batch_size(batch_size)
+    async for booking in cursor:
+        scanned += 1
+        try:
+            masks = booking_day_masks(booking["start_date"], booking["end_date"])
+        except (KeyError, ValueError) as e:
+            print(f"Skipping booking {booking.get('id')}: {str(e)}")
+            continue
+        for (year, month), mask in masks.items():
+            calendars[(booking["car_id"], year)][f"m{month}"] |= mask
+
+    await db.car_calendars.delete_many({})
+    operations = [
+        UpdateOne({"car_id": car_id, "year": year}, {"$set": dict(months)}, upsert=True)
+        for (car_id, year), months in calendars.items()
+    ]
+    for i in range(0, len(operations), batch_size):
+        await db.car_calendars.bulk_write(operations[i:i + batch_size], ordered=False)
+
+    elapsed = time.monotonic() - started
+    print(f"Scanned {scanned} bookings, wrote {len(operations)} calendars in {elapsed:.1f}s")
+
+
+# Date fields that must be BSON datetimes, per collection
+DATE_FIELDS = {
+    "bookings": ["start_date", "end_date", "created_at"],
+    "bookings_archive": ["start_date", "end_date", "created_at"],
+    "cars": ["created_at", "updated_at", "deleted_at"],
+    "users": ["created_at", "otp_expiry"],
+    "reviews": ["created_at"],
+}
+NON_DATE_TYPES = ["string", "int", "long", "double", "decimal"]
+NUMERIC_DATE = re.compile(r"^-?\d+(\.\d+)?$")
+
+
+def canonical_utc(value) -> datetime:
+    """Convert a stored string or timestamp into an aware UTC datetime"""
+    if isinstance(value, (int, float)) or (isinstance(value, str) and NUMERIC_DATE.match(value.strip())):
+        timestamp = float(value)
+        # Millisecond timestamps from JavaScript clients
+        if abs(timestamp) > 1e11:
+            timestamp /= 1000
+        return datetime.fromtimestamp(timestamp, timezone.utc)
+    parsed = parse_date(value)
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+async def load_checkpoint(name: str, restart: bool):
+    if restart:
+        await db.maintenance_checkpoints.delete_one({"_id": name})
+        return None
+    checkpoint = await db.maintenance_checkpoints.find_one({"_id": name})
+    return checkpoint.get("last") if checkpoint else None
+
+
+async def save_checkpoint(name: str, last):
+    await db.maintenance_checkpoints.update_one(
+        {"_id": name}, {"$set": {"last": last, "updated_at": datetime.now(timezone.utc)}}, upsert=True
+    )
+
+
+def report_progress(label: str, scanned: int, updated: int, started: float):
+    elapsed = time.monotonic() - started
+    rate = scanned / elapsed if elapsed else 0.0
+    print(f"{label}: scanned {scanned}, updated {updated} ({rate:.0f} docs/s, {elapsed:.1f}s)")
+
+
+async def normalize_dates(batch_size: int = 1000, restart: bool = False):
+    """Rewrite string and numeric dates as UTC BSON datetimes, resuming from the last finished batch"""
+    for collection_name, fields in DATE_FIELDS.items():
+        collection = db[collection_name]
+        checkpoint = f"normalize-dates:{collection_name}"
+        last_id = await load_checkpoint(checkpoint, restart)
+        if last_id == "done":
+            print(f"{collection_name}: already normalized (use --restart to scan again)")
+            continue
+
+        # Only documents with at least one non-date value are read at all
+        query = {"$or": [{field: {"$type": NON_DATE_TYPES}} for field in fields]}
+        started = time.monotonic()
+        scanned = updated = failed = 0
+        while True:
+            batch_query = {**query, "_id": {"$gt": last_id}} if last_id is not None else query
+            batch = await collection.find(
+                batch_query, {field: 1 for field in fields}
+            ).sort("_id", 1).limit(batch_size).to_list(batch_size)
+            if not batch:
+                break
+
+            operations = []
+            for document in batch:
+                changes = {}
+                for field in fields:
+                    value = document.get(field)
+                    if value is None or isinstance(value, datetime):
+                        continue
+                    try:
+                        changes[field] = canonical_utc(value)
+                    except (ValueError, TypeError, OverflowError, OSError):
+                        failed += 1
+                        print(f"{collection_name} {document['_id']}: cannot parse {field}={value!r}")
+                if changes:
+                    operations.append(UpdateOne({"_id": document["_id"]}, {"$set": changes}))
+            if operations:
+                result = await collection.bulk_write(operations, ordered=False)
+                updated += result.modified_count
+
+            scanned += len(batch)
+            last_id = batch[-1]["_id"]
+            await save_checkpoint(checkpoint, last_id)
+            report_progress(collection_name, scanned, updated, started)
+
+        await save_checkpoint(checkpoint, "done")
+        report_progress(f"{collection_name} done", scanned, updated, started)
+        if failed:
+            print(f"{collection_name}: {failed} values could not be parsed and were left unchanged")
+
+
+async def recompute_ratings(batch_size: int = 1000, restart: bool = False):
+    """Rebuild every car's rating aggregates from one aggregation over reviews"""
+    checkpoint = "recompute-ratings"
+    last_car_id = await load_checkpoint(checkpoint, restart)
+    started = time.monotonic()
+    scanned = updated = 0
+
+    if last_car_id != "done":
+        pipeline = []
+        if last_car_id is not None:
+            pipeline.append({"$match": {"car_id": {"$gt": last_car_id}}})
+        pipeline += [
+            {"$group": {"_id": {"car_id": "$car_id", "rating": "$rating"}, "count": {"$sum": 1}}},
+            {"$group": {"_id": "$_id.car_id", "counts": {"$push": {"rating": "$_id.rating", "count": "$count"}}}},
+            {"$sort": {"_id": 1}},
+        ]
+
+        operations = []
+        async for row in db.reviews.aggregate(pipeline, allowDiskUse=True, batchSize=batch_size):
+            counts = {item["rating"]: item["count"] for item in row["counts"]}
+            operations.append(UpdateOne({"id": row["_id"]}, {"$set": rating_summary(counts)}))
+            scanned += 1
+            if len(operations) >= batch_size:
+                result = await db.cars.bulk_write(operations, ordered=False)
+                updated += result.modified_count
+                operations = []
+                await save_checkpoint(checkpoint, row["_id"])
+                report_progress("ratings", scanned, updated, started)
+        if operations:
+            result = await db.cars.bulk_write(operations, ordered=False)
+            updated += result.modified_count
+        await save_checkpoint(checkpoint, "done")
+        report_progress("ratings", scanned, updated, started)
+    else:
+        print("ratings: already recomputed (use --restart to run again)")
+
+    # Cars whose reviews were all deleted still carry totals, and cars created before
+    # the summary existed have none; reset those that have no reviews at all
+    reset = 0
+    cursor = db.cars.find(
+        {"$or": [{"total_reviews": {"$ne": 0}}, {"rating_sum": {"$exists": False}}]}, {"_id": 0, "id": 1}
+    ).batch_size(batch_size)
+    batch = []
+    async for car in cursor:
+        batch.append(car["id"])
+        if len(batch) < batch_size:
+            continue
+        reset += await reset_unreviewed_cars(batch)
+        batch = []
+    if batch:
+        reset += await reset_unreviewed_cars(batch)
+    report_progress(f"ratings done, {reset} unreviewed cars reset", scanned, updated + reset, started)
+
+
+async def reset_unreviewed_cars(car_ids: list) -> int:
+    reviewed = set(await db.reviews.distinct("car_id", {"car_id": {"$in": car_ids}}))
+    operations = [
+        UpdateOne({"id": car_id}, {"$set": rating_summary({})}) for car_id in car_ids if car_id not in reviewed
+    ]
+    if not operations:
+        return 0
+    result = await db.cars.bulk_write(operations, ordered=False)
+    return result.modified_count
+
+
+async def normalize_data(only: str = None, batch_size: int = 1000, restart: bool = False):
+    if only in (None, "dates"):
+        await normalize_dates(batch_size, restart)
+    if only in (None, "ratings"):
+        await recompute_ratings(batch_size, restart)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CarShare maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    rollups_parser = subparsers.add_parser("backfill-rollups", help="Rebuild host analytics rollups from hot and archived bookings")
+    rollups_parser.add_argument("--host-id", help="Only rebuild rollups for this host")
+    rollups_parser.add_argument("--batch-size", type=int, default=1000)
+
+    names_parser = subparsers.add_parser("backfill-reviewer-names", help="Store reviewer names on existing reviews")
+    names_parser.add_argument("--batch-size", type=int, default=1000)
+
+    archive_parser = subparsers.add_parser("archive-bookings", help="Move old completed and cancelled bookings to the archive")
+    archive_parser.add_argument("--older-than-days", type=int, default=BOOKING_ARCHIVE_AFTER_DAYS)
+    archive_parser.add_argument("--batch-size", type=int, default=500)
+
+    calendars_parser = subparsers.add_parser("rebuild-calendars", help="Recompute car availability bitmaps from bookings")
+    calendars_parser.add_argument("--batch-size", type=int, default=1000)
+
+    normalize_parser = subparsers.add_parser("normalize-data", help="Store dates as UTC datetimes and recompute car ratings")
+    normalize_parser.add_argument("--only", choices=["dates", "ratings"], help="Run a single phase")
+    normalize_parser.add_argument("--batch-size", type=int, default=1000)
+    normalize_parser.add_argument("--restart", action="store_true", help="Ignore saved progress and start over")
+
+    args = parser.parse_args()
+
+    if args.command == "backfill-rollups":
+        asyncio.run(backfill_rollups(args.host_id, args.batch_size))
+    elif args.command == "backfill-reviewer-names":
+        asyncio.run(backfill_reviewer_names(args.batch_size))
+    elif args.command == "archive-bookings":
+        asyncio.run(run_archive_bookings(args.older_than_days, args.batch_size))
+    elif args.command == "rebuild-calendars":
+        asyncio.run(rebuild_calendars(args.batch_size))
+    elif args.command == "normalize-data":
+        asyncio.run(normalize_data(args.only, args.batch_size, args.restart))
+
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
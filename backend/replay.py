@@ -0,0 +1,187 @@
+"""Replay captured API traffic against a running CarShare backend.
+
+Capture traffic by starting the server with TRAFFIC_CAPTURE_FILE set, then:
+
+Usage:
+    python replay.py CAPTURE_FILE [--base-url URL] [--speed 1|10|100] [--token TOKEN]
+                     [--limit N] [--concurrency N] [--json]
+
+Requests are sent on the captured schedule divided by --speed, whether or not earlier
+ones have finished, and the report compares replayed latency and errors per route
+with what the server measured while capturing.
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import time
+from collections import defaultdict
+
+import httpx # type: ignore
+
+
+def load_capture(path: str, limit: int = 0) -> list:
+    """Captured entries in arrival order; gzip files may hold several members"""
+    with open(path, "rb") as f:
+        compressed = f.read(2) == b"\x1f\x8b"
+    opener = gzip.open if compressed else open
+    entries = []
+    with opener(path, "rt") as f:
+        for line in f:
+            if line.strip():
+                entries.append(json.loads(line))
+    entries.sort(key=lambda entry: entry["ts"])
+    return entries[:limit] if limit else entries
+
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def is_error(status: int) -> bool:
+    # 0 means the request never got a response
+    return status == 0 or status >= 500
+
+
+class ReplayStats:
+    """Captured vs replayed latency and status per route"""
+
+    def __init__(self):
+        self.captured = defaultdict(list)
+        self.replayed = defaultdict(list)
+        self.captured_errors = defaultdict(int)
+        self.replayed_errors = defaultdict(int)
+        self.status_changes = defaultdict(int)
+        self.skipped = 0
+        self.max_lag_ms = 0.0
+
+    def add(self, entry: dict, status: int, duration_ms: float):
+        key = f"{entry['m']} {entry.get('r', entry['p'])}"
+        self.captured[key].append(entry.get("d", 0.0))
+        self.replayed[key].append(duration_ms)
+        if is_error(entry.get("s", 0)):
+            self.captured_errors[key] += 1
+        if is_error(status):
+            self.replayed_errors[key] += 1
+        if status // 100 != entry.get("s", 0) // 100:
+            self.status_changes[key] += 1
+
+    def route_summary(self, key: str) -> dict:
+        captured, replayed = self.captured[key], self.replayed[key]
+        summary = {"route": key, "requests": len(replayed)}
+        for name, values in (("captured", captured), ("replayed", replayed)):
+            summary[f"{name}_p50_ms"] = round(percentile(values, 0.5), 2)
+            summary[f"{name}_p95_ms"] = round(percentile(values, 0.95), 2)
+        captured_p95 = summary["captured_p95_ms"]
+        summary["p95_delta_pct"] = round((summary["replayed_p95_ms"] - captured_p95) / captured_p95 * 100, 1) if captured_p95 else None
+        summary["captured_errors"] = self.captured_errors[key]
+        summary["replayed_errors"] = self.replayed_errors[key]
+        summary["status_changes"] = self.status_changes[key]
+        return summary
+
+    def report(self, speed: float, elapsed: float, captured_span: float) -> dict:
+        routes = sorted(self.replayed, key=lambda key: len(self.replayed[key]), reverse=True)
+        total = sum(len(values) for values in self.replayed.values())
+        return {
+            "speed": speed,
+            "requests": total,
+            "skipped": self.skipped,
+            "captured_seconds": round(captured_span, 2),
+            "replay_seconds": round(elapsed, 2),
+            "replay_rps": round(total / elapsed, 1) if elapsed else 0.0,
+            "max_schedule_lag_ms": round(self.max_lag_ms, 2),
+            "captured_errors": sum(self.captured_errors.values()),
+            "replayed_errors": sum(self.replayed_errors.values()),
+            "status_changes": sum(self.status_changes.values()),
+            "routes": [self.route_summary(key) for key in routes],
+        }
+
+
+async def send(client: httpx.AsyncClient, entry: dict, token: str, stats: ReplayStats, limiter: asyncio.Semaphore):
+    headers = {"Authorization": f"Bearer {token}"} if token and entry.get("a") else {}
+    async with limiter:
+        started = time.monotonic()
+        try:
+            response = await client.request(
+                entry["m"], entry["p"], params=entry.get("q"), json=entry.get("b"), headers=headers
+            )
+            status = response.status_code
+        except httpx.HTTPError:
+            status = 0
+        stats.add(entry, status, (time.monotonic() - started) * 1000)
+
+
+async def replay(entries: list, base_url: str, speed: float, token: str = None, concurrency: int = 256) -> dict:
+    stats = ReplayStats()
+    # Bodies that were too large or not JSON (uploads) were not captured and cannot be replayed
+    replayable = [entry for entry in entries if "b" in entry or not entry.get("bl")]
+    stats.skipped = len(entries) - len(replayable)
+    if not replayable:
+        return stats.report(speed, 0.0, 0.0)
+
+    first_ts = replayable[0]["ts"]
+    limiter = asyncio.Semaphore(concurrency)
+    tasks = []
+    async with httpx.AsyncClient(base_url=base_url, timeout=30.0) as client:
+        started = time.monotonic()
+        for entry in replayable:
+            due = started + (entry["ts"] - first_ts) / speed
+            delay = due - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                stats.max_lag_ms = max(stats.max_lag_ms, -delay * 1000)
+            tasks.append(asyncio.create_task(send(client, entry, token, stats, limiter)))
+        await asyncio.gather(*tasks)
+        elapsed = time.monotonic() - started
+
+    return stats.report(speed, elapsed, replayable[-1]["ts"] - first_ts)
+
+
+def print_report(report: dict):
+    print(
+        f"Replayed {report['requests']} requests at {report['speed']:g}x in {report['replay_seconds']}s "
+        f"({report['replay_rps']} req/s, captured over {report['captured_seconds']}s); "
+        f"skipped {report['skipped']}, max schedule lag {report['max_schedule_lag_ms']}ms"
+    )
+    print(
+        f"Errors: {report['captured_errors']} captured, {report['replayed_errors']} replayed; "
+        f"{report['status_changes']} responses changed status class"
+    )
+    print(f"{'route':<45} {'n':>6} {'cap p50':>9} {'rep p50':>9} {'cap p95':>9} {'rep p95':>9} {'p95 d%':>8} {'err c/r':>9}")
+    for route in report["routes"]:
+        delta = "-" if route["p95_delta_pct"] is None else f"{route['p95_delta_pct']:+.1f}"
+        print(
+            f"{route['route'][:45]:<45} {route['requests']:>6} "
+            f"{route['captured_p50_ms']:>9.1f} {route['replayed_p50_ms']:>9.1f} "
+            f"{route['captured_p95_ms']:>9.1f} {route['replayed_p95_ms']:>9.1f} {delta:>8} "
+            f"{route['captured_errors']:>4}/{route['replayed_errors']:<4}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("capture_file", help="File written by the server with TRAFFIC_CAPTURE_FILE")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed multiplier, e.g. 1, 10 or 100")
+    parser.add_argument("--token", help="Bearer token used for requests that were authenticated when captured")
+    parser.add_argument("--limit", type=int, default=0, help="Replay only the first N captured requests")
+    parser.add_argument("--concurrency", type=int, default=256, help="Upper bound on requests in flight")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+    if args.speed <= 0:
+        parser.error("--speed must be positive")
+
+    entries = load_capture(args.capture_file, args.limit)
+    report = asyncio.run(replay(entries, args.base_url, args.speed, args.token, args.concurrency))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
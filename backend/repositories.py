@@ -0,0 +1,546 @@
+"""Data-access layer for users, cars, bookings and reviews.
+
+Handlers go through these repositories instead of building query dicts against
+the global db, so batching and query tuning for each access pattern live in one
+place. MotorRepositories talks to MongoDB; InMemoryRepositories keeps documents
+in process dictionaries so endpoints can be tested and benchmarked without a
+mongod (select it with DATA_BACKEND=memory).
+"""
+import copy
+import re
+from collections import Counter
+from datetime import datetime, timezone
+from enum import Enum
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import ReplaceOne, ReturnDocument, UpdateOne # type: ignore
+from pymongo.errors import BulkWriteError # type: ignore
+
+
+# Shared access patterns, written once against the backend primitives
+class BaseRepository:
+    async def get(self, entity_id: str, projection: Optional[dict] = None) -> Optional[dict]:
+        return await self.find_one({"id": entity_id}, projection)
+
+    async def get_many(self, entity_ids, projection: Optional[dict] = None) -> Dict[str, dict]:
+        """Fetch many documents with one $in query, keyed by id"""
+        entity_ids = list(set(entity_ids))
+        if not entity_ids:
+            return {}
+        if projection is not None:
+            projection = {**projection, "id": 1}
+        documents = await self.find({"id": {"$in": entity_ids}}, projection, limit=len(entity_ids))
+        return {document["id"]: document for document in documents}
+
+
+class UsersQueries:
+    async def get_by_email(self, email: str) -> Optional[dict]:
+        return await self.find_one({"email": email})
+
+
+class CarsQueries:
+    async def list_available(self, location: Optional[str] = None, projection: Optional[dict] = None, limit: int = 1000) -> List[dict]:
+        query = {"is_available": True}
+        if location:
+            query["location"] = {"$regex": location, "$options": "i"}
+        return await self.find(query, projection, limit=limit)
+
+    async def list_by_host(self, host_id: str, include_deleted: bool = False, projection: Optional[dict] = None, limit: int = 1000) -> List[dict]:
+        query = {"host_id": host_id}
+        if not include_deleted:
+            query["deleted_at"] = None
+        return await self.find(query, projection, limit=limit)
+
+
+# Flat row shape of booking history exports; fields missing on a row are left out
+BOOKING_HISTORY_FIELDS = ["id", "status", "start_date", "end_date", "total_amount", "created_at", "host_id", "car_id", "user_id"]
+BOOKING_HISTORY_CAR_FIELDS = ["make", "model", "year", "location"]
+BOOKING_HISTORY_RENTER_FIELDS = ["name", "email"]
+
+
+def booking_history_row(booking: dict, car: Optional[dict], renter: Optional[dict]) -> dict:
+    row = {field: booking.get(field) for field in BOOKING_HISTORY_FIELDS}
+    row.update({f"car_{field}": (car or {}).get(field) for field in BOOKING_HISTORY_CAR_FIELDS})
+    row.update({f"renter_{field}": (renter or {}).get(field) for field in BOOKING_HISTORY_RENTER_FIELDS})
+    return row
+
+
+class BookingsQueries:
+    async def find_overlapping(self, car_id: str, start_date: datetime, end_date: datetime, statuses: List[str]) -> Optional[dict]:
+        """First booking in one of the given statuses whose dates overlap the range"""
+        return await self.find_one({
+            "car_id": car_id,
+            "status": {"$in": statuses},
+            "$or": [
+                {"start_date": {"$lte": end_date, "$gte": start_date}},
+                {"end_date": {"$lte": end_date, "$gte": start_date}},
+                {"start_date": {"$lte": start_date}, "end_date": {"$gte": end_date}}
+            ]
+        }, {"_id": 1, "id": 1})
+
+    async def has_booking_in(self, car_id: str, statuses: List[str]) -> bool:
+        return await self.count({"car_id": car_id, "status": {"$in": statuses}}, limit=1) > 0
+
+    async def cars_with_booking_in(self, car_ids, statuses: List[str]) -> set:
+        """Which of the given cars have a booking in one of the statuses, in one query"""
+        car_ids = list(set(car_ids))
+        if not car_ids:
+            return set()
+        bookings = await self.find(
+            {"car_id": {"$in": car_ids}, "status": {"$in": statuses}}, {"_id": 0, "car_id": 1}, limit=0
+        )
+        return {booking["car_id"] for booking in bookings}
+
+    async def list_by_user(self, user_id: str, projection: Optional[dict] = None, limit: int = 1000) -> List[dict]:
+        return await self.find({"user_id": user_id}, projection, limit=limit)
+
+    async def list_by_host(self, host_id: str, projection: Optional[dict] = None, limit: int = 1000) -> List[dict]:
+        return await self.find({"host_id": host_id}, projection, limit=limit)
+
+
+class ReviewsQueries:
+    async def list_by_car(self, car_id: str, sort: List[tuple], after: Optional[dict] = None, limit: int = 1000) -> List[dict]:
+        query = {"car_id": car_id}
+        if after:
+            query.update(after)
+        return await self.find(query, sort=sort, limit=limit)
+
+
+
+# MongoDB backend
+class MotorRepository(BaseRepository):
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def find_one(self, query: dict, projection: Optional[dict] = None) -> Optional[dict]:
+        return await self.collection.find_one(query, projection)
+
+    async def find(self, query: dict, projection: Optional[dict] = None, sort: Optional[List[tuple]] = None, limit: int = 1000) -> List[dict]:
+        cursor = self.collection.find(query, projection)
+        if sort:
+            cursor = cursor.sort(sort)
+        if limit:
+            cursor = cursor.limit(limit)
+        return await cursor.to_list(limit or None)
+
+    async def iter_find(self, query: dict, projection: Optional[dict] = None, sort: Optional[List[tuple]] = None, batch_size: int = 1000):
+        """Stream every match from one cursor, batch_size documents per round trip"""
+        async for document in self.collection.find(query, projection, sort=sort).batch_size(batch_size):
+            yield document
+
+    async def count(self, query: dict, limit: int = 0) -> int:
+        if limit:
+            return await self.collection.count_documents(query, limit=limit)
+        return await self.collection.count_documents(query)
+
+    async def insert(self, document: dict):
+        await self.collection.insert_one(document)
+
+    async def insert_many(self, documents: List[dict]) -> Tuple[int, List[tuple]]:
+        """Unordered insert; returns the inserted count and (index, message) for each failure"""
+        if not documents:
+            return 0, []
+        try:
+            result = await self.collection.insert_many(documents, ordered=False)
+            return len(result.inserted_ids), []
+        except BulkWriteError as e:
+            failures = [(error["index"], error.get("errmsg", "Insert failed")) for error in e.details.get("writeErrors", [])]
+            return e.details.get("nInserted", 0), failures
+
+    async def upsert_many(self, documents: List[dict], key: str = "id"):
+        if documents:
+            await self.collection.bulk_write(
+                [ReplaceOne({key: document[key]}, document, upsert=True) for document in documents],
+                ordered=False
+            )
+
+    async def update(self, query: dict, update: dict) -> Tuple[int, int]:
+        result = await self.collection.update_one(query, update)
+        return result.matched_count, result.modified_count
+
+    async def update_many(self, query: dict, update: dict) -> int:
+        result = await self.collection.update_many(query, update)
+        return result.modified_count
+
+    async def find_one_and_update(self, query: dict, update: dict, projection: Optional[dict] = None, return_new: bool = True) -> Optional[dict]:
+        """Atomically update the first match; returns it as written (or as it was), None if nothing matched"""
+        return await self.collection.find_one_and_update(
+            query, update, projection,
+            return_document=ReturnDocument.AFTER if return_new else ReturnDocument.BEFORE
+        )
+
+    async def bulk_update(self, operations: List[tuple]) -> int:
+        """Apply (query, update) pairs with one unordered bulk_write; returns the modified count"""
+        if not operations:
+            return 0
+        result = await self.collection.bulk_write(
+            [UpdateOne(query, update) for query, update in operations], ordered=False
+        )
+        return result.modified_count
+
+    async def delete(self, query: dict) -> int:
+        result = await self.collection.delete_one(query)
+        return result.deleted_count
+
+    async def delete_many(self, query: dict) -> int:
+        result = await self.collection.delete_many(query)
+        return result.deleted_count
+
+
+class MotorUsersRepository(UsersQueries, MotorRepository):
+    pass
+
+
+class MotorCarsRepository(CarsQueries, MotorRepository):
+    async def apply_review_rating(self, car_id: str, rating: int) -> bool:
+        """Fold one rating into the stored summary in a single round trip; False if no summary exists yet"""
+        result = await self.collection.update_one(
+            {"id": car_id, "rating_sum": {"$exists": True}},
+            [
+                {"$set": {
+                    f"rating_distribution.{rating}": {"$add": [{"$ifNull": [f"$rating_distribution.{rating}", 0]}, 1]},
+                    "total_reviews": {"$add": ["$total_reviews", 1]},
+                    "rating_sum": {"$add": ["$rating_sum", rating]},
+                }},
+                {"$set": {"average_rating": {"$round": [{"$divide": ["$rating_sum", "$total_reviews"]}, 1]}}},
+            ]
+        )
+        return result.matched_count > 0
+
+
+class MotorBookingsRepository(BookingsQueries, MotorRepository):
+    async def iter_history(self, query: dict, cars, users, batch_size: int = 1000):
+        """Stream bookings joined with car and renter fields, oldest first, from one aggregation cursor"""
+        pipeline = [
+            {"$match": query},
+            {"$sort": {"start_date": 1}},
+            {"$lookup": {"from": cars.collection.name, "localField": "car_id", "foreignField": "id", "as": "car"}},
+            {"$lookup": {"from": users.collection.name, "localField": "user_id", "foreignField": "id", "as": "renter"}},
+            {"$project": {
+                "_id": 0,
+                **{field: 1 for field in BOOKING_HISTORY_FIELDS},
+                **{f"car_{field}": {"$arrayElemAt": [f"$car.{field}", 0]} for field in BOOKING_HISTORY_CAR_FIELDS},
+                **{f"renter_{field}": {"$arrayElemAt": [f"$renter.{field}", 0]} for field in BOOKING_HISTORY_RENTER_FIELDS},
+            }},
+        ]
+        async for row in self.collection.aggregate(pipeline, allowDiskUse=True, batchSize=batch_size):
+            yield row
+
+
+class MotorReviewsRepository(ReviewsQueries, MotorRepository):
+    async def rating_counts(self, car_id: str) -> Dict[int, int]:
+        counts = await self.collection.aggregate([
+            {"$match": {"car_id": car_id}},
+            {"$group": {"_id": "$rating", "count": {"$sum": 1}}},
+        ]).to_list(None)
+        return {row["_id"]: row["count"] for row in counts}
+
+    async def list_for_cars(self, car_ids, cars, limit_per_car: int) -> Dict[str, List[dict]]:
+        """Newest reviews of many cars in one aggregation, at most limit_per_car each"""
+        grouped = {car_id: [] for car_id in car_ids}
+        if grouped:
+            # One bounded sub-query per car on the (car_id, created_at, id) index,
+            # so the work grows with the page size rather than with all reviews
+            rows = await cars.collection.aggregate([
+                {"$match": {"id": {"$in": list(grouped)}}},
+                {"$project": {"_id": 0, "id": 1}},
+                {"$lookup": {
+                    "from": self.collection.name,
+                    "let": {"car_id": "$id"},
+                    "pipeline": [
+                        {"$match": {"$expr": {"$eq": ["$car_id", "$$car_id"]}}},
+                        {"$sort": {"created_at": -1, "id": -1}},
+                        {"$limit": limit_per_car},
+                        {"$project": {"_id": 0}},
+                    ],
+                    "as": "reviews",
+                }},
+            ]).to_list(None)
+            for row in rows:
+                grouped[row["id"]] = row["reviews"]
+        return grouped
+
+
+# In-memory backend
+def to_storage(value):
+    """Mimic a BSON round trip: enums become their values, datetimes become naive UTC"""
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.replace(microsecond=value.microsecond // 1000 * 1000)
+    if isinstance(value, dict):
+        return {key: to_storage(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_storage(item) for item in value]
+    return value
+
+
+_MISSING = object()
+
+
+def get_path(document: dict, path: str):
+    value = document
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _compare(value, operator: str, argument) -> bool:
+    if value is _MISSING or value is None or argument is None:
+        return False
+    try:
+        if operator == "$lt":
+            return value < argument
+        if operator == "$lte":
+            return value <= argument
+        if operator == "$gt":
+            return value > argument
+        return value >= argument
+    except TypeError:
+        return False
+
+
+def _equals(value, expected) -> bool:
+    if expected is None:
+        return value is _MISSING or value is None
+    if isinstance(value, list) and not isinstance(expected, list):
+        return expected in value
+    return value is not _MISSING and value == expected
+
+
+def matches(document: dict, query: dict) -> bool:
+    """Evaluate the subset of MongoDB query syntax the repositories use"""
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(matches(document, clause) for clause in condition):
+                return False
+            continue
+        if key == "$and":
+            if not all(matches(document, clause) for clause in condition):
+                return False
+            continue
+
+        value = get_path(document, key)
+        condition = to_storage(condition)
+        if isinstance(condition, dict) and condition and all(operator.startswith("$") for operator in condition):
+            for operator, argument in condition.items():
+                if operator == "$in":
+                    if not any(_equals(value, item) for item in argument):
+                        return False
+                elif operator == "$nin":
+                    if any(_equals(value, item) for item in argument):
+                        return False
+                elif operator == "$ne":
+                    if _equals(value, argument):
+                        return False
+                elif operator in ("$lt", "$lte", "$gt", "$gte"):
+                    if not _compare(value, operator, argument):
+                        return False
+                elif operator == "$exists":
+                    if (value is not _MISSING) != bool(argument):
+                        return False
+                elif operator == "$regex":
+                    flags = re.IGNORECASE if "i" in condition.get("$options", "") else 0
+                    if not isinstance(value, str) or not re.search(argument, value, flags):
+                        return False
+                elif operator == "$options":
+                    continue
+                else:
+                    raise ValueError(f"Unsupported query operator: {operator}")
+        elif not _equals(value, condition):
+            return False
+    return True
+
+
+def project(document: dict, projection: Optional[dict]) -> dict:
+    document = copy.deepcopy(document)
+    if not projection:
+        return document
+    included = [field for field, flag in projection.items() if flag and field != "_id"]
+    if included:
+        return {field: document[field] for field in included if field in document}
+    return {field: value for field, value in document.items() if projection.get(field, 1)}
+
+
+def apply_update(document: dict, update: dict):
+    for field, value in update.get("$set", {}).items():
+        document[field] = to_storage(value)
+    for field in update.get("$unset", {}):
+        document.pop(field, None)
+    for field, amount in update.get("$inc", {}).items():
+        document[field] = document.get(field, 0) + amount
+
+
+class InMemoryRepository(BaseRepository):
+    def __init__(self):
+        self.documents: Dict[str, dict] = {}
+
+    def _matching(self, query: dict) -> List[dict]:
+        entity_id = query.get("id")
+        if isinstance(entity_id, str):
+            document = self.documents.get(entity_id)
+            return [document] if document is not None and matches(document, query) else []
+        return [document for document in self.documents.values() if matches(document, query)]
+
+    async def find_one(self, query: dict, projection: Optional[dict] = None) -> Optional[dict]:
+        found = self._matching(query)
+        return project(found[0], projection) if found else None
+
+    async def find(self, query: dict, projection: Optional[dict] = None, sort: Optional[List[tuple]] = None, limit: int = 1000) -> List[dict]:
+        found = self._matching(query)
+        for field, direction in reversed(sort or []):
+            found.sort(
+                key=lambda document: (document.get(field) is not None, document.get(field)),
+                reverse=direction < 0
+            )
+        if limit:
+            found = found[:limit]
+        return [project(document, projection) for document in found]
+
+    async def iter_find(self, query: dict, projection: Optional[dict] = None, sort: Optional[List[tuple]] = None, batch_size: int = 1000):
+        for document in await self.find(query, projection, sort, limit=0):
+            yield document
+
+    async def count(self, query: dict, limit: int = 0) -> int:
+        total = len(self._matching(query))
+        return min(total, limit) if limit else total
+
+    async def insert(self, document: dict):
+        document = to_storage(document)
+        if document["id"] in self.documents:
+            raise ValueError(f"Duplicate id: {document['id']}")
+        self.documents[document["id"]] = document
+
+    async def insert_many(self, documents: List[dict]) -> Tuple[int, List[tuple]]:
+        inserted, failures = 0, []
+        for index, document in enumerate(documents):
+            try:
+                await self.insert(document)
+                inserted += 1
+            except ValueError as e:
+                failures.append((index, str(e)))
+        return inserted, failures
+
+    async def upsert_many(self, documents: List[dict], key: str = "id"):
+        for document in documents:
+            self.documents[document[key]] = to_storage(document)
+
+    async def update(self, query: dict, update: dict) -> Tuple[int, int]:
+        found = self._matching(query)
+        if not found:
+            return 0, 0
+        before = copy.deepcopy(found[0])
+        apply_update(found[0], update)
+        return 1, int(found[0] != before)
+
+    async def update_many(self, query: dict, update: dict) -> int:
+        modified = 0
+        for document in self._matching(query):
+            before = copy.deepcopy(document)
+            apply_update(document, update)
+            modified += document != before
+        return modified
+
+    async def find_one_and_update(self, query: dict, update: dict, projection: Optional[dict] = None, return_new: bool = True) -> Optional[dict]:
+        found = self._matching(query)
+        if not found:
+            return None
+        before = project(found[0], projection)
+        apply_update(found[0], update)
+        return project(found[0], projection) if return_new else before
+
+    async def bulk_update(self, operations: List[tuple]) -> int:
+        modified = 0
+        for query, update in operations:
+            modified += (await self.update(query, update))[1]
+        return modified
+
+    async def delete(self, query: dict) -> int:
+        found = self._matching(query)
+        if not found:
+            return 0
+        del self.documents[found[0]["id"]]
+        return 1
+
+    async def delete_many(self, query: dict) -> int:
+        found = self._matching(query)
+        for document in found:
+            del self.documents[document["id"]]
+        return len(found)
+
+
+class InMemoryUsersRepository(UsersQueries, InMemoryRepository):
+    pass
+
+
+class InMemoryCarsRepository(CarsQueries, InMemoryRepository):
+    async def apply_review_rating(self, car_id: str, rating: int) -> bool:
+        car = self.documents.get(car_id)
+        if car is None or "rating_sum" not in car:
+            return False
+        distribution = car.setdefault("rating_distribution", {})
+        distribution[str(rating)] = distribution.get(str(rating), 0) + 1
+        car["total_reviews"] = car.get("total_reviews", 0) + 1
+        car["rating_sum"] += rating
+        car["average_rating"] = round(car["rating_sum"] / car["total_reviews"], 1)
+        return True
+
+
+class InMemoryBookingsRepository(BookingsQueries, InMemoryRepository):
+    async def iter_history(self, query: dict, cars, users, batch_size: int = 1000):
+        bookings = await self.find(query, sort=[("start_date", 1)], limit=0)
+        for i in range(0, len(bookings), batch_size):
+            batch = bookings[i:i + batch_size]
+            car_map = await cars.get_many([booking["car_id"] for booking in batch])
+            user_map = await users.get_many([booking["user_id"] for booking in batch])
+            for booking in batch:
+                yield booking_history_row(booking, car_map.get(booking["car_id"]), user_map.get(booking["user_id"]))
+
+
+class InMemoryReviewsRepository(ReviewsQueries, InMemoryRepository):
+    async def rating_counts(self, car_id: str) -> Dict[int, int]:
+        return dict(Counter(review["rating"] for review in self._matching({"car_id": car_id})))
+
+    async def list_for_cars(self, car_ids, cars, limit_per_car: int) -> Dict[str, List[dict]]:
+        grouped = {car_id: [] for car_id in car_ids}
+        if grouped:
+            reviews = await self.find({"car_id": {"$in": list(grouped)}}, sort=[("created_at", -1), ("id", -1)], limit=0)
+            for review in reviews:
+                if len(grouped[review["car_id"]]) < limit_per_car:
+                    grouped[review["car_id"]].append(review)
+        return grouped
+
+
+class Repositories:
+    def __init__(self, users, cars, bookings, bookings_archive, reviews, persistent: bool):
+        self.users = users
+        self.cars = cars
+        self.bookings = bookings
+        self.bookings_archive = bookings_archive
+        self.reviews = reviews
+        # Derived collections (rollups, calendars) and change streams only exist in MongoDB
+        self.persistent = persistent
+
+
+def create_repositories(backend: str, db=None) -> Repositories:
+    if backend == "memory":
+        return Repositories(
+            users=InMemoryUsersRepository(),
+            cars=InMemoryCarsRepository(),
+            bookings=InMemoryBookingsRepository(),
+            bookings_archive=InMemoryBookingsRepository(),
+            reviews=InMemoryReviewsRepository(),
+            persistent=False,
+        )
+    return Repositories(
+        users=MotorUsersRepository(db.users),
+        cars=MotorCarsRepository(db.cars),
+        bookings=MotorBookingsRepository(db.bookings),
+        bookings_archive=MotorBookingsRepository(db.bookings_archive),
+        reviews=MotorReviewsRepository(db.reviews),
+        persistent=True,
+    )
@@ -1,14 +1,16 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, BackgroundTasks # type: ignore
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials # type: ignore
-from fastapi.responses import Response # type: ignore
+from fastapi.responses import Response, StreamingResponse, JSONResponse # type: ignore
 from dotenv import load_dotenv # type: ignore
 from starlette.middleware.cors import CORSMiddleware # type: ignore
+from starlette.background import BackgroundTask # type: ignore
+from starlette.concurrency import run_in_threadpool # type: ignore
 from motor.motor_asyncio import AsyncIOMotorClient # type: ignore
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, EmailStr # type: ignore
-from typing import List, Optional
+from pydantic import BaseModel, Field, EmailStr, ValidationError # type: ignore
+from typing import Dict, List, Optional
 import uuid
 from datetime import datetime, timedelta, timezone
 import bcrypt # type: ignore
@@ -24,19 +26,129 @@ from reportlab.lib.units import inch # type: ignore
 import io
 import base64
 from bson import ObjectId # type: ignore
+from pymongo import CursorType, UpdateOne # type: ignore
+from pymongo.errors import CollectionInvalid, DuplicateKeyError, OperationFailure, PyMongoError # type: ignore
 from fastapi.encoders import jsonable_encoder # type: ignore
 
 from fastapi import Request
 import json
+import asyncio
+import csv
+import re
+import time
+import math
+import zlib
+import heapq
+import html
+from string import Formatter
+import gzip
+import random
+import hashlib
+import bisect
+import sys
+import threading
+import contextvars
+from collections import Counter
+from contextlib import contextmanager
+from pymongo import monitoring # type: ignore
+import numpy as np # type: ignore
+import pyarrow as pa # type: ignore
+import pyarrow.parquet as pq # type: ignore
+
+from repositories import create_repositories, BOOKING_HISTORY_FIELDS, BOOKING_HISTORY_CAR_FIELDS, BOOKING_HISTORY_RENTER_FIELDS
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Query Tracing
+# Every Mongo command is attributed to the request that issued it. Motor runs
+# pymongo on an executor with a copy of the caller's context, so the listener
+# sees the same RequestTrace the middleware created.
+QUERY_TRACE_LOG = os.getenv("QUERY_TRACE_LOG", "") == "1"
+QUERY_TRACE_WARN_THRESHOLD = int(os.getenv("QUERY_TRACE_WARN_THRESHOLD", "25"))
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", str(ROOT_DIR / "profiles")))
+PROFILE_INTERVAL_SECONDS = 0.005
+
+class RequestTrace:
+    def __init__(self):
+        self.commands = Counter()
+        self.pending: Dict[int, str] = {}
+        self.count = 0
+        self.failed = 0
+        self.duration_ms = 0.0
+
+current_trace: contextvars.ContextVar = contextvars.ContextVar("current_trace", default=None)
+
+class QueryTraceListener(monitoring.CommandListener):
+    def started(self, event):
+        trace = current_trace.get()
+        if trace is not None:
+            collection = event.command.get(event.command_name)
+            target = collection if isinstance(collection, str) else event.database_name
+            trace.pending[event.request_id] = f"{event.command_name} {target}"
+    
+    def _finish(self, event, failed: bool):
+        trace = current_trace.get()
+        if trace is None:
+            return
+        trace.commands[trace.pending.pop(event.request_id, event.command_name)] += 1
+        trace.count += 1
+        trace.failed += failed
+        trace.duration_ms += event.duration_micros / 1000
+    
+    def succeeded(self, event):
+        self._finish(event, False)
+    
+    def failed(self, event):
+        self._finish(event, True)
+
+class StackSampler:
+    """Samples one thread's Python stack on a timer and folds it for flame graphs"""
+    
+    def __init__(self, thread_id: int, interval: float = PROFILE_INTERVAL_SECONDS):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+    
+    def start(self):
+        self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+    
+    def write(self, path: Path):
+        """Write Brendan Gregg's folded format, ready for flamegraph.pl or speedscope"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as output:
+            for stack, count in self.samples.most_common():
+                output.write(f"{stack} {count}\n")
+
+query_trace_listener = QueryTraceListener()
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, event_listeners=[query_trace_listener])
 db = client[os.environ['DB_NAME']]
 
+# Data access: "mongo" (default) or "memory" to run without a mongod
+DATA_BACKEND = os.getenv("DATA_BACKEND", "mongo")
+repos = create_repositories(DATA_BACKEND, db)
+
 # Create the main app without a prefix
 app = FastAPI()
 
@@ -54,6 +166,322 @@ async def log_requests(request: Request, call_next):
     response = await call_next(request)
     return response
 
+@app.middleware("http")
+async def trace_queries(request: Request, call_next):
+    trace = RequestTrace()
+    token = current_trace.set(trace)
+    
+    # Opt-in sampling profile, e.g. curl -H "X-Profile: $PROFILE_TOKEN" ...
+    sampler = None
+    if PROFILE_TOKEN and secrets.compare_digest(request.headers.get("x-profile", ""), PROFILE_TOKEN):
+        sampler = StackSampler(threading.get_ident())
+        sampler.start()
+    
+    started = time.monotonic()
+    try:
+        response = await call_next(request)
+    finally:
+        current_trace.reset(token)
+        if sampler:
+            sampler.stop()
+    elapsed_ms = (time.monotonic() - started) * 1000
+    
+    response.headers["X-DB-Queries"] = str(trace.count)
+    response.headers["Server-Timing"] = f'db;dur={trace.duration_ms:.1f};desc="{trace.count} queries", app;dur={elapsed_ms:.1f}'
+    if sampler:
+        safe_path = re.sub(r"[^A-Za-z0-9]+", "_", request.url.path).strip("_")
+        profile_path = PROFILE_DIR / f"{int(time.time() * 1000)}_{request.method}_{safe_path}.folded"
+        sampler.write(profile_path)
+        response.headers["X-Profile-File"] = profile_path.name
+    
+    if QUERY_TRACE_LOG or trace.count >= QUERY_TRACE_WARN_THRESHOLD:
+        breakdown = ", ".join(f"{command} x{count}" for command, count in trace.commands.most_common(5))
+        logging.getLogger(__name__).log(
+            logging.WARNING if trace.count >= QUERY_TRACE_WARN_THRESHOLD else logging.INFO,
+            f"{request.method} {request.url.path}: {trace.count} queries in {trace.duration_ms:.1f}ms "
+            f"({elapsed_ms:.1f}ms total) - {breakdown}"
+        )
+    return response
+
+# Admission Control
+# Each route class gets its own concurrency limit and bounded wait queue, so a
+# flood of browsing or logins cannot starve booking traffic. Override with e.g.
+# ADMISSION_LIMITS="critical=16:64,auth=4:16,heavy=8:32,default=32:128"
+ADMISSION_LIMITS = os.getenv("ADMISSION_LIMITS", "critical=16:64,auth=4:16,heavy=8:32,default=32:128")
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "2"))
+ADMISSION_RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "1"))
+
+# First match wins; anything unmatched is "default"
+ADMISSION_ROUTE_CLASSES = [
+    ("POST", re.compile(r"^/api/bookings$"), "critical"),
+    ("PUT", re.compile(r"^/api/bookings/[^/]+/status$"), "critical"),
+    ("POST", re.compile(r"^/api/bookings/bulk-status$"), "critical"),
+    # Only the password-hashing routes; /auth/me runs on every page load and must not queue behind logins
+    ("POST", re.compile(r"^/api/auth/(login|register|reset-password|forgot-password)$"), "auth"),
+    ("GET", re.compile(r"^/api/cars$"), "heavy"),
+    ("GET", re.compile(r"^/api/bookings/[^/]+/receipt$"), "heavy"),
+    ("GET", re.compile(r"^/api/bookings/export$"), "heavy"),
+    ("POST", re.compile(r"^/api/cars/import$"), "heavy"),
+    ("POST", re.compile(r"^/api/cars/bulk$"), "heavy"),
+]
+
+# Long-lived streams would hold a slot for their whole lifetime
+ADMISSION_EXEMPT_PATHS = {"/api/bookings/events", "/api/metrics"}
+
+class AdmissionLimiter:
+    """Concurrency limit with a bounded, time-limited wait queue"""
+    
+    def __init__(self, name: str, concurrency: int, queue_size: int):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.waiting = 0
+        self.in_flight = 0
+        self.admitted = 0
+        self.shed = 0
+        self.queued = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+    
+    async def acquire(self, timeout: float) -> bool:
+        if not self.semaphore.locked():
+            await self.semaphore.acquire()
+        else:
+            if self.waiting >= self.queue_size:
+                self.shed += 1
+                return False
+            
+            self.waiting += 1
+            started = time.monotonic()
+            try:
+                await asyncio.wait_for(self.semaphore.acquire(), timeout)
+            except asyncio.TimeoutError:
+                self.shed += 1
+                return False
+            finally:
+                self.waiting -= 1
+            
+            # Only admitted requests count towards queue wait; shed ones are in shed
+            waited = time.monotonic() - started
+            self.queued += 1
+            self.queue_wait_total += waited
+            self.queue_wait_max = max(self.queue_wait_max, waited)
+        
+        self.in_flight += 1
+        self.admitted += 1
+        return True
+    
+    def release(self):
+        self.in_flight -= 1
+        self.semaphore.release()
+    
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "queue_size": self.queue_size,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "queued": self.queued,
+            "queue_wait_avg_ms": round(self.queue_wait_total / self.queued * 1000, 2) if self.queued else 0.0,
+            "queue_wait_max_ms": round(self.queue_wait_max * 1000, 2),
+        }
+
+def parse_admission_limits(spec: str) -> Dict[str, AdmissionLimiter]:
+    limiters = {}
+    for entry in spec.split(","):
+        if not entry.strip():
+            continue
+        name, limits = entry.strip().split("=")
+        concurrency, queue_size = limits.split(":")
+        limiters[name] = AdmissionLimiter(name, int(concurrency), int(queue_size))
+    limiters.setdefault("default", AdmissionLimiter("default", 32, 128))
+    return limiters
+
+admission_limiters = parse_admission_limits(ADMISSION_LIMITS)
+
+def classify_route(method: str, path: str) -> str:
+    for route_method, pattern, route_class in ADMISSION_ROUTE_CLASSES:
+        if route_method in ("*", method) and pattern.match(path):
+            return route_class if route_class in admission_limiters else "default"
+    return "default"
+
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    path = request.url.path
+    if request.method == "OPTIONS" or path in ADMISSION_EXEMPT_PATHS:
+        return await call_next(request)
+    
+    limiter = admission_limiters[classify_route(request.method, path)]
+    if not await limiter.acquire(ADMISSION_QUEUE_TIMEOUT_SECONDS):
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "Server is busy, please retry shortly"},
+            headers={"Retry-After": str(ADMISSION_RETRY_AFTER_SECONDS)}
+        )
+    
+    try:
+        response = await call_next(request)
+    except BaseException:
+        limiter.release()
+        raise
+    
+    # Streamed bodies such as exports keep running after the handler returns, so the
+    # slot is held until the body is sent; the background task covers a client that
+    # disconnects before the body is ever read
+    released = False
+    def release_once():
+        nonlocal released
+        if not released:
+            released = True
+            limiter.release()
+    
+    body_iterator = response.body_iterator
+    async def body_then_release():
+        try:
+            async for chunk in body_iterator:
+                yield chunk
+        finally:
+            release_once()
+    
+    response.body_iterator = body_then_release()
+    response.background = BackgroundTask(release_once)
+    return response
+
+# Traffic Capture
+# Opt-in: with TRAFFIC_CAPTURE_FILE set, sampled API requests are appended to that file
+# as one JSON line each (gzip members when the name ends in .gz) for replay.py.
+# Credentials, personal details and image payloads are replaced before anything is written.
+TRAFFIC_CAPTURE_FILE = os.getenv("TRAFFIC_CAPTURE_FILE", "")
+TRAFFIC_CAPTURE_SAMPLE_RATE = float(os.getenv("TRAFFIC_CAPTURE_SAMPLE_RATE", "1.0"))
+TRAFFIC_CAPTURE_MAX_BODY_BYTES = int(os.getenv("TRAFFIC_CAPTURE_MAX_BODY_BYTES", "16384"))
+TRAFFIC_CAPTURE_FLUSH_SECONDS = float(os.getenv("TRAFFIC_CAPTURE_FLUSH_SECONDS", "2"))
+TRAFFIC_CAPTURE_BUFFER_LIMIT = 10000
+TRAFFIC_CAPTURE_SKIP_PATHS = {"/api/bookings/events", "/api/metrics"}
+
+# Values under these keys never leave the process; emails keep a stable, valid shape
+# so replayed registrations and logins still pass validation
+# One-time codes (otp, pin, code) and stream tickets are credentials too
+CAPTURE_SECRET_KEYS = re.compile(r"password|token|secret|authorization|license|card|cvv|(^|_)(otp|pin)$|code|ticket", re.IGNORECASE)
+CAPTURE_PERSONAL_KEYS = re.compile(r"phone|address|birth|bio|name$", re.IGNORECASE)
+CAPTURE_IMAGE_KEYS = re.compile(r"image|photo|avatar|picture", re.IGNORECASE)
+CAPTURE_MAX_STRING = 256
+
+def sanitize_captured(value, key: str = ""):
+    """Copy of a request body or query value that is safe to write to disk"""
+    if isinstance(value, dict):
+        return {k: sanitize_captured(v, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [sanitize_captured(v, key) for v in value]
+    # Codes may be sent as numbers
+    if CAPTURE_SECRET_KEYS.search(key):
+        return "redacted"
+    if not isinstance(value, str):
+        return value
+    if key.lower() == "email" or key.lower().endswith("_email"):
+        digest = hashlib.sha256(value.lower().encode()).hexdigest()[:12]
+        return f"user-{digest}@example.com"
+    if CAPTURE_PERSONAL_KEYS.search(key):
+        return "redacted"
+    if CAPTURE_IMAGE_KEYS.search(key) or len(value) > CAPTURE_MAX_STRING:
+        return f"<{len(value)} chars>"
+    return value
+
+class TrafficRecorder:
+    """Buffers captured request shapes and appends them to the capture file"""
+    
+    def __init__(self, path: str):
+        self.path = Path(path) if path else None
+        self.buffer: List[dict] = []
+        self.recorded = 0
+        self.dropped = 0
+        self.written = 0
+    
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+    
+    def record(self, entry: dict):
+        if len(self.buffer) >= TRAFFIC_CAPTURE_BUFFER_LIMIT:
+            self.dropped += 1
+            return
+        self.buffer.append(entry)
+        self.recorded += 1
+    
+    def _write(self, entries: List[dict]):
+        payload = "".join(json.dumps(entry, separators=(",", ":"), default=str) + "\n" for entry in entries).encode()
+        if self.path.suffix == ".gz":
+            payload = gzip.compress(payload)
+        # One append per flush keeps lines from concurrent workers intact
+        with open(self.path, "ab") as f:
+            f.write(payload)
+    
+    async def flush(self):
+        if not self.buffer:
+            return
+        entries, self.buffer = self.buffer, []
+        await asyncio.to_thread(self._write, entries)
+        self.written += len(entries)
+    
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "file": str(self.path) if self.path else None,
+            "recorded": self.recorded,
+            "written": self.written,
+            "buffered": len(self.buffer),
+            "dropped": self.dropped,
+        }
+
+traffic_recorder = TrafficRecorder(TRAFFIC_CAPTURE_FILE)
+
+async def traffic_capture_loop():
+    while True:
+        await asyncio.sleep(TRAFFIC_CAPTURE_FLUSH_SECONDS)
+        try:
+            await traffic_recorder.flush()
+        except OSError as e:
+            print(f"Traffic capture flush failed: {str(e)}")
+
+@app.middleware("http")
+async def capture_traffic(request: Request, call_next):
+    path = request.url.path
+    if (
+        not traffic_recorder.enabled
+        or not path.startswith("/api/")
+        or path in TRAFFIC_CAPTURE_SKIP_PATHS
+        or request.method == "OPTIONS"
+        or random.random() >= TRAFFIC_CAPTURE_SAMPLE_RATE
+    ):
+        return await call_next(request)
+    
+    entry = {"ts": round(time.time(), 3), "m": request.method, "p": path}
+    if request.query_params:
+        entry["q"] = [[k, sanitize_captured(v, k)] for k, v in request.query_params.multi_items()]
+    if "authorization" in request.headers:
+        entry["a"] = 1
+    
+    # Only small JSON bodies are kept; anything else (uploads, images) is recorded by size
+    body_length = int(request.headers.get("content-length") or 0)
+    if body_length:
+        entry["bl"] = body_length
+        if body_length <= TRAFFIC_CAPTURE_MAX_BODY_BYTES and request.headers.get("content-type", "").startswith("application/json"):
+            try:
+                entry["b"] = sanitize_captured(json.loads(await request.body()))
+            except ValueError:
+                pass
+    
+    started = time.monotonic()
+    response = await call_next(request)
+    entry["d"] = round((time.monotonic() - started) * 1000, 2)
+    entry["s"] = response.status_code
+    route = request.scope.get("route")
+    entry["r"] = getattr(route, "path", path)
+    traffic_recorder.record(entry)
+    return response
+
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
@@ -86,6 +514,115 @@ EMAIL_USER = os.getenv("EMAIL_USER", "")
 EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD", "")
 EMAIL_FROM = os.getenv("EMAIL_FROM", "Rental <" + EMAIL_USER + ">")
 
+# Booking Archive Configuration
+LIVE_BOOKING_STATUSES = ["pending", "confirmed", "active"]
+TERMINAL_BOOKING_STATUSES = ["completed", "cancelled"]
+BOOKING_ARCHIVE_AFTER_DAYS = int(os.getenv("BOOKING_ARCHIVE_AFTER_DAYS", "180"))
+BOOKING_ARCHIVE_INTERVAL_HOURS = float(os.getenv("BOOKING_ARCHIVE_INTERVAL_HOURS", "24"))
+BOOKING_ARCHIVE_BATCH_SIZE = 500
+
+# Car Import Configuration
+CAR_IMPORT_BATCH_SIZE = 500
+CAR_IMPORT_MAX_ROWS = 10000
+CAR_IMPORT_MAX_ERRORS = 1000
+# Longest line, or quoted field spanning lines, kept in memory while parsing
+CAR_IMPORT_MAX_RECORD_BYTES = 64 * 1024
+
+# Booking Events Configuration
+# "auto" uses Mongo change streams when the deployment is a replica set and
+# falls back to in-process pub/sub otherwise
+BOOKING_EVENTS_SOURCE = os.getenv("BOOKING_EVENTS_SOURCE", "auto")
+BOOKING_EVENTS_HEARTBEAT_SECONDS = 15
+BOOKING_EVENTS_QUEUE_SIZE = 100
+# EventSource cannot send headers, so streams are opened with a single-use ticket
+# in the query string instead of the long-lived access token
+STREAM_TICKET_TTL_SECONDS = int(os.getenv("STREAM_TICKET_TTL_SECONDS", "30"))
+
+# Pricing Configuration
+# Rules apply to every car on top of its price_per_day. Supported types:
+#   weekend      - multiplier for the listed weekdays (Monday is 0)
+#   season       - multiplier between two MM-DD dates, inclusive, may wrap the new year
+#   long_rental  - discount off the whole rental once it reaches min_days (best one wins)
+# Override with a JSON list in PRICING_RULES.
+DEFAULT_PRICING_RULES = [
+    {"type": "weekend", "days": [4, 5], "multiplier": 1.1},
+    {"type": "long_rental", "min_days": 7, "discount": 0.10},
+    {"type": "long_rental", "min_days": 28, "discount": 0.20},
+]
+PRICING_RULES = json.loads(os.getenv("PRICING_RULES", "null")) or DEFAULT_PRICING_RULES
+QUOTE_TOLERANCE = 0.01
+MAX_QUOTE_DAYS = 366
+MAX_QUOTE_CARS = 1000
+
+# Car Index Configuration
+# In-process indexes over available cars are built at startup and updated on every
+# car write; other workers' writes arrive over the invalidation bus, and a full
+# rebuild on this interval is the safety net for anything the bus missed
+CAR_INDEX_REFRESH_MINUTES = float(os.getenv("CAR_INDEX_REFRESH_MINUTES", "60"))
+SIMILARITY_DIMENSIONS = 64
+SEARCH_FIELD_WEIGHTS = {"make": 3.0, "model": 3.0, "features": 2.0, "description": 1.0}
+SEARCH_PAGE_SIZE = 20
+AUTOCOMPLETE_LIMIT = 8
+
+# Sparse Fieldsets
+# view=card is what list pages render; view=detail (the default) is the full document
+CAR_VIEWS = {
+    "card": ["id", "make", "model", "year", "price_per_day", "image_url", "location", "average_rating", "total_reviews"],
+}
+CAR_EMBEDDED_FIELDS = {"reviews", "reviews_next_cursor", "quote"}
+BOOKING_VIEWS = {
+    "card": ["id", "car_id", "start_date", "end_date", "status", "total_amount", "created_at", "car", "host", "user"],
+}
+BOOKING_EMBEDDED_FIELDS = {"car", "host", "user"}
+BOOKING_CAR_FIELDS = ["id", "brand", "model", "make", "year", "price_per_day", "location", "image_url"]
+AUTOCOMPLETE_MAX_SCAN = 2000
+MAX_SEARCH_PAGE_SIZE = 100
+MAX_SIMILAR_CARS = 20
+
+# Trending Configuration
+# Views, bookings and reviews are counted in hourly buckets; leaderboards rank
+# cars by a weighted sum over the last TRENDING_WINDOW_HOURS and are rebuilt
+# every TRENDING_REFRESH_SECONDS
+TRENDING_WINDOW_HOURS = int(os.getenv("TRENDING_WINDOW_HOURS", "168"))
+TRENDING_REFRESH_SECONDS = int(os.getenv("TRENDING_REFRESH_SECONDS", "30"))
+TRENDING_BOARD_SIZE = 50
+TRENDING_WEIGHTS = {"bookings": 5.0, "views": 0.1, "rating_sum": 0.5}
+
+# Booking Export Configuration
+# Rows are read, encoded and flushed to the client this many at a time
+BOOKING_EXPORT_CHUNK_ROWS = int(os.getenv("BOOKING_EXPORT_CHUNK_ROWS", "5000"))
+
+# Fleet Operations Configuration
+# Upper bound on the cars or bookings a single bulk request may touch
+MAX_BULK_ITEMS = int(os.getenv("MAX_BULK_ITEMS", "1000"))
+
+# Cache Invalidation Configuration
+# Workers announce "entity changed" events in a capped collection and tail it to
+# evict their own in-process copies; the collection only has to cover the longest
+# expected pause of a worker, after which it resyncs from scratch
+INVALIDATION_COLLECTION = "invalidation_events"
+INVALIDATION_CAPPED_BYTES = int(os.getenv("INVALIDATION_CAPPED_BYTES", str(16 * 1024 * 1024)))
+INVALIDATION_CAPPED_DOCS = int(os.getenv("INVALIDATION_CAPPED_DOCS", "50000"))
+INVALIDATION_MAX_IDS = 1000
+
+# Request Coalescing Configuration
+# Identical car reads that arrive while one is already running wait for its result
+# instead of querying again; set COALESCE_READS=0 to compare against uncoalesced reads
+COALESCE_READS = os.getenv("COALESCE_READS", "1") != "0"
+
+# Metrics Configuration
+# GET /api/metrics is operator-only: it needs X-Metrics-Token matching METRICS_TOKEN
+# and is disabled while it is unset
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# Campaign Configuration
+# Campaign routes are operator-only: they need X-Campaign-Token matching CAMPAIGN_TOKEN
+# and are disabled while it is unset. Recipients are read and sent CAMPAIGN_BATCH_SIZE at a time.
+CAMPAIGN_TOKEN = os.getenv("CAMPAIGN_TOKEN", "")
+CAMPAIGN_BATCH_SIZE = int(os.getenv("CAMPAIGN_BATCH_SIZE", "500"))
+CAMPAIGN_SEND_RATE = float(os.getenv("CAMPAIGN_SEND_RATE", "50"))
+CAMPAIGN_MAX_SEND_RATE = float(os.getenv("CAMPAIGN_MAX_SEND_RATE", "1000"))
+
 # Pydantic Models
 class UserCreate(BaseModel):
     email: EmailStr
@@ -158,6 +695,41 @@ class Car(BaseModel):
     deleted_at: Optional[datetime] = None  
     average_rating: float = 0.0
     total_reviews: int = 0
+    rating_distribution: Dict[str, int] = Field(default_factory=dict)
+
+class CarBulkUpdate(BaseModel):
+    # Target either explicit ids or every car of the host at a location
+    car_ids: Optional[List[str]] = None
+    location: Optional[str] = None
+    price_per_day: Optional[float] = None
+    price_multiplier: Optional[float] = None
+    is_available: Optional[bool] = None
+
+class CampaignSegment(str, Enum):
+    HOSTS_IN_LOCATION = "hosts_in_location"
+    USERS_WITH_UPCOMING_BOOKINGS = "users_with_upcoming_bookings"
+
+class CampaignCreate(BaseModel):
+    # Templates may use {name}, {first_name} and {email}; use {{ and }} for literal braces
+    subject: str
+    html_template: str
+    text_template: Optional[str] = None
+    segment: CampaignSegment
+    location: Optional[str] = None
+    rate_per_second: Optional[float] = None
+
+class BookingExportFormat(str, Enum):
+    CSV = "csv"
+    PARQUET = "parquet"
+
+class CarImportFormat(str, Enum):
+    CSV = "csv"
+    NDJSON = "ndjson"
+
+class QuoteRequest(BaseModel):
+    car_ids: List[str]
+    start_date: datetime
+    end_date: datetime
 
 class BookingCreate(BaseModel):
     car_id: str
@@ -183,6 +755,15 @@ class Booking(BaseModel):
 class BookingUpdate(BaseModel):
     status: BookingStatus
 
+class BookingBulkStatusUpdate(BaseModel):
+    status: BookingStatus
+    # Target either explicit ids or the host's bookings in current_status,
+    # optionally only those starting in [start_from, start_to)
+    booking_ids: Optional[List[str]] = None
+    current_status: Optional[BookingStatus] = None
+    start_from: Optional[datetime] = None
+    start_to: Optional[datetime] = None
+
 class ReviewCreate(BaseModel):
     car_id: str
     booking_id: str
@@ -196,6 +777,7 @@ class Review(BaseModel):
     booking_id: str
     rating: int
     comment: str
+    user_name: Optional[str] = None  # Denormalized reviewer display name
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class RoleChangeRequest(BaseModel):
@@ -224,6 +806,27 @@ def generate_otp() -> str:
     return str(secrets.randbelow(1000000)).zfill(6)
 
 # Email Functions
+smtp_batch = threading.local()
+
+def open_smtp_connection() -> smtplib.SMTP:
+    server = smtplib.SMTP(EMAIL_HOST, EMAIL_PORT)
+    server.starttls()
+    server.login(EMAIL_USER, EMAIL_PASSWORD)
+    return server
+
+@contextmanager
+def email_batch():
+    """Send every send_email() call in this block over one SMTP connection"""
+    smtp_batch.server = open_smtp_connection()
+    try:
+        yield
+    finally:
+        server, smtp_batch.server = smtp_batch.server, None
+        try:
+            server.quit()
+        except smtplib.SMTPException:
+            pass
+
 def send_email(to_email: str, subject: str, html_content: str, text_content: str = None):
     """Send email using SMTP"""
     try:
@@ -242,12 +845,14 @@ def send_email(to_email: str, subject: str, html_content: str, text_content: str
             text_part = MIMEText(text_content, 'plain')
             msg.attach(text_part)
 
-        # Send the email
-        server = smtplib.SMTP(EMAIL_HOST, EMAIL_PORT)
-        server.starttls()
-        server.login(EMAIL_USER, EMAIL_PASSWORD)
-        server.send_message(msg)
-        server.quit()
+        # Send the email, reusing the batch connection when inside email_batch()
+        server = getattr(smtp_batch, "server", None)
+        if server is not None:
+            server.send_message(msg)
+        else:
+            server = open_smtp_connection()
+            server.send_message(msg)
+            server.quit()
         
         print(f"Email sent successfully to {to_email}")
         return True
@@ -463,6 +1068,15 @@ def send_thank_you_email(user_email: str, user_name: str, car_details: dict):
     
     return send_email(user_email, subject, html_content)
 
+def send_thank_you_emails(recipients: List[tuple]):
+    """Send thank-you emails for many completed bookings over a single SMTP connection"""
+    try:
+        with email_batch():
+            for user_email, user_name, car_details in recipients:
+                send_thank_you_email(user_email, user_name, car_details)
+    except Exception as e:
+        print(f"Failed to send {len(recipients)} thank-you emails: {str(e)}")
+
 def send_password_reset_email(user_email: str, user_name: str, otp: str):
     """Send password reset OTP email"""
     subject = "CarShare - Password Reset OTP"
@@ -648,141 +1262,1767 @@ def generate_booking_receipt(booking_data: dict, user_data: dict, car_data: dict
     
     buffer.seek(0)
     return buffer.read()
-# Helper Functions
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+# Host Analytics Rollups
+def booking_rental_days(booking: dict) -> int:
+    """Number of billable days for a booking, counted the same way as the receipt"""
+    start_date = parse_date(booking["start_date"])
+    end_date = parse_date(booking["end_date"])
+    return max((end_date - start_date).days + 1, 1)
 
-def verify_password(password: str, hashed: str) -> bool:
-    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+def booking_rollup_counters(booking: dict, booking_status: Optional[str]) -> dict:
+    """Counters a booking contributes to its host's daily rollup while in the given status"""
+    if booking_status is None:
+        return {"bookings": 0, "cancellations": 0, "completions": 0, "earnings": 0.0, "rental_days": 0}
+    
+    cancelled = booking_status == BookingStatus.CANCELLED
+    return {
+        "bookings": 1,
+        "cancellations": 1 if cancelled else 0,
+        "completions": 1 if booking_status == BookingStatus.COMPLETED else 0,
+        "earnings": 0.0 if cancelled else float(booking["total_amount"]),
+        "rental_days": 0 if cancelled else booking_rental_days(booking),
+    }
 
-def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
-    to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.now(timezone.utc) + expires_delta
-    else:
-        expire = datetime.now(timezone.utc) + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+def booking_rollup_key(booking: dict) -> dict:
+    """Rollup document key: bookings are attributed to the day the rental starts"""
+    return {
+        "host_id": booking["host_id"],
+        "car_id": booking["car_id"],
+        "day": parse_date(booking["start_date"]).strftime("%Y-%m-%d"),
+    }
 
-def generate_verification_token() -> str:
-    return secrets.token_urlsafe(32)
+def booking_rollup_update(booking: dict, old_status: Optional[str], new_status: Optional[str]) -> Optional[UpdateOne]:
+    """Build the $inc upsert that moves a booking from old_status to new_status in the rollup"""
+    old_counters = booking_rollup_counters(booking, old_status)
+    new_counters = booking_rollup_counters(booking, new_status)
+    increments = {
+        field: new_counters[field] - old_counters[field]
+        for field in new_counters
+        if new_counters[field] != old_counters[field]
+    }
+    if not increments:
+        return None
+    
+    key = booking_rollup_key(booking)
+    return UpdateOne(
+        key,
+        {"$inc": increments, "$setOnInsert": {"month": key["day"][:7]}},
+        upsert=True
+    )
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+async def update_host_rollup(booking: dict, old_status: Optional[str], new_status: Optional[str]):
+    """Incrementally apply a booking creation or status change to host_daily_rollups"""
+    await update_host_rollups([(booking, old_status, new_status)])
+
+async def update_host_rollups(changes: List[tuple]):
+    """Apply many (booking, old_status, new_status) changes with one bulk_write"""
+    if not repos.persistent:
+        return
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise HTTPException(status_code=401, detail="Invalid authentication credentials")
-    except jwt.PyJWTError:
-        raise HTTPException(status_code=401, detail="Invalid authentication credentials")
-    
-    user = await db.users.find_one({"id": user_id})
-    if user is None:
-        raise HTTPException(status_code=401, detail="User not found")
-    
-    user_obj = User(**user)
-    if not user_obj.is_verified:
-        raise HTTPException(status_code=403, detail="Email verification required")
-    
-    return user_obj
+        operations = [booking_rollup_update(*change) for change in changes]
+        operations = [operation for operation in operations if operation]
+        if operations:
+            await db.host_daily_rollups.bulk_write(operations, ordered=False)
+    except Exception as e:
+        # The rollup can always be rebuilt with `python manage.py backfill-rollups`
+        print(f"Failed to update host rollups for {len(changes)} bookings: {str(e)}")
 
-# Authentication Routes
-@api_router.post("/auth/register", response_model=dict)
-async def register(user_data: UserCreate, background_tasks: BackgroundTasks):
-    check_email_typos(user_data.email)
-    # Check if user exists
-    existing_user = await db.users.find_one({"email": user_data.email})
-    if existing_user:
-        raise HTTPException(status_code=400, detail="Email already registered")
+# Reviewer Names
+REVIEWER_NAME_BATCH_SIZE = 500
+
+reviewer_name_stats = {
+    "renames": 0,
+    "reviews_updated": 0,
+    "last_lag_seconds": 0.0,
+    "max_lag_seconds": 0.0,
+}
+
+async def attach_reviewer_names(reviews: List[dict]) -> List[dict]:
+    """Serialize reviews using their stored reviewer name"""
+    # Reviews written before names were denormalized are resolved with a
+    # single batched lookup instead of one query per review
+    missing_ids = {review["user_id"] for review in reviews if not review.get("user_name")}
+    names = {}
+    if missing_ids:
+        users = await repos.users.get_many(missing_ids, {"_id": 0, "name": 1})
+        names = {user_id: user["name"] for user_id, user in users.items()}
     
-    # Hash password and create user
-    hashed_password = hash_password(user_data.password)
-    verification_token = generate_verification_token()
+    review_list = []
+    for review in reviews:
+        review_dict = Review(**review).model_dump()
+        review_dict["user_name"] = review.get("user_name") or names.get(review["user_id"], "Anonymous")
+        review_list.append(review_dict)
+    return review_list
+
+async def propagate_reviewer_name(user_id: str, new_name: str, renamed_at: datetime):
+    """Fan a profile rename out to the user's reviews in batches"""
+    updated = 0
+    try:
+        while True:
+            batch = await repos.reviews.find(
+                {"user_id": user_id, "user_name": {"$ne": new_name}},
+                {"_id": 0, "id": 1},
+                limit=REVIEWER_NAME_BATCH_SIZE
+            )
+            if not batch:
+                break
+            
+            # Skip the write if a newer rename has landed since this job started
+            current = await repos.users.get(user_id, {"_id": 0, "name": 1})
+            if not current or current.get("name") != new_name:
+                return
+            
+            updated += await repos.reviews.update_many(
+                {"id": {"$in": [review["id"] for review in batch]}, "user_id": user_id},
+                {"$set": {"user_name": new_name}}
+            )
+            if len(batch) < REVIEWER_NAME_BATCH_SIZE:
+                break
+    except Exception as e:
+        print(f"Failed to propagate name change for user {user_id}: {str(e)}")
+        return
     
-    user = User(
-        email=user_data.email,
-        name=user_data.name,
-        role=user_data.role,
-        phone=user_data.phone,
-        is_verified=False,
-        verification_token=verification_token
-    )
+    lag = (datetime.now(timezone.utc) - renamed_at).total_seconds()
+    reviewer_name_stats["renames"] += 1
+    reviewer_name_stats["reviews_updated"] += updated
+    reviewer_name_stats["last_lag_seconds"] = lag
+    reviewer_name_stats["max_lag_seconds"] = max(reviewer_name_stats["max_lag_seconds"], lag)
+    print(f"Propagated name change for user {user_id} to {updated} reviews (lag {lag:.3f}s)")
+
+# Review Pagination
+REVIEW_PAGE_SIZE = 10
+MAX_REVIEW_PAGE_SIZE = 50
+
+class ReviewSort(str, Enum):
+    NEWEST = "newest"
+    RATING = "rating"
+
+def encode_review_cursor(review: dict) -> str:
+    """Opaque keyset cursor pointing just past the given review"""
+    payload = {
+        "r": review["rating"],
+        "c": parse_date(review["created_at"]).isoformat(),
+        "i": review["id"],
+    }
+    return base64.urlsafe_b64encode(json.dumps(payload).encode("utf-8")).decode("ascii")
+
+def decode_review_cursor(cursor: str) -> dict:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return {
+            "rating": int(payload["r"]),
+            "created_at": datetime.fromisoformat(payload["c"]),
+            "id": str(payload["i"]),
+        }
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid review cursor")
+
+async def fetch_review_page(car_id: str, sort: ReviewSort = ReviewSort.NEWEST, limit: int = REVIEW_PAGE_SIZE, cursor: Optional[str] = None) -> dict:
+    """Fetch one keyset-paginated page of a car's reviews"""
+    limit = max(1, min(limit, MAX_REVIEW_PAGE_SIZE))
+    after = None
     
-    user_dict = user.model_dump()
-    user_dict["password"] = hashed_password
+    if sort == ReviewSort.RATING:
+        order = [("rating", -1), ("created_at", -1), ("id", -1)]
+    else:
+        order = [("created_at", -1), ("id", -1)]
     
-    await db.users.insert_one(user_dict)
+    if cursor:
+        last = decode_review_cursor(cursor)
+        after_newest = [
+            {"created_at": {"$lt": last["created_at"]}},
+            {"created_at": last["created_at"], "id": {"$lt": last["id"]}},
+        ]
+        if sort == ReviewSort.RATING:
+            after = {"$or": [{"rating": {"$lt": last["rating"]}}] + [
+                {"rating": last["rating"], **condition} for condition in after_newest
+            ]}
+        else:
+            after = {"$or": after_newest}
     
-    # Send verification email in background
-    background_tasks.add_task(
-        send_verification_email,
-        user_data.email,
-        user_data.name,
-        verification_token
-    )
+    # Fetch one extra row to learn whether another page exists
+    reviews = await repos.reviews.list_by_car(car_id, order, after, limit=limit + 1)
+    has_more = len(reviews) > limit
+    reviews = reviews[:limit]
     
     return {
-        "message": "Registration successful! Please check your email to verify your account.",
-        "email": user_data.email
+        "reviews": await attach_reviewer_names(reviews),
+        "next_cursor": encode_review_cursor(reviews[-1]) if has_more else None,
     }
 
-@api_router.post("/auth/verify-email")
-async def verify_email(verification_data: EmailVerificationRequest, background_tasks: BackgroundTasks):
-    user = await db.users.find_one({"verification_token": verification_data.token})
-    if not user:
-        raise HTTPException(status_code=400, detail="Invalid or expired verification token")
-    
-    # Update user as verified
-    await db.users.update_one(
-        {"id": user["id"]},
-        {
-            "$set": {
-                "is_verified": True,
-                "verification_token": None
-            }
-        }
+def rating_summary(counts: Dict[int, int]) -> dict:
+    """Car rating fields for a {rating: number of reviews} histogram"""
+    total_reviews = sum(counts.values())
+    rating_sum = sum(rating * count for rating, count in counts.items())
+    return {
+        "rating_distribution": {str(rating): count for rating, count in counts.items()},
+        "rating_sum": rating_sum,
+        "total_reviews": total_reviews,
+        "average_rating": round(rating_sum / total_reviews, 1) if total_reviews else 0.0
+    }
+
+async def recompute_car_rating_summary(car_id: str):
+    """Rebuild a car's rating aggregates from its reviews"""
+    counts = await repos.reviews.rating_counts(car_id)
+    await repos.cars.update({"id": car_id}, {"$set": rating_summary(counts)})
+
+async def apply_review_to_car_summary(car_id: str, rating: int):
+    """Fold a new review into the car's stored rating aggregates in one round trip"""
+    # Cars created before the summary existed get it built from scratch once
+    if not await repos.cars.apply_review_rating(car_id, rating):
+        await recompute_car_rating_summary(car_id)
+
+# Booking Archive
+async def find_booking(query: dict) -> Optional[dict]:
+    """Find a booking in the hot collection, falling back to the archive"""
+    booking = await repos.bookings.find_one(query)
+    if booking is None:
+        booking = await repos.bookings_archive.find_one(query)
+    return booking
+
+async def find_bookings(query: dict, projection: Optional[dict] = None, length: int = 1000) -> List[dict]:
+    """Read booking history across the hot collection and the archive"""
+    hot, archived = await asyncio.gather(
+        repos.bookings.find(query, projection, limit=length),
+        repos.bookings_archive.find(query, projection, limit=length),
     )
+    return hot + archived
+
+async def archive_bookings(older_than_days: int = BOOKING_ARCHIVE_AFTER_DAYS, batch_size: int = BOOKING_ARCHIVE_BATCH_SIZE) -> int:
+    """Move completed and cancelled bookings that ended before the cutoff to bookings_archive"""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+    query = {"status": {"$in": TERMINAL_BOOKING_STATUSES}, "end_date": {"$lt": cutoff}}
+    archived = 0
     
-    # Send welcome email in background
-    background_tasks.add_task(
-        send_welcome_email,
-        user["email"],
-        user["name"],
-        user["role"]
-    )
+    while True:
+        batch = await repos.bookings.find(query, limit=batch_size)
+        if not batch:
+            break
+        
+        # Upsert first and delete second so an interrupted run can simply be repeated
+        await repos.bookings_archive.upsert_many(batch)
+        archived += await repos.bookings.delete_many({
+            "id": {"$in": [booking["id"] for booking in batch]},
+            "status": {"$in": TERMINAL_BOOKING_STATUSES}
+        })
+        if len(batch) < batch_size:
+            break
     
-    # Create access token
-    user_obj = User(**user)
-    user_obj.is_verified = True
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user_obj.id}, expires_delta=access_token_expires
-    )
+    return archived
+
+async def booking_archive_loop():
+    """Periodically move cold bookings out of the hot collection"""
+    while True:
+        try:
+            archived = await archive_bookings()
+            if archived:
+                print(f"Archived {archived} bookings older than {BOOKING_ARCHIVE_AFTER_DAYS} days")
+        except Exception as e:
+            print(f"Booking archive run failed: {str(e)}")
+        await asyncio.sleep(BOOKING_ARCHIVE_INTERVAL_HOURS * 3600)
+
+# Car Import
+def decode_import_line(line: bytes, first: bool):
+    """A line as text, or a ValueError the parsers report for that line"""
+    if len(line) > CAR_IMPORT_MAX_RECORD_BYTES:
+        return ValueError(f"Line is longer than {CAR_IMPORT_MAX_RECORD_BYTES} bytes")
+    # Spreadsheet exports often start with a UTF-8 byte order mark
+    if first and line.startswith(b"\xef\xbb\xbf"):
+        line = line[3:]
+    try:
+        return line.decode("utf-8").rstrip("\r")
+    except UnicodeDecodeError as e:
+        return ValueError(f"Line is not valid UTF-8 (byte {e.start + 1})")
+
+async def iter_request_lines(request: Request):
+    """Yield decoded lines from a streamed request body without buffering the whole file"""
+    buffer = b""
+    first = True
+    # Set while discarding the rest of a line already reported as too long
+    skipping = False
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if skipping:
+                skipping = False
+                continue
+            yield decode_import_line(line, first)
+            first = False
+        if len(buffer) > CAR_IMPORT_MAX_RECORD_BYTES:
+            if not skipping:
+                yield ValueError(f"Line is longer than {CAR_IMPORT_MAX_RECORD_BYTES} bytes")
+                first = False
+            skipping = True
+            buffer = b""
+    if buffer and not skipping:
+        yield decode_import_line(buffer, first)
+
+async def iter_csv_rows(lines):
+    """Parse CSV records from a line stream, allowing quoted fields that span lines"""
+    header = None
+    pending = ""
+    line_number = 0
+    record_start = 0
+    async for line in lines:
+        line_number += 1
+        if isinstance(line, Exception):
+            if header is None:
+                yield line_number, ValueError(f"Header row: {str(line)}")
+                return
+            # A record the bad line was part of cannot be parsed either
+            pending = ""
+            yield line_number, line
+            continue
+        if not pending:
+            record_start = line_number
+        pending = f"{pending}\n{line}" if pending else line
+        # An odd number of quotes means a quoted field continues on the next line
+        if pending.count('"') % 2:
+            if len(pending) > CAR_IMPORT_MAX_RECORD_BYTES:
+                pending = ""
+                yield record_start, ValueError(f"Quoted field is longer than {CAR_IMPORT_MAX_RECORD_BYTES} bytes")
+            continue
+        
+        record, pending = pending, ""
+        if not record.strip():
+            continue
+        values = next(csv.reader([record]))
+        if header is None:
+            header = [value.strip() for value in values]
+            continue
+        
+        row = dict(zip(header, values))
+        if isinstance(row.get("features"), str):
+            row["features"] = [feature.strip() for feature in row["features"].split(";") if feature.strip()]
+        yield record_start, row
     
-    return {
-        "message": "Email verified successfully! Welcome to CarShare!",
-        "access_token": access_token,
-        "token_type": "bearer",
-        "user": user_obj
-    }
+    if pending:
+        yield record_start, ValueError("Unterminated quoted field")
 
-@api_router.post("/auth/resend-verification")
-async def resend_verification(email_data: dict, background_tasks: BackgroundTasks):
-    email = email_data.get("email")
-    if not email:
-        raise HTTPException(status_code=400, detail="Email is required")
+async def iter_ndjson_rows(lines):
+    """Parse one JSON object per line"""
+    line_number = 0
+    async for line in lines:
+        line_number += 1
+        if isinstance(line, Exception):
+            yield line_number, line
+            continue
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_number, ValueError(f"Invalid JSON: {str(e)}")
+            continue
+        if not isinstance(row, dict):
+            yield line_number, ValueError("Each line must be a JSON object")
+            continue
+        yield line_number, row
+
+async def insert_car_batch(batch: List[tuple], report: dict):
+    """Insert validated cars with one unordered insert_many, recording per-row write errors"""
+    documents = [car.model_dump() for _, car in batch]
+    inserted, failures = await repos.cars.insert_many(documents)
+    report["inserted"] += inserted
+    failed = set()
+    for index, message in failures:
+        failed.add(index)
+        record_car_import_error(report, batch[index][0], message)
     
-    user = await db.users.find_one({"email": email})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+    index_cars([document for i, document in enumerate(documents) if i not in failed])
+
+def record_car_import_error(report: dict, row_number: int, message):
+    report["failed"] += 1
+    if len(report["errors"]) < CAR_IMPORT_MAX_ERRORS:
+        report["errors"].append({"row": row_number, "errors": message})
+
+# Booking Events
+BOOKING_EVENT_FIELDS = ["id", "user_id", "car_id", "host_id", "start_date", "end_date", "total_amount", "status", "created_at"]
+
+class BookingEventHub:
+    """In-process pub/sub that fans booking events out to connected users and hosts"""
+    
+    def __init__(self):
+        self.subscribers: Dict[str, set] = {}
+        self.source = "memory"
+        self.published = 0
+        self.dropped = 0
+    
+    def subscribe(self, user_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=BOOKING_EVENTS_QUEUE_SIZE)
+        self.subscribers.setdefault(user_id, set()).add(queue)
+        return queue
+    
+    def unsubscribe(self, user_id: str, queue: asyncio.Queue):
+        queues = self.subscribers.get(user_id)
+        if queues:
+            queues.discard(queue)
+            if not queues:
+                del self.subscribers[user_id]
+    
+    def publish(self, event_type: str, booking: dict):
+        # The driver license image never leaves the booking document
+        event = {
+            "type": event_type,
+            "booking": jsonable_encoder({field: booking.get(field) for field in BOOKING_EVENT_FIELDS}),
+        }
+        for user_id in {booking.get("user_id"), booking.get("host_id")}:
+            for queue in self.subscribers.get(user_id, ()):
+                try:
+                    queue.put_nowait(event)
+                    self.published += 1
+                except asyncio.QueueFull:
+                    # A stalled client loses events rather than growing memory
+                    self.dropped += 1
+
+booking_event_hub = BookingEventHub()
+
+def publish_booking_event(event_type: str, booking: dict):
+    """Publish from request handlers unless a change stream is already doing it"""
+    if booking_event_hub.source == "memory":
+        booking_event_hub.publish(event_type, booking)
+
+async def watch_booking_changes():
+    """Feed the event hub from a Mongo change stream so events cross worker boundaries"""
+    pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}}]
+    try:
+        async with db.bookings.watch(pipeline, full_document="updateLookup") as stream:
+            booking_event_hub.source = "change_stream"
+            print("Booking events: streaming from Mongo change stream")
+            async for change in stream:
+                booking = change.get("fullDocument")
+                if not booking:
+                    continue
+                if change["operationType"] == "insert":
+                    booking_event_hub.publish("booking.created", booking)
+                elif change["operationType"] == "replace" or "status" in change["updateDescription"]["updatedFields"]:
+                    booking_event_hub.publish("booking.status", booking)
+    except PyMongoError as e:
+        print(f"Booking events: change streams unavailable ({str(e)}), using in-process pub/sub")
+    finally:
+        booking_event_hub.source = "memory"
+
+# Price Quotes
+def as_utc(value: datetime) -> datetime:
+    """Timezone-aware UTC datetime; naive values are taken to already be UTC"""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+def quote_rental_days(start_date: datetime, end_date: datetime) -> int:
+    """Billable days, counted the way the booking form always has: partial days round up, plus one"""
+    seconds = (end_date - start_date).total_seconds()
+    if seconds < 0:
+        raise HTTPException(status_code=400, detail="End date must be after start date")
+    days = math.ceil(seconds / 86400) + 1
+    if days > MAX_QUOTE_DAYS:
+        raise HTTPException(status_code=400, detail=f"Rentals are limited to {MAX_QUOTE_DAYS} days")
+    return days
+
+def day_rate_multipliers(start_date: datetime, days: int) -> np.ndarray:
+    """Per-day price multipliers for the rental, one entry per billable day"""
+    first_day = np.datetime64(start_date.strftime("%Y-%m-%d"), "D")
+    dates = first_day + np.arange(days)
+    # 1970-01-01 was a Thursday, so shift by 3 to make Monday 0
+    weekdays = (dates.astype(np.int64) + 3) % 7
+    month_starts = dates.astype("datetime64[M]")
+    month_days = (month_starts.astype(np.int64) % 12 + 1) * 100 + (dates - month_starts.astype("datetime64[D]")).astype(np.int64) + 1
+    
+    multipliers = np.ones(days)
+    for rule in PRICING_RULES:
+        if rule["type"] == "weekend":
+            multipliers[np.isin(weekdays, rule["days"])] *= rule["multiplier"]
+        elif rule["type"] == "season":
+            season_start = int(rule["start"].replace("-", ""))
+            season_end = int(rule["end"].replace("-", ""))
+            if season_start <= season_end:
+                in_season = (month_days >= season_start) & (month_days <= season_end)
+            else:
+                in_season = (month_days >= season_start) | (month_days <= season_end)
+            multipliers[in_season] *= rule["multiplier"]
+    return multipliers
+
+def long_rental_discount(days: int) -> float:
+    return max(
+        (rule["discount"] for rule in PRICING_RULES if rule["type"] == "long_rental" and days >= rule["min_days"]),
+        default=0.0
+    )
+
+def quote_prices(prices_per_day: List[float], start_date: datetime, end_date: datetime) -> dict:
+    """Price any number of cars for the same dates in one vectorized pass"""
+    # Clients may send one date with an offset and one without
+    start_date, end_date = as_utc(start_date), as_utc(end_date)
+    days = quote_rental_days(start_date, end_date)
+    multipliers = day_rate_multipliers(start_date, days)
+    discount = long_rental_discount(days)
+    
+    # Rules are shared by every car, so each total is price_per_day times the same factor
+    prices = np.asarray(prices_per_day, dtype=np.float64)
+    subtotals = prices * days
+    totals = prices * multipliers.sum() * (1 - discount)
+    return {
+        "days": days,
+        "rate_factor": round(float(multipliers.sum()) / days, 4),
+        "discount": discount,
+        "subtotals": np.round(subtotals, 2).tolist(),
+        "totals": np.round(totals, 2).tolist(),
+    }
+
+def quote_car(car: dict, start_date: datetime, end_date: datetime) -> dict:
+    quote = quote_prices([car["price_per_day"]], start_date, end_date)
+    return {
+        "car_id": car["id"],
+        "price_per_day": car["price_per_day"],
+        "days": quote["days"],
+        "rate_factor": quote["rate_factor"],
+        "discount": quote["discount"],
+        "subtotal": quote["subtotals"][0],
+        "total": quote["totals"][0],
+    }
+
+# Availability Calendars
+# One document per car and year with fields m1..m12; bit (day - 1) of each month
+# field is set when any live booking touches that day. Completed and cancelled
+# bookings release their days, so the pre-check is never stricter than the
+# live-status query it stands in front of.
+CALENDAR_MONTH_MASK = 0x7FFFFFFF
+
+def booking_day_masks(start_date, end_date, interior_only: bool = False) -> Dict[tuple, int]:
+    """Month bitmaps for the days a booking touches, keyed by (year, month)"""
+    first_day = parse_date(start_date).date()
+    last_day = parse_date(end_date).date()
+    if interior_only:
+        # Days fully covered by the rental; anything already booked on them is a certain conflict
+        first_day += timedelta(days=1)
+        last_day -= timedelta(days=1)
+    
+    masks = {}
+    day = first_day
+    while day <= last_day:
+        key = (day.year, day.month)
+        masks[key] = masks.get(key, 0) | (1 << (day.day - 1))
+        day += timedelta(days=1)
+    return masks
+
+def calendar_bit_updates(car_id: str, masks: Dict[tuple, int], operation: str) -> List[UpdateOne]:
+    by_year = {}
+    for (year, month), mask in masks.items():
+        by_year.setdefault(year, {})[f"m{month}"] = {operation: mask}
+    return [
+        UpdateOne({"car_id": car_id, "year": year}, {"$bit": fields}, upsert=True)
+        for year, fields in by_year.items()
+    ]
+
+async def mark_calendar_days(booking: dict):
+    """Set the booked-day bits for a new or reinstated booking"""
+    if not repos.persistent:
+        return
+    try:
+        masks = booking_day_masks(booking["start_date"], booking["end_date"])
+        if masks:
+            await db.car_calendars.bulk_write(calendar_bit_updates(booking["car_id"], masks, "or"))
+    except Exception as e:
+        print(f"Failed to update calendar for booking {booking.get('id')}: {str(e)}")
+
+async def release_calendar_days(booking: dict):
+    """Clear the days of a booking that is no longer live, keeping any still covered by other bookings"""
+    if not repos.persistent:
+        return
+    try:
+        masks = booking_day_masks(booking["start_date"], booking["end_date"])
+        if not masks:
+            return
+        
+        # Another booking can share the first or last day, so rebuild those bits from what is still live
+        first_day = datetime.combine(parse_date(booking["start_date"]).date(), datetime.min.time())
+        last_day = datetime.combine(parse_date(booking["end_date"]).date(), datetime.max.time())
+        others = await repos.bookings.find({
+            "car_id": booking["car_id"],
+            "id": {"$ne": booking["id"]},
+            "status": {"$in": LIVE_BOOKING_STATUSES},
+            "start_date": {"$lte": last_day},
+            "end_date": {"$gte": first_day}
+        }, {"_id": 0, "start_date": 1, "end_date": 1}, limit=0)
+        
+        keep = {}
+        for other in others:
+            for key, mask in booking_day_masks(other["start_date"], other["end_date"]).items():
+                if key in masks:
+                    keep[key] = keep.get(key, 0) | (mask & masks[key])
+        
+        operations = calendar_bit_updates(
+            booking["car_id"], {key: ~mask & CALENDAR_MONTH_MASK for key, mask in masks.items()}, "and"
+        )
+        if keep:
+            operations += calendar_bit_updates(booking["car_id"], keep, "or")
+        await db.car_calendars.bulk_write(operations)
+    except Exception as e:
+        print(f"Failed to release calendar for booking {booking.get('id')}: {str(e)}")
+
+async def calendar_has_conflict(car_id: str, start_date: datetime, end_date: datetime) -> bool:
+    """Cheap pre-check: is any day fully covered by the request already booked?"""
+    masks = booking_day_masks(start_date, end_date, interior_only=True)
+    if not masks or not repos.persistent:
+        return False
+    
+    years = sorted({year for year, _ in masks})
+    calendars = await db.car_calendars.find({"car_id": car_id, "year": {"$in": years}}).to_list(len(years))
+    by_year = {calendar["year"]: calendar for calendar in calendars}
+    return any(
+        by_year.get(year, {}).get(f"m{month}", 0) & mask
+        for (year, month), mask in masks.items()
+    )
+
+def calendar_update_for(old_status: str, new_status: str):
+    """The calendar side effect of a status change: mark, release or nothing"""
+    was_live = old_status in LIVE_BOOKING_STATUSES
+    is_live = new_status in LIVE_BOOKING_STATUSES
+    if was_live and not is_live:
+        return release_calendar_days
+    if is_live and not was_live:
+        return mark_calendar_days
+    return None
+
+def bitmap_days(bitmap: int) -> List[int]:
+    return [day for day in range(1, 32) if bitmap & (1 << (day - 1))]
+
+# Car Indexes
+class CarSimilarityIndex:
+    """Dense feature vectors for every available car, held in one NumPy matrix"""
+    
+    def __init__(self, dimensions: int = SIMILARITY_DIMENSIONS):
+        self.dimensions = dimensions
+        self.matrix = np.zeros((0, dimensions), dtype=np.float32)
+        self.ids: List[Optional[str]] = []
+        self.rows: Dict[str, int] = {}
+        self.free_rows: List[int] = []
+    
+    def _slot(self, token: str) -> int:
+        # crc32 is stable across processes, unlike hash()
+        return zlib.crc32(token.encode("utf-8")) % self.dimensions
+    
+    def encode(self, car: dict) -> np.ndarray:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        
+        def add(token: str, weight: float):
+            vector[self._slot(token)] += weight
+        
+        make = str(car.get("make", "")).strip().lower()
+        model = str(car.get("model", "")).strip().lower()
+        add(f"make:{make}", 2.0)
+        add(f"model:{make}|{model}", 2.5)
+        add(f"location:{str(car.get('location', '')).strip().lower()}", 1.5)
+        
+        # Neighbouring year and price buckets get partial credit so "close" still scores
+        year_bucket = int(car.get("year") or 0) // 3
+        add(f"year:{year_bucket}", 1.0)
+        add(f"year:{year_bucket - 1}", 0.4)
+        add(f"year:{year_bucket + 1}", 0.4)
+        price_band = int(math.log2(max(float(car.get("price_per_day") or 1), 1)) * 2)
+        add(f"price:{price_band}", 1.5)
+        add(f"price:{price_band - 1}", 0.6)
+        add(f"price:{price_band + 1}", 0.6)
+        
+        features = [str(feature).strip().lower() for feature in car.get("features") or []]
+        for feature in features:
+            add(f"feature:{feature}", 1.0 / math.sqrt(len(features)))
+        add(f"rating:{round(float(car.get('average_rating') or 0))}", 0.5)
+        
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+    
+    def rebuild(self, cars: List[dict]):
+        matrix = np.zeros((max(len(cars), 1), self.dimensions), dtype=np.float32)
+        ids, rows = [], {}
+        for row, car in enumerate(cars):
+            matrix[row] = self.encode(car)
+            ids.append(car["id"])
+            rows[car["id"]] = row
+        self.matrix, self.ids, self.rows, self.free_rows = matrix, ids, rows, []
+    
+    def upsert(self, car: dict):
+        row = self.rows.get(car["id"])
+        if row is None:
+            if self.free_rows:
+                row = self.free_rows.pop()
+            else:
+                row = len(self.ids)
+                if row >= len(self.matrix):
+                    grown = np.zeros((max(len(self.matrix) * 2, 16), self.dimensions), dtype=np.float32)
+                    grown[:len(self.matrix)] = self.matrix
+                    self.matrix = grown
+                self.ids.append(None)
+            self.ids[row] = car["id"]
+            self.rows[car["id"]] = row
+        self.matrix[row] = self.encode(car)
+    
+    def remove(self, car_id: str):
+        row = self.rows.pop(car_id, None)
+        if row is not None:
+            self.matrix[row] = 0
+            self.ids[row] = None
+            self.free_rows.append(row)
+    
+    def similar(self, car_id: str, k: int) -> List[tuple]:
+        """Top-k cosine neighbours as (car_id, score), best first"""
+        row = self.rows.get(car_id)
+        if row is None:
+            return []
+        
+        # Rows are unit length, so one matrix-vector product gives every cosine similarity
+        used = len(self.ids)
+        scores = self.matrix[:used] @ self.matrix[row]
+        scores[row] = -np.inf
+        for free_row in self.free_rows:
+            scores[free_row] = -np.inf
+        
+        k = min(k, used - 1 - len(self.free_rows))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.ids[i], round(float(scores[i]), 4)) for i in top]
+
+similar_cars_index = CarSimilarityIndex()
+
+class CarSearchIndex:
+    """In-process inverted index over make, model, description and features, ranked with BM25"""
+    
+    TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+    K1 = 1.2
+    B = 0.75
+    
+    def __init__(self):
+        self.postings: Dict[str, Dict[str, float]] = {}
+        self.doc_terms: Dict[str, Dict[str, float]] = {}
+        self.doc_lengths: Dict[str, float] = {}
+        self.doc_meta: Dict[str, dict] = {}
+        self.total_length = 0.0
+    
+    @classmethod
+    def tokenize(cls, text: str) -> List[str]:
+        return cls.TOKEN_PATTERN.findall(str(text).lower())
+    
+    def _weighted_terms(self, car: dict) -> Dict[str, float]:
+        terms = {}
+        for field, weight in SEARCH_FIELD_WEIGHTS.items():
+            value = car.get(field) or ""
+            text = " ".join(value) if isinstance(value, list) else value
+            for token in self.tokenize(text):
+                terms[token] = terms.get(token, 0.0) + weight
+        return terms
+    
+    def rebuild(self, cars: List[dict]):
+        self.postings, self.doc_terms, self.doc_lengths, self.doc_meta = {}, {}, {}, {}
+        self.total_length = 0.0
+        for car in cars:
+            self.upsert(car)
+    
+    def upsert(self, car: dict):
+        self.remove(car["id"])
+        terms = self._weighted_terms(car)
+        for term, frequency in terms.items():
+            self.postings.setdefault(term, {})[car["id"]] = frequency
+        length = sum(terms.values())
+        self.doc_terms[car["id"]] = terms
+        self.doc_lengths[car["id"]] = length
+        self.total_length += length
+        self.doc_meta[car["id"]] = {
+            "make": str(car.get("make", "")).lower(),
+            "location": str(car.get("location", "")).lower(),
+            "price_per_day": float(car.get("price_per_day") or 0),
+            "year": int(car.get("year") or 0),
+        }
+    
+    def remove(self, car_id: str):
+        terms = self.doc_terms.pop(car_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(car_id, None)
+                if not posting:
+                    del self.postings[term]
+        self.total_length -= self.doc_lengths.pop(car_id, 0.0)
+        self.doc_meta.pop(car_id, None)
+    
+    def _matches(self, car_id: str, filters: dict) -> bool:
+        meta = self.doc_meta[car_id]
+        if filters.get("make") and meta["make"] != filters["make"].lower():
+            return False
+        if filters.get("location") and filters["location"].lower() not in meta["location"]:
+            return False
+        if filters.get("min_price") is not None and meta["price_per_day"] < filters["min_price"]:
+            return False
+        if filters.get("max_price") is not None and meta["price_per_day"] > filters["max_price"]:
+            return False
+        if filters.get("min_year") is not None and meta["year"] < filters["min_year"]:
+            return False
+        if filters.get("max_year") is not None and meta["year"] > filters["max_year"]:
+            return False
+        return True
+    
+    def search(self, query: str, filters: dict, offset: int, limit: int) -> tuple:
+        """Return (total matches, [(car_id, score)]) for one page of results"""
+        terms = set(self.tokenize(query))
+        document_count = len(self.doc_terms)
+        if not terms or not document_count:
+            return 0, []
+        
+        average_length = self.total_length / document_count
+        scores: Dict[str, float] = {}
+        for term in terms:
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (document_count - len(posting) + 0.5) / (len(posting) + 0.5))
+            for car_id, frequency in posting.items():
+                norm = self.K1 * (1 - self.B + self.B * self.doc_lengths[car_id] / average_length)
+                scores[car_id] = scores.get(car_id, 0.0) + idf * frequency * (self.K1 + 1) / (frequency + norm)
+        
+        matches = [(score, car_id) for car_id, score in scores.items() if self._matches(car_id, filters)]
+        page = heapq.nlargest(offset + limit, matches)[offset:]
+        return len(matches), [(car_id, round(score, 4)) for score, car_id in page]
+
+car_search_index = CarSearchIndex()
+
+class AutocompleteIndex:
+    """Sorted prefix keys for distinct locations, makes and models, weighted by listing count"""
+    
+    KINDS = ("location", "make", "model")
+    WORD_PATTERN = re.compile(r"[^\s,/-]+")
+    
+    def __init__(self):
+        self.keys: List[tuple] = []  # sorted (prefix key, kind, normalized value)
+        self.values: Dict[tuple, dict] = {}  # (kind, normalized value) -> display value and listing count
+        self.car_values: Dict[str, List[tuple]] = {}
+    
+    @staticmethod
+    def normalize(value: str) -> str:
+        return " ".join(str(value).lower().split())
+    
+    def _car_entries(self, car: dict) -> List[tuple]:
+        entries = []
+        for kind in self.KINDS:
+            display = " ".join(str(car.get(kind) or "").split())
+            if display:
+                entries.append((kind, self.normalize(display), display))
+        return entries
+    
+    def _value_keys(self, kind: str, normalized: str) -> List[tuple]:
+        # "austin, tx" is reachable from "aus" and from "tx"
+        starts = [match.start() for match in self.WORD_PATTERN.finditer(normalized)]
+        return [(normalized[start:], kind, normalized) for start in starts]
+    
+    def _add(self, kind: str, normalized: str, display: str):
+        entry = self.values.get((kind, normalized))
+        if entry:
+            entry["count"] += 1
+            return
+        self.values[(kind, normalized)] = {"value": display, "kind": kind, "count": 1}
+        for key in self._value_keys(kind, normalized):
+            bisect.insort(self.keys, key)
+    
+    def _discard(self, kind: str, normalized: str):
+        entry = self.values.get((kind, normalized))
+        if not entry:
+            return
+        entry["count"] -= 1
+        if entry["count"] > 0:
+            return
+        del self.values[(kind, normalized)]
+        for key in self._value_keys(kind, normalized):
+            position = bisect.bisect_left(self.keys, key)
+            if position < len(self.keys) and self.keys[position] == key:
+                del self.keys[position]
+    
+    def rebuild(self, cars: List[dict]):
+        self.keys, self.values, self.car_values = [], {}, {}
+        for car in cars:
+            entries = self._car_entries(car)
+            self.car_values[car["id"]] = [(kind, normalized) for kind, normalized, _ in entries]
+            for kind, normalized, display in entries:
+                entry = self.values.setdefault((kind, normalized), {"value": display, "kind": kind, "count": 0})
+                entry["count"] += 1
+        self.keys = sorted(
+            key for kind, normalized in self.values for key in self._value_keys(kind, normalized)
+        )
+    
+    def upsert(self, car: dict):
+        self.remove(car["id"])
+        entries = self._car_entries(car)
+        self.car_values[car["id"]] = [(kind, normalized) for kind, normalized, _ in entries]
+        for kind, normalized, display in entries:
+            self._add(kind, normalized, display)
+    
+    def remove(self, car_id: str):
+        for kind, normalized in self.car_values.pop(car_id, []):
+            self._discard(kind, normalized)
+    
+    def complete(self, prefix: str, kind: Optional[str] = None, limit: int = AUTOCOMPLETE_LIMIT) -> List[dict]:
+        prefix = self.normalize(prefix)
+        if not prefix:
+            return []
+        
+        candidates = {}
+        position = bisect.bisect_left(self.keys, (prefix,))
+        for key, key_kind, normalized in self.keys[position:position + AUTOCOMPLETE_MAX_SCAN]:
+            if not key.startswith(prefix):
+                break
+            if kind is None or key_kind == kind:
+                candidates[(key_kind, normalized)] = self.values[(key_kind, normalized)]
+        return heapq.nlargest(limit, candidates.values(), key=lambda entry: entry["count"])
+
+autocomplete_index = AutocompleteIndex()
+
+# Every in-process car index implements rebuild(cars), upsert(car) and remove(car_id)
+car_indexes = [similar_cars_index, car_search_index, autocomplete_index]
+
+def apply_car_index_updates(cars: List[dict]):
+    """Add or refresh cars in every in-process index; unavailable cars are dropped"""
+    for car in cars:
+        for index in car_indexes:
+            if car.get("is_available", True) and not car.get("deleted_at"):
+                index.upsert(car)
+            else:
+                index.remove(car["id"])
+
+def index_cars(cars: List[dict]):
+    """Refresh this worker's car indexes and tell the other workers to do the same"""
+    apply_car_index_updates(cars)
+    invalidation_bus.publish("car", [car["id"] for car in cars])
+
+def unindex_car(car_id: str):
+    for index in car_indexes:
+        index.remove(car_id)
+    invalidation_bus.publish("car", [car_id])
+
+async def rebuild_car_indexes():
+    """Rebuild every in-process car index from the available cars"""
+    cars = await repos.cars.find({"is_available": True, "deleted_at": None}, {"_id": 0}, limit=0)
+    for index in car_indexes:
+        index.rebuild(cars)
+    return len(cars)
+
+async def car_index_refresh_loop():
+    while True:
+        try:
+            count = await rebuild_car_indexes()
+            print(f"Car indexes rebuilt with {count} cars")
+        except Exception as e:
+            print(f"Car index rebuild failed: {str(e)}")
+        if CAR_INDEX_REFRESH_MINUTES <= 0:
+            return
+        await asyncio.sleep(CAR_INDEX_REFRESH_MINUTES * 60)
+
+# Cache Invalidation
+class InvalidationBus:
+    """Fans "entity changed" events out to every worker through a capped collection"""
+    
+    def __init__(self):
+        self.worker_id = uuid.uuid4().hex
+        self.handlers: Dict[str, list] = {}
+        self.resync_handlers: list = []
+        self.source = "local"
+        self.seq = 0
+        # Highest sequence number seen per publishing worker; a gap means lost events
+        self.last_seq: Dict[str, int] = {}
+        # A single writer task keeps inserts in sequence order, so readers only see gaps for real losses
+        self.outbox: asyncio.Queue = asyncio.Queue()
+        self.published = 0
+        self.publish_failed = 0
+        self.received = 0
+        self.applied = 0
+        self.dropped = 0
+        self.resyncs = 0
+        self.handler_errors = 0
+        self.lag_total_ms = 0.0
+        self.lag_max_ms = 0.0
+        self.last_lag_ms = 0.0
+    
+    def subscribe(self, entity: str, handler, resync=None):
+        """handler(ids) evicts or reloads the given ids; resync() rebuilds everything after lost events"""
+        self.handlers.setdefault(entity, []).append(handler)
+        if resync:
+            self.resync_handlers.append(resync)
+    
+    def publish(self, entity: str, ids: List[str]):
+        # With a single process (or no Mongo) there is nobody else to tell
+        if self.source == "local":
+            return
+        ids = list(dict.fromkeys(ids))
+        for start in range(0, len(ids), INVALIDATION_MAX_IDS):
+            self.seq += 1
+            event = {
+                "origin": self.worker_id,
+                "seq": self.seq,
+                "entity": entity,
+                "ids": ids[start:start + INVALIDATION_MAX_IDS],
+                "at": datetime.now(timezone.utc),
+            }
+            # Requests never wait on the announcement; a failed insert shows up as a gap for the readers
+            self.outbox.put_nowait(event)
+    
+    async def _write_events(self):
+        while True:
+            event = await self.outbox.get()
+            try:
+                await db[INVALIDATION_COLLECTION].insert_one(event)
+                self.published += 1
+            except Exception as e:
+                self.publish_failed += 1
+                print(f"Invalidation publish failed: {str(e)}")
+    
+    def seed(self, event: dict):
+        """Note an event written before this reader caught up, without applying it"""
+        if event.get("origin") != self.worker_id:
+            self.last_seq[event["origin"]] = max(self.last_seq.get(event["origin"], 0), event["seq"])
+    
+    async def deliver(self, event: dict):
+        if event.get("origin") == self.worker_id:
+            return
+        self.received += 1
+        at = event["at"] if event["at"].tzinfo else event["at"].replace(tzinfo=timezone.utc)
+        self.last_lag_ms = max(0.0, (datetime.now(timezone.utc) - at).total_seconds() * 1000)
+        self.lag_total_ms += self.last_lag_ms
+        self.lag_max_ms = max(self.lag_max_ms, self.last_lag_ms)
+        
+        previous = self.last_seq.get(event["origin"])
+        if previous is not None and event["seq"] <= previous:
+            # Already seen, or covered by the resync that followed a gap
+            return
+        self.last_seq[event["origin"]] = event["seq"]
+        if previous is not None and event["seq"] > previous + 1:
+            self.dropped += event["seq"] - previous - 1
+            await self.resync()
+            return
+        
+        for handler in self.handlers.get(event["entity"], ()):
+            try:
+                await handler(event["ids"])
+            except Exception as e:
+                self.handler_errors += 1
+                print(f"Invalidation handler for {event['entity']} failed: {str(e)}")
+        self.applied += 1
+    
+    async def resync(self):
+        self.resyncs += 1
+        for resync in self.resync_handlers:
+            try:
+                await resync()
+            except Exception as e:
+                self.handler_errors += 1
+                print(f"Invalidation resync failed: {str(e)}")
+    
+    async def run(self):
+        """Tail the capped collection for the life of the worker"""
+        try:
+            await db.create_collection(
+                INVALIDATION_COLLECTION, capped=True, size=INVALIDATION_CAPPED_BYTES, max=INVALIDATION_CAPPED_DOCS
+            )
+        except CollectionInvalid:
+            pass
+        except PyMongoError as e:
+            print(f"Cache invalidation: capped collection unavailable ({str(e)}), caches refresh on their own schedule")
+            return
+        
+        collection = db[INVALIDATION_COLLECTION]
+        writer_started = False
+        print(f"Cache invalidation: tailing {INVALIDATION_COLLECTION} as worker {self.worker_id}")
+        while True:
+            # One cursor in natural (insertion) order for as long as it lives. ObjectIds come
+            # from each worker's own clock and counter, so they cannot be used to resume.
+            # Our own marker keeps the collection non-empty, which keeps an idle cursor
+            # alive, and tells us where the events written before we started end.
+            marker = uuid.uuid4().hex
+            caught_up = False
+            try:
+                await collection.insert_one({"origin": self.worker_id, "marker": marker, "at": datetime.now(timezone.utc)})
+                if not writer_started:
+                    asyncio.create_task(self._write_events())
+                    self.source = "capped_collection"
+                    writer_started = True
+                cursor = collection.find({}, cursor_type=CursorType.TAILABLE_AWAIT)
+                while cursor.alive:
+                    async for event in cursor:
+                        if "marker" in event:
+                            caught_up = caught_up or event["marker"] == marker
+                        elif not caught_up:
+                            self.seed(event)
+                        else:
+                            await self.deliver(event)
+                print("Cache invalidation: tail cursor closed, resyncing")
+            except PyMongoError as e:
+                # Usually the collection wrapped past our position
+                print(f"Cache invalidation: tail interrupted ({str(e)}), resyncing")
+            # Events between the old cursor and the new marker are only seeded, not applied
+            if writer_started:
+                await self.resync()
+            await asyncio.sleep(1)
+    
+    def stats(self) -> dict:
+        return {
+            "source": self.source,
+            "worker_id": self.worker_id,
+            "published": self.published,
+            "publish_failed": self.publish_failed,
+            "publish_queued": self.outbox.qsize(),
+            "received": self.received,
+            "applied": self.applied,
+            "dropped": self.dropped,
+            "resyncs": self.resyncs,
+            "handler_errors": self.handler_errors,
+            "lag_avg_ms": round(self.lag_total_ms / self.received, 2) if self.received else 0.0,
+            "lag_max_ms": round(self.lag_max_ms, 2),
+            "last_lag_ms": round(self.last_lag_ms, 2),
+        }
+
+invalidation_bus = InvalidationBus()
+
+async def reload_indexed_cars(car_ids: List[str]):
+    """Pick up another worker's car writes without waiting for the periodic rebuild"""
+    cars = await repos.cars.find({"id": {"$in": car_ids}}, {"_id": 0}, limit=len(car_ids))
+    apply_car_index_updates(cars)
+    for car_id in set(car_ids) - {car["id"] for car in cars}:
+        for index in car_indexes:
+            index.remove(car_id)
+
+invalidation_bus.subscribe("car", reload_indexed_cars, resync=rebuild_car_indexes)
+
+# Sparse Fieldsets
+def resolve_fields(fields: Optional[str], view: Optional[str], views: Dict[str, List[str]], allowed: set) -> Optional[List[str]]:
+    """Turn fields= or view= into the list of fields to return, or None for the full document"""
+    if fields:
+        selected = [field.strip() for field in fields.split(",") if field.strip()]
+        unknown = [field for field in selected if field not in allowed]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    elif view and view != "detail":
+        if view not in views:
+            raise HTTPException(status_code=400, detail=f"Unknown view: {view}")
+        selected = list(views[view])
+    else:
+        return None
+    
+    if "id" not in selected:
+        selected.insert(0, "id")
+    return selected
+
+def fields_projection(selected: List[str], embedded: set, required: tuple = ()) -> dict:
+    projection = {"_id": 0}
+    for field in list(selected) + list(required):
+        if field not in embedded:
+            projection[field] = 1
+    return projection
+
+def pick_fields(document: dict, selected: List[str]) -> dict:
+    return {field: document.get(field) for field in selected if field in document}
+
+# Trending
+class TrendingTracker:
+    """Rolling-window activity counters per car with leaderboards per location"""
+    FIELDS = ("bookings", "views", "reviews", "rating_sum")
+    
+    def __init__(self):
+        self.pending: Dict[tuple, Counter] = {}  # (car_id, hour) -> counts not yet flushed
+        self.buckets: Dict[tuple, Counter] = {}  # memory backend only; MongoDB keeps these in car_activity
+        self.boards: Dict[str, List[dict]] = {}  # location ("" for everywhere) -> ranked entries
+        self.refreshed_at: Optional[datetime] = None
+    
+    @staticmethod
+    def location_key(location: Optional[str]) -> str:
+        return (location or "").strip().lower()
+    
+    def bump(self, car_id: str, **counts):
+        hour = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+        self.pending.setdefault((car_id, hour), Counter()).update(counts)
+    
+    async def flush(self):
+        """Write the counts gathered since the last flush with one bulk_write"""
+        pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        if not repos.persistent:
+            for key, counts in pending.items():
+                self.buckets.setdefault(key, Counter()).update(counts)
+            return
+        
+        try:
+            await db.car_activity.bulk_write([
+                UpdateOne({"car_id": car_id, "hour": hour}, {"$inc": dict(counts)}, upsert=True)
+                for (car_id, hour), counts in pending.items()
+            ], ordered=False)
+        except PyMongoError:
+            # Keep the counts for the next attempt
+            for key, counts in pending.items():
+                self.pending.setdefault(key, Counter()).update(counts)
+            raise
+    
+    async def window_totals(self, since: datetime) -> Dict[str, dict]:
+        if not repos.persistent:
+            self.buckets = {key: counts for key, counts in self.buckets.items() if key[1] >= since}
+            totals = {}
+            for (car_id, _), counts in self.buckets.items():
+                totals.setdefault(car_id, Counter()).update(counts)
+            return totals
+        
+        rows = await db.car_activity.aggregate([
+            {"$match": {"hour": {"$gte": since}}},
+            {"$group": {"_id": "$car_id", **{field: {"$sum": f"${field}"} for field in self.FIELDS}}},
+        ]).to_list(None)
+        return {row.pop("_id"): row for row in rows}
+    
+    async def refresh(self):
+        """Flush pending counts and rebuild every leaderboard from the rolling window"""
+        await self.flush()
+        now = datetime.now(timezone.utc)
+        totals = await self.window_totals(now - timedelta(hours=TRENDING_WINDOW_HOURS))
+        cars = await repos.cars.get_many(
+            totals, {"_id": 0, "is_available": 1, "deleted_at": 1, **{field: 1 for field in CAR_VIEWS["card"]}}
+        )
+        
+        entries = []
+        for car_id, counts in totals.items():
+            car = cars.get(car_id)
+            if not car or not car.get("is_available", True) or car.get("deleted_at"):
+                continue
+            reviews = counts.get("reviews", 0)
+            entries.append({
+                **pick_fields(car, CAR_VIEWS["card"]),
+                "score": round(sum(weight * counts.get(field, 0) for field, weight in TRENDING_WEIGHTS.items()), 2),
+                "bookings": counts.get("bookings", 0),
+                "views": counts.get("views", 0),
+                "reviews": reviews,
+                "window_rating": round(counts.get("rating_sum", 0) / reviews, 1) if reviews else None,
+            })
+        entries.sort(key=lambda entry: entry["score"], reverse=True)
+        
+        boards = {"": entries[:TRENDING_BOARD_SIZE]}
+        for entry in entries:
+            board = boards.setdefault(self.location_key(entry.get("location")), [])
+            if len(board) < TRENDING_BOARD_SIZE:
+                board.append(entry)
+        self.boards = boards
+        self.refreshed_at = now
+    
+    def top(self, location: Optional[str], limit: int) -> List[dict]:
+        return self.boards.get(self.location_key(location), [])[:limit]
+    
+    def stats(self) -> dict:
+        return {
+            "refreshed_at": self.refreshed_at.isoformat() if self.refreshed_at else None,
+            "locations": max(len(self.boards) - 1, 0),
+            "ranked_cars": len(self.boards.get("", [])),
+            "pending_buckets": len(self.pending),
+        }
+
+trending_tracker = TrendingTracker()
+
+async def trending_refresh_loop():
+    while True:
+        try:
+            await trending_tracker.refresh()
+        except Exception as e:
+            print(f"Trending refresh failed: {str(e)}")
+        await asyncio.sleep(TRENDING_REFRESH_SECONDS)
+
+# Booking Export
+BOOKING_EXPORT_COLUMNS = (
+    BOOKING_HISTORY_FIELDS
+    + [f"car_{field}" for field in BOOKING_HISTORY_CAR_FIELDS]
+    + [f"renter_{field}" for field in BOOKING_HISTORY_RENTER_FIELDS]
+)
+
+BOOKING_EXPORT_SCHEMA = pa.schema([
+    ("id", pa.string()),
+    ("status", pa.string()),
+    ("start_date", pa.timestamp("ms", tz="UTC")),
+    ("end_date", pa.timestamp("ms", tz="UTC")),
+    ("total_amount", pa.float64()),
+    ("created_at", pa.timestamp("ms", tz="UTC")),
+    ("host_id", pa.string()),
+    ("car_id", pa.string()),
+    ("user_id", pa.string()),
+    ("car_make", pa.string()),
+    ("car_model", pa.string()),
+    ("car_year", pa.int64()),
+    ("car_location", pa.string()),
+    ("renter_name", pa.string()),
+    ("renter_email", pa.string()),
+])
+
+async def merge_by_start_date(*streams):
+    """Merge row streams that are each sorted by start_date into one sorted stream"""
+    iterators = [stream.__aiter__() for stream in streams]
+    heads = []
+    for index, iterator in enumerate(iterators):
+        row = await anext(iterator, None)
+        if row is not None:
+            heapq.heappush(heads, (row["start_date"], index, row))
+    while heads:
+        _, index, row = heapq.heappop(heads)
+        yield row
+        row = await anext(iterators[index], None)
+        if row is not None:
+            heapq.heappush(heads, (row["start_date"], index, row))
+
+async def iter_booking_export_chunks(query: dict):
+    """Booking history across the hot collection and the archive, oldest first, in lists of at most BOOKING_EXPORT_CHUNK_ROWS"""
+    # Archived bookings are mostly older, but long-running hot ones can start before them
+    rows = merge_by_start_date(*(
+        repository.iter_history(query, repos.cars, repos.users, BOOKING_EXPORT_CHUNK_ROWS)
+        for repository in (repos.bookings_archive, repos.bookings)
+    ))
+    chunk = []
+    async for row in rows:
+        chunk.append({column: row.get(column) for column in BOOKING_EXPORT_COLUMNS})
+        if len(chunk) >= BOOKING_EXPORT_CHUNK_ROWS:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+async def stream_booking_csv(query: dict):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=BOOKING_EXPORT_COLUMNS)
+    writer.writeheader()
+    async for chunk in iter_booking_export_chunks(query):
+        for row in chunk:
+            writer.writerow({
+                column: value.isoformat() if isinstance(value, datetime) else value
+                for column, value in row.items()
+            })
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+class ParquetChunkSink(io.RawIOBase):
+    """Write-only file that hands out what the Parquet writer produced since the last drain"""
+    def __init__(self):
+        self.pending = []
+        self.position = 0
+    
+    def writable(self) -> bool:
+        return True
+    
+    def write(self, data) -> int:
+        self.pending.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+    
+    def tell(self) -> int:
+        # The writer records absolute offsets in the footer, so this never resets
+        return self.position
+    
+    def drain(self) -> bytes:
+        data = b"".join(self.pending)
+        self.pending = []
+        return data
+
+async def stream_booking_parquet(query: dict):
+    # Each chunk becomes one row group, so memory stays bounded by the chunk size
+    sink = ParquetChunkSink()
+    writer = pq.ParquetWriter(sink, BOOKING_EXPORT_SCHEMA, compression="snappy")
+    try:
+        async for chunk in iter_booking_export_chunks(query):
+            writer.write_table(pa.Table.from_pylist(chunk, schema=BOOKING_EXPORT_SCHEMA))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+# Request Coalescing
+class SingleFlight:
+    """Concurrent calls with the same key share one in-flight computation"""
+    
+    def __init__(self, name: str):
+        self.name = name
+        self.in_flight: Dict[tuple, asyncio.Task] = {}
+        self.requests = 0
+        self.executions = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.max_waiters = 0
+        self.waiters: Dict[tuple, int] = {}
+    
+    async def do(self, key: tuple, compute):
+        """Run compute() for key, or join the run already in flight"""
+        self.requests += 1
+        if not COALESCE_READS:
+            self.executions += 1
+            return await compute()
+        
+        task = self.in_flight.get(key)
+        if task is None:
+            self.executions += 1
+            task = asyncio.ensure_future(compute())
+            self.in_flight[key] = task
+            self.waiters[key] = 1
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self.coalesced += 1
+            self.waiters[key] += 1
+            self.max_waiters = max(self.max_waiters, self.waiters[key])
+        # A caller that disconnects must not cancel the run the others are waiting on
+        return await asyncio.shield(task)
+    
+    def _finish(self, key: tuple, task: asyncio.Task):
+        self.in_flight.pop(key, None)
+        self.waiters.pop(key, None)
+        if not task.cancelled() and task.exception() is not None:
+            self.errors += 1
+    
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "coalescing_ratio": round(self.coalesced / self.requests, 4) if self.requests else 0.0,
+            "in_flight": len(self.in_flight),
+            "max_waiters": self.max_waiters,
+            "errors": self.errors,
+        }
+
+car_detail_flight = SingleFlight("car_detail")
+car_listing_flight = SingleFlight("car_listing")
+
+def location_key(location: Optional[str]) -> Optional[str]:
+    """Listings match location case-insensitively, so "Boston" and "boston" share a flight"""
+    if not location:
+        return None
+    # Lowercasing would change the meaning of escapes like \S, so those stay as sent
+    return location if "\\" in location else location.lower()
+
+# Campaigns
+CAMPAIGN_FIELDS = {"name", "first_name", "email"}
+
+CAMPAIGN_LAYOUT_HEAD = """
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <meta charset="utf-8">
+        <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    </head>
+    <body style="margin: 0; padding: 0; font-family: Arial, sans-serif; background-color: #f4f4f4;">
+        <div style="max-width: 600px; margin: 0 auto; background-color: #ffffff;">
+            <div style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); padding: 40px 20px; text-align: center;">
+                <h1 style="color: #ffffff; margin: 0; font-size: 28px; font-weight: bold;">CarShare</h1>
+            </div>
+            <div style="padding: 40px 30px; color: #666666; font-size: 16px; line-height: 1.6;">
+"""
+CAMPAIGN_LAYOUT_TAIL = """
+            </div>
+        </div>
+    </body>
+    </html>
+"""
+
+class CompiledTemplate:
+    """A message template parsed once into literal chunks and recipient fields"""
+    
+    def __init__(self, source: str, escape: bool = False):
+        self.parts = []
+        for literal, field, format_spec, conversion in Formatter().parse(source):
+            if field is not None and (field not in CAMPAIGN_FIELDS or format_spec or conversion):
+                raise ValueError(f"Unknown template field {{{field}}}; use one of {', '.join(sorted(CAMPAIGN_FIELDS))}")
+            self.parts.append((literal, field))
+        self.escape = escape
+    
+    def render(self, values: Dict[str, str]) -> str:
+        chunks = []
+        for literal, field in self.parts:
+            chunks.append(literal)
+            if field is not None:
+                chunks.append(html.escape(values[field]) if self.escape else values[field])
+        return "".join(chunks)
+
+def campaign_values(user: dict) -> Dict[str, str]:
+    name = user.get("name") or ""
+    return {"name": name, "first_name": name.split()[0] if name else "", "email": user["email"]}
+
+async def iter_campaign_recipients(segment: CampaignSegment, location: Optional[str], batch_size: int):
+    """Yield batches of active recipients, reading their ids off a single sorted cursor"""
+    if segment == CampaignSegment.HOSTS_IN_LOCATION:
+        id_field = "host_id"
+        source = repos.cars.iter_find(
+            {"location": {"$regex": re.escape(location), "$options": "i"}, "deleted_at": None},
+            {"_id": 0, "host_id": 1}, [("host_id", 1)], batch_size
+        )
+    else:
+        id_field = "user_id"
+        source = repos.bookings.iter_find(
+            {"status": {"$in": ["pending", "confirmed"]}, "start_date": {"$gte": datetime.now(timezone.utc)}},
+            {"_id": 0, "user_id": 1}, [("user_id", 1)], batch_size
+        )
+    
+    async def load(ids: List[str]) -> List[dict]:
+        users = await repos.users.get_many(ids, {"_id": 0, "email": 1, "name": 1, "is_active": 1})
+        return [users[user_id] for user_id in ids if user_id in users and users[user_id].get("is_active", True)]
+    
+    # Sorted ids make duplicates adjacent, so only the current batch is ever held
+    ids, last_id = [], None
+    async for document in source:
+        if document[id_field] == last_id:
+            continue
+        last_id = document[id_field]
+        ids.append(last_id)
+        if len(ids) >= batch_size:
+            yield await load(ids)
+            ids = []
+    if ids:
+        yield await load(ids)
+
+def deliver_campaign_batch(messages: List[tuple], rate: float) -> tuple:
+    """Send (to, subject, html, text) messages over one SMTP connection, at most rate per second"""
+    sent = failed = 0
+    interval = 1 / rate
+    next_send = time.monotonic()
+    try:
+        with email_batch():
+            for to_email, subject, html_content, text_content in messages:
+                delay = next_send - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                next_send = max(next_send + interval, time.monotonic())
+                if send_email(to_email, subject, html_content, text_content):
+                    sent += 1
+                else:
+                    failed += 1
+    except Exception as e:
+        print(f"Campaign batch aborted after {sent + failed} of {len(messages)} messages: {str(e)}")
+        failed += len(messages) - sent - failed
+    return sent, failed
+
+async def run_campaign(campaign: dict, subject: CompiledTemplate, html_body: CompiledTemplate, text_body: Optional[CompiledTemplate]):
+    campaign_id = campaign["id"]
+    await db.campaigns.update_one(
+        {"id": campaign_id}, {"$set": {"status": "sending", "started_at": datetime.now(timezone.utc)}}
+    )
+    
+    async def record(delivery, recipients: int):
+        sent, failed = await delivery
+        await db.campaigns.update_one(
+            {"id": campaign_id}, {"$inc": {"recipients": recipients, "sent": sent, "failed": failed}}
+        )
+    
+    # The next batch is read and rendered while the previous one is being sent
+    pending = None
+    try:
+        async for recipients in iter_campaign_recipients(campaign["segment"], campaign.get("location"), CAMPAIGN_BATCH_SIZE):
+            messages = []
+            for user in recipients:
+                values = campaign_values(user)
+                messages.append((
+                    user["email"],
+                    subject.render(values),
+                    html_body.render(values),
+                    text_body.render(values) if text_body else None,
+                ))
+            if pending:
+                await record(*pending)
+            delivery = asyncio.ensure_future(asyncio.to_thread(deliver_campaign_batch, messages, campaign["rate_per_second"]))
+            pending = (delivery, len(messages))
+        if pending:
+            await record(*pending)
+        await db.campaigns.update_one(
+            {"id": campaign_id}, {"$set": {"status": "completed", "finished_at": datetime.now(timezone.utc)}}
+        )
+    except Exception as e:
+        print(f"Campaign {campaign_id} failed: {str(e)}")
+        await db.campaigns.update_one(
+            {"id": campaign_id},
+            {"$set": {"status": "failed", "error": str(e), "finished_at": datetime.now(timezone.utc)}}
+        )
+
+# Running campaigns are referenced here so they are not garbage collected mid-send
+campaign_tasks: set = set()
+
+def require_campaign_token(request: Request):
+    if not CAMPAIGN_TOKEN:
+        raise HTTPException(status_code=403, detail="Campaigns are disabled")
+    if not secrets.compare_digest(request.headers.get("x-campaign-token", ""), CAMPAIGN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid campaign token")
+
+# Helper Functions
+def hash_password(password: str) -> str:
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+
+def verify_password(password: str, hashed: str) -> bool:
+    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
+    to_encode = data.copy()
+    if expires_delta:
+        expire = datetime.now(timezone.utc) + expires_delta
+    else:
+        expire = datetime.now(timezone.utc) + timedelta(minutes=15)
+    to_encode.update({"exp": expire})
+    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    return encoded_jwt
+
+def generate_verification_token() -> str:
+    return secrets.token_urlsafe(32)
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return await authenticate_token(credentials.credentials)
+
+async def authenticate_token(token: str, token_type: str = "access") -> User:
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        user_id: str = payload.get("sub")
+        if user_id is None:
+            raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+    except jwt.PyJWTError:
+        raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+    
+    # Stream tickets and access tokens are not interchangeable
+    if payload.get("typ", "access") != token_type:
+        raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+    if token_type == "stream":
+        await redeem_stream_ticket(payload)
+    
+    user = await repos.users.get(user_id)
+    if user is None:
+        raise HTTPException(status_code=401, detail="User not found")
+    
+    user_obj = User(**user)
+    if not user_obj.is_verified:
+        raise HTTPException(status_code=403, detail="Email verification required")
+    
+    return user_obj
+
+def create_stream_ticket(user_id: str) -> str:
+    return create_access_token(
+        data={"sub": user_id, "typ": "stream", "jti": secrets.token_urlsafe(16)},
+        expires_delta=timedelta(seconds=STREAM_TICKET_TTL_SECONDS)
+    )
+
+# Ticket ids already used, until they expire; MongoDB shares them between workers
+redeemed_stream_tickets: Dict[str, float] = {}
+
+async def redeem_stream_ticket(payload: dict):
+    """Reject a stream ticket that was already used once"""
+    expires_at = datetime.fromtimestamp(payload["exp"], timezone.utc)
+    if repos.persistent:
+        try:
+            await db.stream_tickets.insert_one({"jti": payload["jti"], "expires_at": expires_at})
+        except DuplicateKeyError:
+            raise HTTPException(status_code=401, detail="Stream ticket already used")
+        return
+    
+    now = time.time()
+    for jti in [jti for jti, expiry in redeemed_stream_tickets.items() if expiry < now]:
+        del redeemed_stream_tickets[jti]
+    if payload["jti"] in redeemed_stream_tickets:
+        raise HTTPException(status_code=401, detail="Stream ticket already used")
+    redeemed_stream_tickets[payload["jti"]] = expires_at.timestamp()
+
+def require_persistent_backend(feature: str):
+    """Derived collections such as rollups and calendars only exist in MongoDB"""
+    if not repos.persistent:
+        raise HTTPException(status_code=503, detail=f"{feature} require the MongoDB data backend")
+
+# Authentication Routes
+@api_router.post("/auth/register", response_model=dict)
+async def register(user_data: UserCreate, background_tasks: BackgroundTasks):
+    check_email_typos(user_data.email)
+    # Check if user exists
+    existing_user = await repos.users.get_by_email(user_data.email)
+    if existing_user:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    
+    # Hash password and create user
+    # bcrypt is CPU-bound; keep it off the event loop
+    hashed_password = await run_in_threadpool(hash_password, user_data.password)
+    verification_token = generate_verification_token()
+    
+    user = User(
+        email=user_data.email,
+        name=user_data.name,
+        role=user_data.role,
+        phone=user_data.phone,
+        is_verified=False,
+        verification_token=verification_token
+    )
+    
+    user_dict = user.model_dump()
+    user_dict["password"] = hashed_password
+    
+    await repos.users.insert(user_dict)
+    
+    # Send verification email in background
+    background_tasks.add_task(
+        send_verification_email,
+        user_data.email,
+        user_data.name,
+        verification_token
+    )
+    
+    return {
+        "message": "Registration successful! Please check your email to verify your account.",
+        "email": user_data.email
+    }
+
+@api_router.post("/auth/verify-email")
+async def verify_email(verification_data: EmailVerificationRequest, background_tasks: BackgroundTasks):
+    user = await repos.users.find_one({"verification_token": verification_data.token})
+    if not user:
+        raise HTTPException(status_code=400, detail="Invalid or expired verification token")
+    
+    # Update user as verified
+    await repos.users.update(
+        {"id": user["id"]},
+        {
+            "$set": {
+                "is_verified": True,
+                "verification_token": None
+            }
+        }
+    )
+    
+    # Send welcome email in background
+    background_tasks.add_task(
+        send_welcome_email,
+        user["email"],
+        user["name"],
+        user["role"]
+    )
+    
+    # Create access token
+    user_obj = User(**user)
+    user_obj.is_verified = True
+    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token = create_access_token(
+        data={"sub": user_obj.id}, expires_delta=access_token_expires
+    )
+    
+    return {
+        "message": "Email verified successfully! Welcome to CarShare!",
+        "access_token": access_token,
+        "token_type": "bearer",
+        "user": user_obj
+    }
+
+@api_router.post("/auth/resend-verification")
+async def resend_verification(email_data: dict, background_tasks: BackgroundTasks):
+    email = email_data.get("email")
+    if not email:
+        raise HTTPException(status_code=400, detail="Email is required")
+    
+    user = await repos.users.get_by_email(email)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
     
     if user.get("is_verified"):
         raise HTTPException(status_code=400, detail="Email is already verified")
     
     # Generate new verification token
     verification_token = generate_verification_token()
-    await db.users.update_one(
+    await repos.users.update(
         {"id": user["id"]},
         {"$set": {"verification_token": verification_token}}
     )
@@ -800,8 +3040,8 @@ async def resend_verification(email_data: dict, background_tasks: BackgroundTask
 @api_router.post("/auth/login", response_model=Token)
 async def login(user_credentials: UserLogin):
     check_email_typos(user_credentials.email)
-    user = await db.users.find_one({"email": user_credentials.email})
-    if not user or not verify_password(user_credentials.password, user["password"]):
+    user = await repos.users.get_by_email(user_credentials.email)
+    if not user or not await run_in_threadpool(verify_password, user_credentials.password, user["password"]):
         raise HTTPException(status_code=401, detail="Incorrect email or password")
     
     user_obj = User(**user)
@@ -826,7 +3066,7 @@ async def get_me(current_user: User = Depends(get_current_user)):
 @api_router.put("/auth/change-role")
 async def change_role(role_data: RoleChangeRequest, current_user: User = Depends(get_current_user)):
     # Update user role
-    await db.users.update_one(
+    await repos.users.update(
         {"id": current_user.id},
         {"$set": {"role": role_data.new_role}}
     )
@@ -836,7 +3076,7 @@ async def change_role(role_data: RoleChangeRequest, current_user: User = Depends
 @api_router.post("/auth/forgot-password")
 async def forgot_password(request: ForgotPasswordRequest, background_tasks: BackgroundTasks):
     check_email_typos(request.email)
-    user = await db.users.find_one({"email": request.email})
+    user = await repos.users.get_by_email(request.email)
     if not user:
         # Don't reveal if email exists or not for security
         return {"message": "If the email exists, you will receive a password reset OTP."}
@@ -846,7 +3086,7 @@ async def forgot_password(request: ForgotPasswordRequest, background_tasks: Back
     otp_expiry = datetime.now(timezone.utc) + timedelta(minutes=10)
     
     # Update user with OTP and expiry
-    await db.users.update_one(
+    await repos.users.update(
         {"id": user["id"]},
         {
             "$set": {
@@ -869,7 +3109,7 @@ async def forgot_password(request: ForgotPasswordRequest, background_tasks: Back
 @api_router.post("/auth/reset-password")
 async def reset_password(request: ResetPasswordRequest):
     check_email_typos(request.email)
-    user = await db.users.find_one({"email": request.email})
+    user = await repos.users.get_by_email(request.email)
     if not user:
         raise HTTPException(status_code=400, detail="Invalid email or OTP")
     
@@ -884,10 +3124,10 @@ async def reset_password(request: ResetPasswordRequest):
         raise HTTPException(status_code=400, detail="Invalid OTP")
     
     # Hash new password
-    hashed_password = hash_password(request.new_password)
+    hashed_password = await run_in_threadpool(hash_password, request.new_password)
     
     # Update password and remove OTP fields
-    await db.users.update_one(
+    await repos.users.update(
         {"id": user["id"]},
         {
             "$set": {"password": hashed_password},
@@ -898,16 +3138,25 @@ async def reset_password(request: ResetPasswordRequest):
     return {"message": "Password reset successfully"}
 
 @api_router.put("/profile", response_model=User)
-async def update_profile(profile_data: UserProfile, current_user: User = Depends(get_current_user)):
+async def update_profile(profile_data: UserProfile, background_tasks: BackgroundTasks, current_user: User = Depends(get_current_user)):
     # Update user profile
     update_data = profile_data.model_dump(exclude_unset=True)
-    await db.users.update_one(
+    await repos.users.update(
         {"id": current_user.id},
         {"$set": update_data}
     )
     
+    # Reviews carry a copy of the reviewer's name, so renames are fanned out
+    if "name" in update_data and update_data["name"] != current_user.name:
+        background_tasks.add_task(
+            propagate_reviewer_name,
+            current_user.id,
+            update_data["name"],
+            datetime.now(timezone.utc)
+        )
+    
     # Return updated user
-    updated_user = await db.users.find_one({"id": current_user.id})
+    updated_user = await repos.users.get(current_user.id)
     return User(**updated_user)
 
 # Car Routes
@@ -917,71 +3166,216 @@ async def create_car(car_data: CarCreate, current_user: User = Depends(get_curre
         raise HTTPException(status_code=403, detail="Only hosts can add cars")
     
     car = Car(**car_data.model_dump(), host_id=current_user.id)
-    await db.cars.insert_one(car.model_dump())
+    await repos.cars.insert(car.model_dump())
+    index_cars([car.model_dump()])
     return car
 
+@api_router.post("/cars/import")
+async def import_cars(request: Request, format: Optional[CarImportFormat] = None, current_user: User = Depends(get_current_user)):
+    if current_user.role != UserRole.HOST:
+        raise HTTPException(status_code=403, detail="Only hosts can add cars")
+    
+    if format is None:
+        content_type = request.headers.get("content-type", "")
+        format = CarImportFormat.CSV if "csv" in content_type else CarImportFormat.NDJSON
+    
+    lines = iter_request_lines(request)
+    rows = iter_csv_rows(lines) if format == CarImportFormat.CSV else iter_ndjson_rows(lines)
+    
+    report = {"processed": 0, "inserted": 0, "failed": 0, "errors": []}
+    batch = []
+    async for row_number, row in rows:
+        report["processed"] += 1
+        if report["processed"] > CAR_IMPORT_MAX_ROWS:
+            report["processed"] -= 1
+            record_car_import_error(report, row_number, f"Import is limited to {CAR_IMPORT_MAX_ROWS} rows")
+            break
+        
+        if isinstance(row, Exception):
+            record_car_import_error(report, row_number, str(row))
+            continue
+        
+        try:
+            car_data = CarCreate(**row)
+        except ValidationError as e:
+            record_car_import_error(report, row_number, [
+                {"field": ".".join(str(part) for part in error["loc"]), "message": error["msg"]}
+                for error in e.errors()
+            ])
+            continue
+        
+        batch.append((row_number, Car(**car_data.model_dump(), host_id=current_user.id)))
+        if len(batch) >= CAR_IMPORT_BATCH_SIZE:
+            await insert_car_batch(batch, report)
+            batch = []
+    
+    if batch:
+        await insert_car_batch(batch, report)
+    
+    report["errors_truncated"] = report["failed"] > len(report["errors"])
+    return report
+
 @api_router.get("/cars", response_model=List[dict])
-async def get_cars(location: Optional[str] = None):
-    query = {"is_available": True}
-    if location:
-        query["location"] = {"$regex": location, "$options": "i"}
+async def get_cars(
+    location: Optional[str] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    fields: Optional[str] = None,
+    view: Optional[str] = None
+):
+    selected = resolve_fields(fields, view, CAR_VIEWS, set(Car.model_fields) | CAR_EMBEDDED_FIELDS)
+    with_quotes = bool(start_date and end_date)
+    key = (
+        location_key(location),
+        start_date.isoformat() if with_quotes else None,
+        end_date.isoformat() if with_quotes else None,
+        tuple(selected) if selected is not None else None,
+    )
+    return await car_listing_flight.do(key, lambda: list_cars(location, start_date, end_date, selected, with_quotes))
+
+async def list_cars(location: Optional[str], start_date: Optional[datetime], end_date: Optional[datetime], selected: Optional[List[str]], with_quotes: bool) -> List[dict]:
+    projection = None
+    if selected is not None:
+        projection = fields_projection(selected, CAR_EMBEDDED_FIELDS, ("price_per_day",) if with_quotes else ())
+    cars = await repos.cars.list_available(location, projection)
+    
+    # With dates, every car gets its exact total from a single batch quote
+    quotes = None
+    if with_quotes and cars:
+        quotes = quote_prices([car["price_per_day"] for car in cars], start_date, end_date)
     
-    cars = await db.cars.find(query).to_list(1000)
+    # Each car embeds only its first review page, fetched for the whole listing
+    # in one batched query; one extra review per car tells whether more exist
+    embed_reviews = selected is None or "reviews" in selected or "reviews_next_cursor" in selected
+    reviews_by_car = {}
+    if embed_reviews:
+        reviews_by_car = await repos.reviews.list_for_cars([car["id"] for car in cars], repos.cars, REVIEW_PAGE_SIZE + 1)
     
-    # Add reviews to each car
     cars_with_reviews = []
     for car in cars:
-        car_obj = Car(**car)
-        
-        # Get reviews for this car
-        reviews = await db.reviews.find({"car_id": car["id"]}).to_list(1000)
-        
-        # Get user names for reviews
-        review_list = []
-        for review in reviews:
-            user = await db.users.find_one({"id": review["user_id"]})
-            review_obj = Review(**review)
-            review_dict = review_obj.model_dump()
-            review_dict["user_name"] = user["name"] if user else "Anonymous"
-            review_list.append(review_dict)
+        if selected is None:
+            car_dict = Car(**car).dict()
+        else:
+            car_dict = pick_fields(car, selected)
         
-        car_dict = car_obj.dict()
-        car_dict["reviews"] = review_list
+        if embed_reviews:
+            reviews = reviews_by_car[car["id"]]
+            car_dict["reviews"] = await attach_reviewer_names(reviews[:REVIEW_PAGE_SIZE])
+            car_dict["reviews_next_cursor"] = encode_review_cursor(reviews[REVIEW_PAGE_SIZE - 1]) if len(reviews) > REVIEW_PAGE_SIZE else None
+        if quotes:
+            index = len(cars_with_reviews)
+            car_dict["quote"] = {
+                "days": quotes["days"],
+                "discount": quotes["discount"],
+                "subtotal": quotes["subtotals"][index],
+                "total": quotes["totals"][index],
+            }
         cars_with_reviews.append(car_dict)
     
     return cars_with_reviews
 
-@api_router.get("/cars/{car_id}", response_model=dict)
-async def get_car(car_id: str):
-    car = await db.cars.find_one({"id": car_id})
-    if not car:
-        raise HTTPException(status_code=404, detail="Car not found")
+@api_router.get("/cars/search")
+async def search_cars(
+    q: str,
+    location: Optional[str] = None,
+    make: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    min_year: Optional[int] = None,
+    max_year: Optional[int] = None,
+    offset: int = 0,
+    limit: int = SEARCH_PAGE_SIZE
+):
+    offset = max(offset, 0)
+    limit = max(1, min(limit, MAX_SEARCH_PAGE_SIZE))
+    filters = {
+        "location": location, "make": make,
+        "min_price": min_price, "max_price": max_price,
+        "min_year": min_year, "max_year": max_year,
+    }
+    total, hits = car_search_index.search(q, filters, offset, limit)
+    if not hits:
+        return {"total": total, "offset": offset, "limit": limit, "results": []}
     
-    car_obj = Car(**car)
+    scores = dict(hits)
+    cars = await repos.cars.find(
+        {"id": {"$in": list(scores)}, "is_available": True}, {"_id": 0}, limit=len(scores)
+    )
+    cars.sort(key=lambda car: scores[car["id"]], reverse=True)
+    return {
+        "total": total,
+        "offset": offset,
+        "limit": limit,
+        "results": [{**Car(**car).model_dump(), "score": scores[car["id"]]} for car in cars],
+    }
+
+@api_router.get("/cars/trending", response_model=dict)
+async def get_trending_cars(location: Optional[str] = None, limit: int = 10):
+    # Served straight from the last precomputed leaderboard
+    return {
+        "location": location,
+        "window_hours": TRENDING_WINDOW_HOURS,
+        "refreshed_at": trending_tracker.refreshed_at,
+        "cars": trending_tracker.top(location, max(1, min(limit, TRENDING_BOARD_SIZE))),
+    }
+
+@api_router.get("/autocomplete", response_model=List[dict])
+async def autocomplete(q: str, kind: Optional[str] = None, limit: int = AUTOCOMPLETE_LIMIT):
+    if kind is not None and kind not in AutocompleteIndex.KINDS:
+        raise HTTPException(status_code=400, detail="kind must be one of location, make or model")
     
-    # Get reviews for this car
-    reviews = await db.reviews.find({"car_id": car_id}).to_list(1000)
+    # Answered entirely from memory; keystrokes never reach MongoDB
+    return autocomplete_index.complete(q, kind, max(1, min(limit, 20)))
+
+@api_router.get("/cars/{car_id}", response_model=dict)
+async def get_car(car_id: str, fields: Optional[str] = None, view: Optional[str] = None):
+    selected = resolve_fields(fields, view, CAR_VIEWS, set(Car.model_fields) | CAR_EMBEDDED_FIELDS)
+    key = (car_id, tuple(selected) if selected is not None else None)
+    car_dict = await car_detail_flight.do(key, lambda: load_car_detail(car_id, selected))
+    if car_dict is None:
+        raise HTTPException(status_code=404, detail="Car not found")
+    # Every request is a view, even when it shared the lookup
+    trending_tracker.bump(car_id, views=1)
+    return car_dict
+
+async def load_car_detail(car_id: str, selected: Optional[List[str]]) -> Optional[dict]:
+    projection = None if selected is None else fields_projection(selected, CAR_EMBEDDED_FIELDS)
+    car = await repos.cars.find_one({"id": car_id, "deleted_at": None}, projection)
+    if not car:
+        return None
     
-    # Get user names for reviews
-    review_list = []
-    for review in reviews:
-        user = await db.users.find_one({"id": review["user_id"]})
-        review_obj = Review(**review)
-        review_dict = review_obj.dict()
-        review_dict["user_name"] = user["name"] if user else "Anonymous"
-        review_list.append(review_dict)
+    car_dict = Car(**car).model_dump() if selected is None else pick_fields(car, selected)
     
-    car_dict = car_obj.model_dump()
-    car_dict["reviews"] = review_list
+    # Only the first page of reviews is embedded; the rest come from /reviews/car/{car_id}
+    if selected is None or "reviews" in selected or "reviews_next_cursor" in selected:
+        review_page = await fetch_review_page(car_id)
+        car_dict["reviews"] = review_page["reviews"]
+        car_dict["reviews_next_cursor"] = review_page["next_cursor"]
     
     return car_dict
 
+@api_router.get("/cars/{car_id}/similar", response_model=List[dict])
+async def get_similar_cars(car_id: str, k: int = 6):
+    k = max(1, min(k, MAX_SIMILAR_CARS))
+    neighbours = similar_cars_index.similar(car_id, k)
+    if not neighbours:
+        if car_id not in similar_cars_index.rows and not await repos.cars.get(car_id, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Car not found")
+        return []
+    
+    scores = dict(neighbours)
+    cars = await repos.cars.find(
+        {"id": {"$in": list(scores)}, "is_available": True}, {"_id": 0}, limit=len(scores)
+    )
+    cars.sort(key=lambda car: scores[car["id"]], reverse=True)
+    return [{**Car(**car).model_dump(), "similarity": scores[car["id"]]} for car in cars]
+
 @api_router.get("/my-cars", response_model=List[Car])
 async def get_my_cars(current_user: User = Depends(get_current_user)):
     if current_user.role != UserRole.HOST:
         raise HTTPException(status_code=403, detail="Only hosts can view their cars")
     
-    cars = await db.cars.find({"host_id": current_user.id}).to_list(1000)
+    cars = await repos.cars.list_by_host(current_user.id)
     return [Car(**car) for car in cars]
 
 @api_router.post("/bookings", response_model=Booking)
@@ -990,24 +3384,30 @@ async def create_booking(booking_data: BookingCreate, background_tasks: Backgrou
         raise HTTPException(status_code=403, detail="Only users can create bookings")
     
     # Check if car exists and is available
-    car = await db.cars.find_one({"id": booking_data.car_id, "is_available": True})
+    car = await repos.cars.find_one({"id": booking_data.car_id, "is_available": True})
     if not car:
         raise HTTPException(status_code=404, detail="Car not found or not available")
     
+    # Most conflicts are caught by the day bitmap without touching bookings
+    if await calendar_has_conflict(booking_data.car_id, booking_data.start_date, booking_data.end_date):
+        raise HTTPException(status_code=400, detail="Car is not available for selected dates")
+    
     # Check for conflicting bookings
-    conflicting_booking = await db.bookings.find_one({
-        "car_id": booking_data.car_id,
-        "status": {"$in": ["pending", "confirmed", "active"]},
-        "$or": [
-            {"start_date": {"$lte": booking_data.end_date, "$gte": booking_data.start_date}},
-            {"end_date": {"$lte": booking_data.end_date, "$gte": booking_data.start_date}},
-            {"start_date": {"$lte": booking_data.start_date}, "end_date": {"$gte": booking_data.end_date}}
-        ]
-    })
+    conflicting_booking = await repos.bookings.find_overlapping(
+        booking_data.car_id, booking_data.start_date, booking_data.end_date, LIVE_BOOKING_STATUSES
+    )
     
     if conflicting_booking:
         raise HTTPException(status_code=400, detail="Car is not available for selected dates")
     
+    # The client's total is only accepted if it matches the server-side quote
+    quote = quote_car(car, booking_data.start_date, booking_data.end_date)
+    if abs(quote["total"] - booking_data.total_amount) > QUOTE_TOLERANCE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Total amount does not match the current price of ${quote['total']:.2f}"
+        )
+    
     booking = Booking(
         **booking_data.dict(),
         user_id=current_user.id,
@@ -1016,9 +3416,14 @@ async def create_booking(booking_data: BookingCreate, background_tasks: Backgrou
     )
     
     # Convert ObjectId fields before inserting
-    booking_dict = booking.mode_dump()
+    booking_dict = booking.model_dump()
     booking_dict = convert_objectid_to_str(booking_dict)
-    await db.bookings.insert_one(booking_dict)
+    await repos.bookings.insert(booking_dict)
+    trending_tracker.bump(booking.car_id, bookings=1)
+    
+    background_tasks.add_task(update_host_rollup, booking_dict, None, booking.status)
+    background_tasks.add_task(mark_calendar_days, booking_dict)
+    publish_booking_event("booking.created", booking_dict)
     
     # Send booking confirmation email
     booking_details = {
@@ -1042,119 +3447,156 @@ async def create_booking(booking_data: BookingCreate, background_tasks: Backgrou
     return booking
 
 @api_router.get("/bookings")
-async def get_my_bookings(current_user: User = Depends(get_current_user)):
+async def get_my_bookings(fields: Optional[str] = None, view: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    selected = resolve_fields(fields, view, BOOKING_VIEWS, set(Booking.model_fields) | BOOKING_EMBEDDED_FIELDS)
+    
+    # Users see the host of each booking, hosts see the renter
     if current_user.role == UserRole.USER:
-        bookings = await db.bookings.find({"user_id": current_user.id}).to_list(1000)
-        
-        # Add car and host details for user bookings
-        booking_list = []
-        for booking in bookings:
+        query, party_key, party_id_field = {"user_id": current_user.id}, "host", "host_id"
+        party_fields = ["name", "phone"]
+    else:  # HOST
+        query, party_key, party_id_field = {"host_id": current_user.id}, "user", "user_id"
+        party_fields = ["name", "phone", "email"]
+    
+    projection = None
+    if selected is not None:
+        projection = fields_projection(selected, BOOKING_EMBEDDED_FIELDS, ("car_id", party_id_field))
+    bookings = await find_bookings(query, projection)
+    
+    # Related cars and users are fetched with one $in query each instead of per booking
+    include_car = selected is None or "car" in selected
+    include_party = selected is None or party_key in selected
+    car_ids = [booking["car_id"] for booking in bookings] if include_car else []
+    party_ids = [booking[party_id_field] for booking in bookings] if include_party else []
+    cars, parties = await asyncio.gather(
+        repos.cars.get_many(car_ids, {"_id": 0, **{field: 1 for field in BOOKING_CAR_FIELDS}}),
+        repos.users.get_many(party_ids, {"_id": 0, **{field: 1 for field in party_fields}}),
+    )
+    
+    booking_list = []
+    for booking in bookings:
+        if selected is None:
             # Convert all ObjectIds to strings
-            booking = convert_objectid_to_str(booking)
-            
-            car = await db.cars.find_one({"id": booking["car_id"]})
-            host = await db.users.find_one({"id": booking["host_id"]})
-            
-            # Create booking dict without using Pydantic model
-            booking_dict = booking.copy()
-            
-            # Handle car data - create a clean car object without ObjectId issues
-            if car:
-                booking_dict["car"] = {
-                    "id": car["id"],
-                    "brand": car.get("brand"),
-                    "model": car.get("model"), 
-                    "make": car.get("make"),  # Added make field
-                    "year": car.get("year"),
-                    "price_per_day": car.get("price_per_day"),
-                    "location": car.get("location"),
-                    "image_url": car.get("image_url"),
-                }
-            else:
-                booking_dict["car"] = None
-                
-            # Handle host data - only include needed fields
-            if host:
-                booking_dict["host"] = {
-                    "name": host["name"], 
-                    "phone": host.get("phone")
-                }
-            else:
-                booking_dict["host"] = None
-                
-            booking_list.append(booking_dict)
-            
-        return booking_list
+            booking_dict = convert_objectid_to_str(booking)
+        else:
+            booking_dict = pick_fields(booking, selected)
         
-    else:  # HOST
-        bookings = await db.bookings.find({"host_id": current_user.id}).to_list(1000)
+        # Handle car data - create a clean car object without ObjectId issues
+        if include_car:
+            car = cars.get(booking["car_id"])
+            booking_dict["car"] = {field: car.get(field) for field in BOOKING_CAR_FIELDS} if car else None
         
-        # Add car and user details for host bookings
-        booking_list = []
-        for booking in bookings:
-            # Convert all ObjectIds to strings
-            booking = convert_objectid_to_str(booking)
-            
-            car = await db.cars.find_one({"id": booking["car_id"]})
-            user = await db.users.find_one({"id": booking["user_id"]})
-            
-            # Create booking dict without using Pydantic model
-            booking_dict = booking.copy()
-            
-            # Handle car data - create a clean car object without ObjectId issues
-            if car:
-                booking_dict["car"] = {
-                    "id": car["id"],
-                    "brand": car.get("brand"),
-                    "model": car.get("model"),
-                    "make": car.get("make"),  # Added make field
-                    "year": car.get("year"),
-                    "price_per_day": car.get("price_per_day"),
-                    "location": car.get("location"),
-                    "image_url": car.get("image_url"),
-                }
-            else:
-                booking_dict["car"] = None
-                
-            # Handle user data - only include needed fields
-            if user:
-                booking_dict["user"] = {
-                    "name": user["name"], 
-                    "phone": user.get("phone"), 
-                    "email": user["email"]
-                }
-            else:
-                booking_dict["user"] = None
-                
-            booking_list.append(booking_dict)
-            
-        return booking_list
+        # Handle host/user data - only include needed fields
+        if include_party:
+            party = parties.get(booking[party_id_field])
+            booking_dict[party_key] = {field: party.get(field) for field in party_fields} if party else None
+        
+        booking_list.append(booking_dict)
+    
+    return booking_list
 
-@api_router.put("/bookings/{booking_id}/status")
-async def update_booking_status(booking_id: str, status_data: BookingUpdate, background_tasks: BackgroundTasks, current_user: User = Depends(get_current_user)):
-    booking = await db.bookings.find_one({"id": booking_id})
-    if not booking:
-        raise HTTPException(status_code=404, detail="Booking not found")
+@api_router.post("/bookings/events/ticket")
+async def create_booking_events_ticket(current_user: User = Depends(get_current_user)):
+    return {"ticket": create_stream_ticket(current_user.id), "expires_in": STREAM_TICKET_TTL_SECONDS}
+
+@api_router.get("/bookings/events")
+async def booking_events(request: Request, ticket: str):
+    # EventSource cannot send an Authorization header, so a short-lived single-use
+    # ticket from POST /bookings/events/ticket comes in the query string instead
+    current_user = await authenticate_token(ticket, token_type="stream")
+    queue = booking_event_hub.subscribe(current_user.id)
+    
+    async def event_stream():
+        try:
+            yield "retry: 5000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=BOOKING_EVENTS_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            booking_event_hub.unsubscribe(current_user.id, queue)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.get("/bookings/export")
+async def export_bookings(
+    format: BookingExportFormat = BookingExportFormat.CSV,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    current_user: User = Depends(get_current_user)
+):
+    # Hosts export bookings of their cars, users their own rentals
+    if current_user.role == UserRole.HOST:
+        query = {"host_id": current_user.id}
+    else:
+        query = {"user_id": current_user.id}
+    
+    # Bookings are selected by the day they start: [start_date, end_date)
+    if start_date or end_date:
+        query["start_date"] = {}
+        if start_date:
+            query["start_date"]["$gte"] = start_date
+        if end_date:
+            query["start_date"]["$lt"] = end_date
     
-    # Check permissions
-    if current_user.role == UserRole.HOST and booking["host_id"] != current_user.id:
-        raise HTTPException(status_code=403, detail="Only the host can update booking status")
-    elif current_user.role == UserRole.USER and booking["user_id"] != current_user.id:
-        raise HTTPException(status_code=403, detail="Only the booking owner can cancel")
+    filename = f"bookings_{datetime.now(timezone.utc).strftime('%Y%m%d')}.{format.value}"
+    if format == BookingExportFormat.PARQUET:
+        body, media_type = stream_booking_parquet(query), "application/vnd.apache.parquet"
+    else:
+        body, media_type = stream_booking_csv(query), "text/csv"
     
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+@api_router.put("/bookings/{booking_id}/status")
+async def update_booking_status(booking_id: str, status_data: BookingUpdate, background_tasks: BackgroundTasks, current_user: User = Depends(get_current_user)):
     # Users can only cancel their bookings
     if current_user.role == UserRole.USER and status_data.status != BookingStatus.CANCELLED:
         raise HTTPException(status_code=403, detail="Users can only cancel bookings")
     
-    await db.bookings.update_one(
-        {"id": booking_id},
-        {"$set": {"status": status_data.status}}
+    # Permissions are part of the filter; the previous version of the booking comes back
+    # from the same round trip, so concurrent updates each see the status they replaced
+    owner_field = "host_id" if current_user.role == UserRole.HOST else "user_id"
+    booking = await repos.bookings.find_one_and_update(
+        {"id": booking_id, owner_field: current_user.id},
+        {"$set": {"status": status_data.status}},
+        return_new=False
     )
+    if not booking:
+        existing, archived = await asyncio.gather(
+            repos.bookings.get(booking_id, {"_id": 0, "id": 1}),
+            repos.bookings_archive.get(booking_id, {"_id": 0, "id": 1}),
+        )
+        if existing and current_user.role == UserRole.HOST:
+            raise HTTPException(status_code=403, detail="Only the host can update booking status")
+        if existing:
+            raise HTTPException(status_code=403, detail="Only the booking owner can cancel")
+        if archived:
+            raise HTTPException(status_code=400, detail="Archived bookings can no longer be updated")
+        raise HTTPException(status_code=404, detail="Booking not found")
+    
+    background_tasks.add_task(update_host_rollup, booking, booking.get("status"), status_data.status)
+    calendar_update = calendar_update_for(booking.get("status"), status_data.status)
+    if calendar_update:
+        background_tasks.add_task(calendar_update, booking)
+    publish_booking_event("booking.status", {**booking, "status": status_data.status})
     
     # Send thank you email when booking is completed
     if status_data.status == BookingStatus.COMPLETED:
-        user = await db.users.find_one({"id": booking["user_id"]})
-        car = await db.cars.find_one({"id": booking["car_id"]})
+        user, car = await asyncio.gather(
+            repos.users.get(booking["user_id"], {"_id": 0, "email": 1, "name": 1}),
+            repos.cars.get(booking["car_id"], {"_id": 0, "make": 1, "model": 1}),
+        )
         
         if user and car:
             background_tasks.add_task(
@@ -1168,23 +3610,20 @@ async def update_booking_status(booking_id: str, status_data: BookingUpdate, bac
 
 @api_router.get("/bookings/{booking_id}/receipt")
 async def download_receipt(booking_id: str, current_user: User = Depends(get_current_user)):
-    booking = await db.bookings.find_one({"id": booking_id})
+    booking = await find_booking({"id": booking_id, "user_id": current_user.id})
     if not booking:
+        # Only failed lookups pay for telling "missing" apart from "not yours"
+        if await find_booking({"id": booking_id}):
+            raise HTTPException(status_code=403, detail="Access denied")
         raise HTTPException(status_code=404, detail="Booking not found")
     
-    # Check if user owns this booking
-    if booking["user_id"] != current_user.id:
-        raise HTTPException(status_code=403, detail="Access denied")
-    
-    # Get car and user details
-    car = await db.cars.find_one({"id": booking["car_id"]})
-    user = await db.users.find_one({"id": current_user.id})
-    
-    if not car or not user:
+    # The renter was loaded by authentication; only the car needs a lookup
+    car = await repos.cars.get(booking["car_id"])
+    if not car:
         raise HTTPException(status_code=404, detail="Related data not found")
     
     # Generate PDF receipt
-    pdf_data = generate_booking_receipt(booking, user, car)
+    pdf_data = generate_booking_receipt(booking, current_user.model_dump(), car)
     
     return Response(
         content=pdf_data,
@@ -1194,59 +3633,29 @@ async def download_receipt(booking_id: str, current_user: User = Depends(get_cur
 
 @api_router.put("/cars/{car_id}", response_model=Car)
 async def update_car(car_id: str, car_data: CarCreate, current_user: User = Depends(get_current_user)):
-    print(f"PUT request for car_id: {car_id}")
-    print(f"Current user: {current_user.id}")
-    print(f"User role: {current_user.role}")
-    print(f"Car data received: {car_data}")
-
     if current_user.role != UserRole.HOST:
         raise HTTPException(status_code=403, detail="Only hosts can update cars")
     
-    # Check if car exists and belongs to the current user
-    print(f"Looking for car with id: {car_id} and host_id: {current_user.id}")
-    existing_car = await db.cars.find_one({"id": car_id, "host_id": current_user.id})
-    print(f"Existing car found: {existing_car is not None}")
-    if not existing_car:
-        print("Car not found or permission denied")
-        raise HTTPException(status_code=404, detail="Car not found or you don't have permission to edit it")
-    
     # Check if there are any active bookings for this car
-    print(f"Checking for active bookings for car: {car_id}")
-    active_booking = await db.bookings.find_one({
-        "car_id": car_id,
-        "status": {"$in": ["confirmed", "active"]}
-    })
-    print(f"Active booking found: {active_booking is not None}")
-    
-    if active_booking:
-        print("Active booking exists - cannot update")
+    if await repos.bookings.has_booking_in(car_id, ["confirmed", "active"]):
+        if not await repos.cars.find_one({"id": car_id, "host_id": current_user.id, "deleted_at": None}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Car not found or you don't have permission to edit it")
         raise HTTPException(
             status_code=400, 
             detail="Cannot edit car details while there are active or confirmed bookings"
         )
     
-    # Update car data
-    print("Preparing update data")
+    # Ownership is part of the filter, and the car comes back exactly as this write left it
     update_data = car_data.model_dump()
     update_data["updated_at"] = datetime.now(timezone.utc)
-    print(f"Update data: {update_data}")
-    
-    print("Executing database update")
-    result = await db.cars.update_one(
-        {"id": car_id, "host_id": current_user.id},
+    updated_car = await repos.cars.find_one_and_update(
+        {"id": car_id, "host_id": current_user.id, "deleted_at": None},
         {"$set": update_data}
     )
-    print(f"Update result - matched: {result.matched_count}, modified: {result.modified_count}")
-    
-    if result.modified_count == 0:
-        print("Failed to update car - no modifications made")
-        raise HTTPException(status_code=400, detail="Failed to update car")
+    if not updated_car:
+        raise HTTPException(status_code=404, detail="Car not found or you don't have permission to edit it")
     
-    # Return updated car
-    print("Fetching updated car")
-    updated_car = await db.cars.find_one({"id": car_id})
-    print(f"Updated car found: {updated_car is not None}")
-
+    index_cars([updated_car])
     return Car(**updated_car)
 
 
@@ -1255,45 +3664,42 @@ async def delete_car(car_id: str, current_user: User = Depends(get_current_user)
     if current_user.role != UserRole.HOST:
         raise HTTPException(status_code=403, detail="Only hosts can delete cars")
     
-    # Check if car exists and belongs to the current user
-    existing_car = await db.cars.find_one({"id": car_id, "host_id": current_user.id})
-    if not existing_car:
-        raise HTTPException(status_code=404, detail="Car not found or you don't have permission to delete it")
-    
-    # Check if there are any active bookings for this car
-    active_booking = await db.bookings.find_one({
-        "car_id": car_id,
-        "status": {"$in": ["pending", "confirmed", "active"]}
-    })
+    # Live bookings and booking history (archived bookings count too) are independent checks
+    active_booking, completed_bookings, archived_bookings = await asyncio.gather(
+        repos.bookings.has_booking_in(car_id, LIVE_BOOKING_STATUSES),
+        repos.bookings.has_booking_in(car_id, ["completed"]),
+        repos.bookings_archive.has_booking_in(car_id, ["completed"]),
+    )
     
+    owned = {"id": car_id, "host_id": current_user.id, "deleted_at": None}
     if active_booking:
+        if not await repos.cars.find_one(owned, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Car not found or you don't have permission to delete it")
         raise HTTPException(
             status_code=400, 
             detail="Cannot delete car while there are pending, confirmed, or active bookings"
         )
     
-    # Check if there are any completed bookings (optional - you might want to keep the car for historical purposes)
-    completed_bookings = await db.bookings.count_documents({
-        "car_id": car_id,
-        "status": "completed"
-    })
-    
-    if completed_bookings > 0:
+    if completed_bookings or archived_bookings:
         # Instead of deleting, mark as unavailable
-        await db.cars.update_one(
-            {"id": car_id},
-            {"$set": {"is_available": False, "deleted_at": datetime.now(timezone.utc)}}
+        marked = await repos.cars.find_one_and_update(
+            owned,
+            {"$set": {"is_available": False, "deleted_at": datetime.now(timezone.utc)}},
+            {"_id": 1}
         )
+        if not marked:
+            raise HTTPException(status_code=404, detail="Car not found or you don't have permission to delete it")
+        unindex_car(car_id)
         return {"message": "Car marked as unavailable due to booking history"}
     
     # Delete the car if no bookings exist
-    result = await db.cars.delete_one({"id": car_id, "host_id": current_user.id})
+    if await repos.cars.delete(owned) == 0:
+        raise HTTPException(status_code=404, detail="Car not found or you don't have permission to delete it")
     
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=400, detail="Failed to delete car")
+    unindex_car(car_id)
     
     # Also delete any reviews associated with this car
-    await db.reviews.delete_many({"car_id": car_id})
+    await repos.reviews.delete_many({"car_id": car_id})
     
     return {"message": "Car deleted successfully"}
 
@@ -1304,7 +3710,7 @@ async def create_review(review_data: ReviewCreate, current_user: User = Depends(
         raise HTTPException(status_code=403, detail="Only users can create reviews")
     
     # Check if booking exists and belongs to user
-    booking = await db.bookings.find_one({
+    booking = await find_booking({
         "id": review_data.booking_id,
         "user_id": current_user.id,
         "status": BookingStatus.COMPLETED
@@ -1314,45 +3720,431 @@ async def create_review(review_data: ReviewCreate, current_user: User = Depends(
         raise HTTPException(status_code=404, detail="Booking not found or not completed")
     
     # Check if review already exists
-    existing_review = await db.reviews.find_one({"booking_id": review_data.booking_id})
+    existing_review = await repos.reviews.find_one({"booking_id": review_data.booking_id}, {"_id": 1})
     if existing_review:
         raise HTTPException(status_code=400, detail="Review already exists for this booking")
     
-    review = Review(**review_data.model_dump(), user_id=current_user.id)
-    await db.reviews.insert_one(review.model_dump())
+    review = Review(**review_data.model_dump(), user_id=current_user.id, user_name=current_user.name)
+    await repos.reviews.insert(review.model_dump())
+    trending_tracker.bump(review.car_id, reviews=1, rating_sum=review.rating)
     
-    # Update car average rating
-    car_reviews = await db.reviews.find({"car_id": review_data.car_id}).to_list(1000)
-    if car_reviews:
-        total_rating = sum(r["rating"] for r in car_reviews)
-        average_rating = total_rating / len(car_reviews)
-        
-        await db.cars.update_one(
-            {"id": review_data.car_id},
+    # Update car average rating and per-star distribution
+    await apply_review_to_car_summary(review_data.car_id, review_data.rating)
+    invalidation_bus.publish("car", [review_data.car_id])
+    
+    return review
+
+@api_router.get("/reviews/car/{car_id}", response_model=dict)
+async def get_car_reviews(car_id: str, sort: ReviewSort = ReviewSort.NEWEST, limit: int = REVIEW_PAGE_SIZE, cursor: Optional[str] = None):
+    return await fetch_review_page(car_id, sort, limit, cursor)
+
+# Host Analytics Routes
+@api_router.get("/host/analytics")
+async def get_host_analytics(months: int = 12, current_user: User = Depends(get_current_user)):
+    if current_user.role != UserRole.HOST:
+        raise HTTPException(status_code=403, detail="Only hosts can view analytics")
+    
+    if months < 1 or months > 60:
+        raise HTTPException(status_code=400, detail="months must be between 1 and 60")
+    require_persistent_backend("Host analytics")
+    
+    now = datetime.now(timezone.utc)
+    window_start = now - timedelta(days=30 * months)
+    
+    # Everything is answered from the daily rollups, so the cost depends on
+    # fleet size and window length rather than on booking history
+    sums = {
+        "bookings": {"$sum": "$bookings"},
+        "cancellations": {"$sum": "$cancellations"},
+        "completions": {"$sum": "$completions"},
+        "earnings": {"$sum": "$earnings"},
+        "rental_days": {"$sum": "$rental_days"},
+    }
+    pipeline = [
+        {"$match": {"host_id": current_user.id, "day": {"$gte": window_start.strftime("%Y-%m-%d")}}},
+        {"$facet": {
+            "by_month": [{"$group": {"_id": "$month", **sums}}, {"$sort": {"_id": 1}}],
+            "by_car": [{"$group": {"_id": "$car_id", **sums}}],
+            "totals": [{"$group": {"_id": None, **sums}}],
+        }},
+    ]
+    result = await db.host_daily_rollups.aggregate(pipeline).to_list(1)
+    facets = result[0] if result else {"by_month": [], "by_car": [], "totals": []}
+    
+    cars = await repos.cars.list_by_host(
+        current_user.id, include_deleted=True,
+        projection={"_id": 0, "id": 1, "make": 1, "model": 1, "year": 1, "created_at": 1}
+    )
+    car_stats = {row["_id"]: row for row in facets["by_car"]}
+    
+    def summarize(row: dict) -> dict:
+        bookings = row.get("bookings", 0)
+        kept = bookings - row.get("cancellations", 0)
+        return {
+            "bookings": bookings,
+            "cancellations": row.get("cancellations", 0),
+            "completions": row.get("completions", 0),
+            "earnings": round(row.get("earnings", 0.0), 2),
+            "rental_days": row.get("rental_days", 0),
+            "average_booking_length": round(row.get("rental_days", 0) / kept, 2) if kept else 0.0,
+            "cancellation_rate": round(row.get("cancellations", 0) / bookings, 4) if bookings else 0.0,
+        }
+    
+    utilization = []
+    for car in cars:
+        created_at = car.get("created_at") or window_start
+        if created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=timezone.utc)
+        window_days = max((now - max(created_at, window_start)).days, 1)
+        stats = summarize(car_stats.get(car["id"], {}))
+        utilization.append({
+            "car_id": car["id"],
+            "car": f"{car.get('year')} {car.get('make')} {car.get('model')}",
+            **stats,
+            "utilization": round(min(stats["rental_days"] / window_days, 1.0), 4),
+        })
+    
+    return {
+        "window_start": window_start.strftime("%Y-%m-%d"),
+        "months": months,
+        "totals": summarize(facets["totals"][0] if facets["totals"] else {}),
+        "earnings_by_month": [
+            {"month": row["_id"], **summarize(row)} for row in facets["by_month"]
+        ],
+        "cars": utilization,
+    }
+
+# Calendar Routes
+@api_router.get("/cars/{car_id}/calendar")
+async def get_car_calendar(car_id: str, year: int, month: int):
+    if month < 1 or month > 12:
+        raise HTTPException(status_code=400, detail="month must be between 1 and 12")
+    if year < 1 or year > 9999:
+        raise HTTPException(status_code=400, detail="year must be between 1 and 9999")
+    require_persistent_backend("Availability calendars")
+    
+    calendar = await db.car_calendars.find_one({"car_id": car_id, "year": year}, {"_id": 0, f"m{month}": 1})
+    bitmap = (calendar or {}).get(f"m{month}", 0)
+    return {"car_id": car_id, "year": year, "month": month, "bitmap": bitmap, "booked_days": bitmap_days(bitmap)}
+
+@api_router.get("/calendar")
+async def get_fleet_calendar(car_ids: str, year: int, month: int):
+    if month < 1 or month > 12:
+        raise HTTPException(status_code=400, detail="month must be between 1 and 12")
+    if year < 1 or year > 9999:
+        raise HTTPException(status_code=400, detail="year must be between 1 and 9999")
+    require_persistent_backend("Availability calendars")
+    
+    ids = [car_id for car_id in car_ids.split(",") if car_id][:MAX_QUOTE_CARS]
+    calendars = await db.car_calendars.find(
+        {"car_id": {"$in": ids}, "year": year}, {"_id": 0, "car_id": 1, f"m{month}": 1}
+    ).to_list(len(ids))
+    bitmaps = {car_id: 0 for car_id in ids}
+    for calendar in calendars:
+        bitmaps[calendar["car_id"]] = calendar.get(f"m{month}", 0)
+    
+    # Bitwise across the fleet: a day is free in all cars if no bitmap has it set,
+    # and free in at least one car unless every bitmap has it set
+    booked_in_any = 0
+    booked_in_all = CALENDAR_MONTH_MASK if ids else 0
+    for bitmap in bitmaps.values():
+        booked_in_any |= bitmap
+        booked_in_all &= bitmap
+    
+    # December always has 31 days, and year 9999 has no following January
+    days_in_month = 31 if month == 12 else (datetime(year, month + 1, 1) - datetime(year, month, 1)).days
+    month_mask = (1 << days_in_month) - 1
+    return {
+        "year": year,
+        "month": month,
+        "cars": {car_id: bitmap_days(bitmap) for car_id, bitmap in bitmaps.items()},
+        "free_in_all": bitmap_days(~booked_in_any & month_mask),
+        "free_in_any": bitmap_days(~booked_in_all & month_mask),
+    }
+
+# Quote Routes
+@api_router.get("/quote")
+async def get_quote(car_id: str, start_date: datetime, end_date: datetime):
+    car = await repos.cars.find_one({"id": car_id, "deleted_at": None}, {"_id": 0, "id": 1, "price_per_day": 1})
+    if not car:
+        raise HTTPException(status_code=404, detail="Car not found")
+    
+    return quote_car(car, start_date, end_date)
+
+@api_router.post("/quotes")
+async def get_quotes(quote_request: QuoteRequest):
+    if len(quote_request.car_ids) > MAX_QUOTE_CARS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_QUOTE_CARS} cars can be quoted at once")
+    
+    cars = await repos.cars.find(
+        {"id": {"$in": quote_request.car_ids}, "deleted_at": None},
+        {"_id": 0, "id": 1, "price_per_day": 1},
+        limit=len(quote_request.car_ids)
+    )
+    if not cars:
+        return {"quotes": []}
+    
+    quotes = quote_prices([car["price_per_day"] for car in cars], quote_request.start_date, quote_request.end_date)
+    return {
+        "days": quotes["days"],
+        "discount": quotes["discount"],
+        "quotes": [
             {
-                "$set": {
-                    "average_rating": round(average_rating, 1),
-                    "total_reviews": len(car_reviews)
-                }
+                "car_id": car["id"],
+                "price_per_day": car["price_per_day"],
+                "subtotal": quotes["subtotals"][index],
+                "total": quotes["totals"][index],
             }
+            for index, car in enumerate(cars)
+        ],
+    }
+
+# Fleet Bulk Routes
+@api_router.post("/cars/bulk")
+async def bulk_update_cars(update: CarBulkUpdate, current_user: User = Depends(get_current_user)):
+    if current_user.role != UserRole.HOST:
+        raise HTTPException(status_code=403, detail="Only hosts can update cars")
+    if (update.car_ids is None) == (update.location is None):
+        raise HTTPException(status_code=400, detail="Provide either car_ids or location")
+    if update.price_per_day is not None and update.price_multiplier is not None:
+        raise HTTPException(status_code=400, detail="Use either price_per_day or price_multiplier")
+    if update.price_per_day is None and update.price_multiplier is None and update.is_available is None:
+        raise HTTPException(status_code=400, detail="Nothing to update")
+    if (update.price_per_day is not None and update.price_per_day <= 0) or (update.price_multiplier is not None and update.price_multiplier <= 0):
+        raise HTTPException(status_code=400, detail="Prices must be positive")
+    
+    # Ownership is part of the query, so other hosts' cars are simply not found
+    query = {"host_id": current_user.id, "deleted_at": None}
+    if update.car_ids is not None:
+        if len(update.car_ids) > MAX_BULK_ITEMS:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_ITEMS} cars can be updated at once")
+        query["id"] = {"$in": update.car_ids}
+    else:
+        query["location"] = {"$regex": f"^{re.escape(update.location)}$", "$options": "i"}
+    
+    cars = await repos.cars.find(query, {"_id": 0}, limit=MAX_BULK_ITEMS + 1)
+    if len(cars) > MAX_BULK_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Selector matches more than {MAX_BULK_ITEMS} cars")
+    
+    skipped = []
+    if update.car_ids is not None:
+        found = {car["id"] for car in cars}
+        skipped += [
+            {"car_id": car_id, "reason": "Car not found or you don't have permission to edit it"}
+            for car_id in dict.fromkeys(update.car_ids) if car_id not in found
+        ]
+    
+    # Same rule as PUT /cars/{car_id}, checked for the whole fleet in one query
+    changes_price = update.price_per_day is not None or update.price_multiplier is not None
+    if changes_price and cars:
+        busy = await repos.bookings.cars_with_booking_in([car["id"] for car in cars], ["confirmed", "active"])
+        skipped += [
+            {"car_id": car["id"], "reason": "Cannot edit car details while there are active or confirmed bookings"}
+            for car in cars if car["id"] in busy
+        ]
+        cars = [car for car in cars if car["id"] not in busy]
+    
+    now = datetime.now(timezone.utc)
+    operations = []
+    for car in cars:
+        changes = {"updated_at": now}
+        if update.price_per_day is not None:
+            changes["price_per_day"] = update.price_per_day
+        elif update.price_multiplier is not None:
+            changes["price_per_day"] = round(car["price_per_day"] * update.price_multiplier, 2)
+        if update.is_available is not None:
+            changes["is_available"] = update.is_available
+        operations.append(({"id": car["id"], "host_id": current_user.id}, {"$set": changes}))
+        car.update(changes)
+    updated = await repos.cars.bulk_update(operations)
+    
+    # Cars switched off are dropped from the indexes, and other workers hear about all of them at once
+    index_cars(cars)
+    
+    return {"matched": len(cars), "updated": updated, "skipped": skipped}
+
+def bookings_overlap(first: dict, second: dict) -> bool:
+    return parse_date(first["start_date"]) <= parse_date(second["end_date"]) and parse_date(first["end_date"]) >= parse_date(second["start_date"])
+
+@api_router.post("/bookings/bulk-status")
+async def bulk_update_booking_status(update: BookingBulkStatusUpdate, background_tasks: BackgroundTasks, current_user: User = Depends(get_current_user)):
+    if current_user.role != UserRole.HOST:
+        raise HTTPException(status_code=403, detail="Only hosts can update bookings in bulk")
+    
+    query = {"host_id": current_user.id}
+    if update.booking_ids is not None:
+        if len(update.booking_ids) > MAX_BULK_ITEMS:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_ITEMS} bookings can be updated at once")
+        query["id"] = {"$in": update.booking_ids}
+    elif update.current_status is not None:
+        query["status"] = update.current_status
+        if update.start_from or update.start_to:
+            query["start_date"] = {}
+            if update.start_from:
+                query["start_date"]["$gte"] = update.start_from
+            if update.start_to:
+                query["start_date"]["$lt"] = update.start_to
+    else:
+        raise HTTPException(status_code=400, detail="Provide either booking_ids or current_status")
+    
+    bookings = await repos.bookings.find(query, limit=MAX_BULK_ITEMS + 1)
+    if len(bookings) > MAX_BULK_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Selector matches more than {MAX_BULK_ITEMS} bookings")
+    
+    skipped = []
+    if update.booking_ids is not None:
+        found = {booking["id"] for booking in bookings}
+        skipped += [
+            {"booking_id": booking_id, "reason": "Booking not found"}
+            for booking_id in dict.fromkeys(update.booking_ids) if booking_id not in found
+        ]
+    skipped += [
+        {"booking_id": booking["id"], "reason": f"Booking is already {update.status.value}"}
+        for booking in bookings if booking["status"] == update.status
+    ]
+    bookings = [booking for booking in bookings if booking["status"] != update.status]
+    
+    # Reinstating cancelled bookings must not double-book a car: every candidate is
+    # checked against one query for the live bookings of the cars involved
+    reinstating = [
+        booking for booking in bookings
+        if booking["status"] == BookingStatus.CANCELLED and update.status in LIVE_BOOKING_STATUSES
+    ]
+    if reinstating:
+        live = await repos.bookings.find({
+            "car_id": {"$in": list({booking["car_id"] for booking in reinstating})},
+            "status": {"$in": LIVE_BOOKING_STATUSES},
+            "start_date": {"$lte": max(parse_date(booking["end_date"]) for booking in reinstating)},
+            "end_date": {"$gte": min(parse_date(booking["start_date"]) for booking in reinstating)},
+        }, {"_id": 0, "car_id": 1, "start_date": 1, "end_date": 1}, limit=0)
+        live_by_car = {}
+        for booking in live:
+            live_by_car.setdefault(booking["car_id"], []).append(booking)
+        
+        conflicts = set()
+        for booking in reinstating:
+            taken = live_by_car.setdefault(booking["car_id"], [])
+            if any(bookings_overlap(booking, other) for other in taken):
+                conflicts.add(booking["id"])
+                skipped.append({"booking_id": booking["id"], "reason": "Car is not available for selected dates"})
+            else:
+                taken.append(booking)
+        bookings = [booking for booking in bookings if booking["id"] not in conflicts]
+    
+    # Each write only applies if the booking still has the status it was read with, so a
+    # concurrent change in between is reported as a conflict instead of being overwritten
+    updated = await repos.bookings.bulk_update([
+        ({"id": booking["id"], "status": booking["status"]}, {"$set": {"status": update.status}})
+        for booking in bookings
+    ])
+    if updated < len(bookings):
+        not_applied = await repos.bookings.find(
+            {"id": {"$in": [booking["id"] for booking in bookings]}, "status": {"$ne": update.status}},
+            {"_id": 0, "id": 1}, limit=0
         )
+        conflicts = {booking["id"] for booking in not_applied}
+        skipped += [
+            {"booking_id": booking["id"], "reason": "Booking status changed concurrently"}
+            for booking in bookings if booking["id"] in conflicts
+        ]
+        bookings = [booking for booking in bookings if booking["id"] not in conflicts]
     
-    return review
+    background_tasks.add_task(update_host_rollups, [(booking, booking["status"], update.status) for booking in bookings])
+    for booking in bookings:
+        calendar_update = calendar_update_for(booking["status"], update.status)
+        if calendar_update:
+            background_tasks.add_task(calendar_update, booking)
+        publish_booking_event("booking.status", {**booking, "status": update.status})
+    
+    # Thank-you emails for the whole batch: two lookups and one SMTP session
+    if update.status == BookingStatus.COMPLETED and bookings:
+        users, cars = await asyncio.gather(
+            repos.users.get_many([booking["user_id"] for booking in bookings], {"_id": 0, "email": 1, "name": 1}),
+            repos.cars.get_many([booking["car_id"] for booking in bookings], {"_id": 0, "make": 1, "model": 1}),
+        )
+        recipients = [
+            (users[booking["user_id"]]["email"], users[booking["user_id"]]["name"],
+             {"make": cars[booking["car_id"]]["make"], "model": cars[booking["car_id"]]["model"]})
+            for booking in bookings
+            if booking["user_id"] in users and booking["car_id"] in cars
+        ]
+        if recipients:
+            background_tasks.add_task(send_thank_you_emails, recipients)
+    
+    return {"matched": len(bookings), "updated": updated, "skipped": skipped}
 
-@api_router.get("/reviews/car/{car_id}", response_model=List[dict])
-async def get_car_reviews(car_id: str):
-    reviews = await db.reviews.find({"car_id": car_id}).to_list(1000)
+# Campaign Routes
+@api_router.post("/campaigns", response_model=dict)
+async def create_campaign(campaign_data: CampaignCreate, request: Request):
+    require_campaign_token(request)
+    require_persistent_backend("Campaigns")
+    if campaign_data.segment == CampaignSegment.HOSTS_IN_LOCATION and not campaign_data.location:
+        raise HTTPException(status_code=400, detail="location is required for hosts_in_location")
     
-    # Add user names to reviews
-    review_list = []
-    for review in reviews:
-        user = await db.users.find_one({"id": review["user_id"]})
-        review_obj = Review(**review)
-        review_dict = review_obj.model_dump()
-        review_dict["user_name"] = user["name"] if user else "Anonymous"
-        review_list.append(review_dict)
+    # Templates are compiled once here; a bad field fails the request instead of every message
+    try:
+        subject = CompiledTemplate(campaign_data.subject)
+        html_body = CompiledTemplate(CAMPAIGN_LAYOUT_HEAD + campaign_data.html_template + CAMPAIGN_LAYOUT_TAIL, escape=True)
+        text_body = CompiledTemplate(campaign_data.text_template) if campaign_data.text_template else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    return review_list
+    rate = campaign_data.rate_per_second or CAMPAIGN_SEND_RATE
+    if not 0 < rate <= CAMPAIGN_MAX_SEND_RATE:
+        raise HTTPException(status_code=400, detail=f"rate_per_second must be between 0 and {CAMPAIGN_MAX_SEND_RATE:g}")
+    
+    campaign = {
+        "id": str(uuid.uuid4()),
+        "subject": campaign_data.subject,
+        "segment": campaign_data.segment,
+        "location": campaign_data.location,
+        "rate_per_second": rate,
+        "status": "queued",
+        "recipients": 0,
+        "sent": 0,
+        "failed": 0,
+        "created_at": datetime.now(timezone.utc),
+    }
+    await db.campaigns.insert_one(dict(campaign))
+    
+    task = asyncio.create_task(run_campaign(campaign, subject, html_body, text_body))
+    campaign_tasks.add(task)
+    task.add_done_callback(campaign_tasks.discard)
+    return campaign
+
+@api_router.get("/campaigns/{campaign_id}", response_model=dict)
+async def get_campaign(campaign_id: str, request: Request):
+    require_campaign_token(request)
+    require_persistent_backend("Campaigns")
+    campaign = await db.campaigns.find_one({"id": campaign_id}, {"_id": 0})
+    if not campaign:
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    return campaign
+
+# Metrics Routes
+def require_metrics_token(request: Request):
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=403, detail="Metrics are disabled")
+    if not secrets.compare_digest(request.headers.get("x-metrics-token", ""), METRICS_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid metrics token")
+
+@api_router.get("/metrics")
+async def get_metrics(request: Request):
+    require_metrics_token(request)
+    return {
+        "admission": {name: limiter.stats() for name, limiter in admission_limiters.items()},
+        "booking_events": {
+            "source": booking_event_hub.source,
+            "subscribers": sum(len(queues) for queues in booking_event_hub.subscribers.values()),
+            "published": booking_event_hub.published,
+            "dropped": booking_event_hub.dropped,
+        },
+        "reviewer_names": reviewer_name_stats,
+        "trending": trending_tracker.stats(),
+        "traffic_capture": traffic_recorder.stats(),
+        "invalidation": invalidation_bus.stats(),
+        "coalescing": {flight.name: flight.stats() for flight in (car_detail_flight, car_listing_flight)},
+    }
 
 # Include the router in the main app
 app.include_router(api_router)
@@ -1372,6 +4164,93 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Startup
+@app.on_event("startup")
+async def create_indexes():
+    if not repos.persistent:
+        return
+    await db.host_daily_rollups.create_index(
+        [("host_id", 1), ("day", 1), ("car_id", 1)], unique=True
+    )
+    # Lookups by id, including the per-row $lookup joins of booking exports
+    await db.users.create_index([("id", 1)], unique=True)
+    await db.cars.create_index([("id", 1)], unique=True)
+    await db.reviews.create_index([("user_id", 1)])
+    await db.reviews.create_index([("car_id", 1), ("created_at", -1), ("id", -1)])
+    await db.reviews.create_index([("car_id", 1), ("rating", -1), ("created_at", -1), ("id", -1)])
+    
+    # Live rows only: terminal bookings leave the hot set and soft-deleted cars
+    # are never available, so these indexes stay small enough to live in RAM
+    # $in in a partial filter needs MongoDB 6.0; older servers get a full index
+    try:
+        await db.bookings.create_index(
+            [("car_id", 1), ("start_date", 1), ("end_date", 1)],
+            name="live_bookings_by_car",
+            partialFilterExpression={"status": {"$in": LIVE_BOOKING_STATUSES}}
+        )
+    except OperationFailure as e:
+        print(f"Partial index live_bookings_by_car not supported, using a full index: {e}")
+        await db.bookings.create_index(
+            [("car_id", 1), ("start_date", 1), ("end_date", 1)],
+            name="live_bookings_by_car"
+        )
+    await db.bookings.create_index([("id", 1)], unique=True)
+    await db.bookings.create_index([("user_id", 1)])
+    await db.bookings.create_index([("host_id", 1)])
+    await db.bookings.create_index([("host_id", 1), ("start_date", 1)])
+    await db.bookings.create_index([("user_id", 1), ("start_date", 1)])
+    await db.bookings.create_index([("status", 1), ("end_date", 1)])
+    await db.bookings_archive.create_index([("id", 1)], unique=True)
+    await db.bookings_archive.create_index([("user_id", 1)])
+    await db.bookings_archive.create_index([("host_id", 1)])
+    await db.bookings_archive.create_index([("host_id", 1), ("start_date", 1)])
+    await db.bookings_archive.create_index([("user_id", 1), ("start_date", 1)])
+    await db.bookings_archive.create_index([("car_id", 1), ("status", 1)])
+    await db.car_calendars.create_index([("car_id", 1), ("year", 1)], unique=True)
+    await db.stream_tickets.create_index([("jti", 1)], unique=True)
+    await db.stream_tickets.create_index([("expires_at", 1)], expireAfterSeconds=0)
+    await db.car_activity.create_index([("car_id", 1), ("hour", 1)], unique=True)
+    # Buckets past the window are never read again
+    await db.car_activity.create_index([("hour", 1)], expireAfterSeconds=(TRENDING_WINDOW_HOURS + 24) * 3600)
+    await db.cars.create_index(
+        [("location", 1)],
+        name="available_cars_by_location",
+        partialFilterExpression={"is_available": True}
+    )
+
+@app.on_event("startup")
+async def start_car_indexes():
+    asyncio.create_task(car_index_refresh_loop())
+
+@app.on_event("startup")
+async def start_invalidation_bus():
+    if repos.persistent:
+        asyncio.create_task(invalidation_bus.run())
+
+@app.on_event("startup")
+async def start_trending():
+    asyncio.create_task(trending_refresh_loop())
+
+@app.on_event("startup")
+async def start_booking_events():
+    if BOOKING_EVENTS_SOURCE in ("auto", "change_stream") and repos.persistent:
+        asyncio.create_task(watch_booking_changes())
+
+@app.on_event("startup")
+async def start_traffic_capture():
+    if traffic_recorder.enabled:
+        asyncio.create_task(traffic_capture_loop())
+
+@app.on_event("shutdown")
+async def flush_traffic_capture():
+    if traffic_recorder.enabled:
+        await traffic_recorder.flush()
+
+@app.on_event("startup")
+async def start_booking_archive():
+    if BOOKING_ARCHIVE_INTERVAL_HOURS > 0:
+        asyncio.create_task(booking_archive_loop())
+
 if __name__ == "__main__":
     import uvicorn # type: ignore
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,61 @@
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+# The API runs against the in-memory repositories, so no mongod is needed
+os.environ["DATA_BACKEND"] = "memory"
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "carshare_test")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pytest # type: ignore
+from fastapi.testclient import TestClient # type: ignore
+
+import server
+from repositories import create_repositories
+
+
+@pytest.fixture
+def repos(monkeypatch):
+    fresh = create_repositories("memory")
+    monkeypatch.setattr(server, "repos", fresh)
+    return fresh
+
+
+@pytest.fixture
+def client(repos, monkeypatch):
+    for name in dir(server):
+        if name.startswith("send_") and name.endswith("_email"):
+            monkeypatch.setattr(server, name, lambda *args, **kwargs: True)
+    # Not used as a context manager, so startup jobs that need MongoDB never run
+    return TestClient(server.app)
+
+
+@pytest.fixture
+def make_user(client, repos):
+    """Register and verify a user; returns (auth headers, user id)"""
+    def make(email: str, role: str = "user"):
+        response = client.post("/api/auth/register", json={"email": email, "password": "secret", "name": email.split("@")[0], "role": role})
+        assert response.status_code == 200, response.text
+        user = asyncio.run(repos.users.get_by_email(email))
+        response = client.post("/api/auth/verify-email", json={"token": user["verification_token"]})
+        assert response.status_code == 200, response.text
+        body = response.json()
+        return {"Authorization": f"Bearer {body['access_token']}"}, body["user"]["id"]
+    return make
+
+
+@pytest.fixture
+def make_car(client):
+    def make(headers: dict, **fields):
+        car = {
+            "make": "Tesla", "model": "Model 3", "year": 2022, "color": "red", "price_per_day": 100,
+            "description": "Electric sedan", "image_url": "https://example.com/car.jpg",
+            "location": "Austin, TX", "features": ["GPS"],
+        }
+        car.update(fields)
+        response = client.post("/api/cars", json=car, headers=headers)
+        assert response.status_code == 200, response.text
+        return response.json()["id"]
+    return make
@@ -0,0 +1,32 @@
+import asyncio
+
+import server
+
+
+def test_queue_wait_stats_only_count_admitted_requests():
+    async def scenario():
+        limiter = server.AdmissionLimiter("test", concurrency=1, queue_size=4)
+        assert await limiter.acquire(1.0)
+        # Times out in the queue and is shed
+        assert not await limiter.acquire(0.05)
+        waiter = asyncio.create_task(limiter.acquire(1.0))
+        await asyncio.sleep(0.02)
+        limiter.release()
+        assert await waiter
+        return limiter.stats()
+
+    stats = asyncio.run(scenario())
+    assert (stats["admitted"], stats["shed"], stats["queued"]) == (2, 1, 1)
+    assert stats["queue_wait_max_ms"] < 50
+
+
+def test_metrics_need_the_operator_token(client, monkeypatch):
+    monkeypatch.setattr(server, "METRICS_TOKEN", "")
+    assert client.get("/api/metrics").status_code == 403
+
+    monkeypatch.setattr(server, "METRICS_TOKEN", "operator")
+    assert client.get("/api/metrics").status_code == 403
+    assert client.get("/api/metrics", headers={"X-Metrics-Token": "wrong"}).status_code == 403
+    response = client.get("/api/metrics", headers={"X-Metrics-Token": "operator"})
+    assert response.status_code == 200
+    assert "admission" in response.json()
@@ -0,0 +1,114 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest # type: ignore
+
+import server
+
+
+START = datetime(2030, 5, 6, 10, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def rental(client, make_user, make_car):
+    host, host_id = make_user("host@example.com", "host")
+    renter, renter_id = make_user("renter@example.com")
+    car_id = make_car(host)
+    return {"host": host, "renter": renter, "car_id": car_id}
+
+
+def book(client, rental, start=START, days=2, total=None):
+    dates = {"start_date": start.isoformat(), "end_date": (start + timedelta(days=days)).isoformat()}
+    if total is None:
+        total = client.get("/api/quote", params={"car_id": rental["car_id"], **dates}).json()["total"]
+    return client.post(
+        "/api/bookings",
+        json={"car_id": rental["car_id"], "total_amount": total, "driver_license": "D123", **dates},
+        headers=rental["renter"],
+    )
+
+
+def set_status(client, rental, booking_id, status, as_role="host"):
+    return client.put(f"/api/bookings/{booking_id}/status", json={"status": status}, headers=rental[as_role])
+
+
+def test_booking_lifecycle(client, repos, rental):
+    created = book(client, rental)
+    assert created.status_code == 200, created.text
+    booking_id = created.json()["id"]
+    assert created.json()["status"] == "confirmed"
+
+    # The car is taken for those dates
+    assert book(client, rental, START + timedelta(days=1)).status_code == 400
+
+    assert set_status(client, rental, booking_id, "active", as_role="renter").status_code == 403
+    for status in ("active", "completed"):
+        response = set_status(client, rental, booking_id, status)
+        assert response.status_code == 200, response.text
+
+    listed = client.get("/api/bookings", headers=rental["renter"]).json()
+    assert [(booking["id"], booking["status"]) for booking in listed] == [(booking_id, "completed")]
+
+    review = client.post(
+        "/api/reviews",
+        json={"car_id": rental["car_id"], "booking_id": booking_id, "rating": 4, "comment": "Great"},
+        headers=rental["renter"],
+    )
+    assert review.status_code == 200, review.text
+    car = client.get(f"/api/cars/{rental['car_id']}").json()
+    assert car["average_rating"] == 4.0
+    assert [review["comment"] for review in car["reviews"]] == ["Great"]
+
+
+def test_cancelled_booking_frees_the_dates(client, rental):
+    booking_id = book(client, rental).json()["id"]
+    assert set_status(client, rental, booking_id, "cancelled", as_role="renter").status_code == 200
+    assert book(client, rental).status_code == 200
+
+
+def test_booking_total_must_match_the_quote(client, rental):
+    response = book(client, rental, total=1.0)
+    assert response.status_code == 400
+    assert "does not match" in response.json()["detail"]
+
+
+def test_bulk_status_reports_missing_unchanged_and_conflicting_bookings(client, repos, rental):
+    ids = [book(client, rental, START + timedelta(days=10 * i)).json()["id"] for i in range(3)]
+    set_status(client, rental, ids[2], "active")
+
+    response = client.post(
+        "/api/bookings/bulk-status",
+        json={"booking_ids": ids + ["missing"], "status": "active"},
+        headers=rental["host"],
+    )
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert (body["matched"], body["updated"]) == (2, 2)
+    assert {(item["booking_id"], item["reason"]) for item in body["skipped"]} == {
+        ("missing", "Booking not found"),
+        (ids[2], "Booking is already active"),
+    }
+
+
+def test_bulk_status_skips_bookings_changed_concurrently(client, repos, rental, monkeypatch):
+    ids = [book(client, rental, START + timedelta(days=10 * i)).json()["id"] for i in range(2)]
+    published = []
+    monkeypatch.setattr(server, "publish_booking_event", lambda event_type, booking: published.append(booking["id"]))
+
+    # Another request cancels the second booking between the read and the write
+    bulk_update = repos.bookings.bulk_update
+    async def racing_bulk_update(operations):
+        await repos.bookings.update({"id": ids[1]}, {"$set": {"status": "cancelled"}})
+        return await bulk_update(operations)
+    monkeypatch.setattr(repos.bookings, "bulk_update", racing_bulk_update)
+
+    body = client.post("/api/bookings/bulk-status", json={"booking_ids": ids, "status": "active"}, headers=rental["host"]).json()
+    assert (body["matched"], body["updated"]) == (1, 1)
+    assert body["skipped"] == [{"booking_id": ids[1], "reason": "Booking status changed concurrently"}]
+    assert published == [ids[0]]
+    statuses = [booking["status"] for booking in client.get("/api/bookings", headers=rental["host"]).json()]
+    assert sorted(statuses) == ["active", "cancelled"]
+
+
+def test_only_hosts_update_in_bulk(client, rental):
+    response = client.post("/api/bookings/bulk-status", json={"current_status": "confirmed", "status": "active"}, headers=rental["renter"])
+    assert response.status_code == 403
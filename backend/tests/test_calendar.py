@@ -0,0 +1,28 @@
+import pytest # type: ignore
+
+import server
+
+
+@pytest.mark.parametrize("path", ["/api/cars/car-1/calendar", "/api/calendar"])
+@pytest.mark.parametrize("year, month", [(0, 1), (-5, 6), (10000, 1), (2030, 0), (2030, 13)])
+def test_calendar_rejects_out_of_range_dates(client, path, year, month):
+    response = client.get(path, params={"car_ids": "car-1", "year": year, "month": month})
+    assert response.status_code == 400
+
+
+def test_fleet_calendar_handles_december_of_the_last_year(client, repos, monkeypatch):
+    # Calendars live in MongoDB only; an empty fake collection is enough here
+    class NoCalendars:
+        def find(self, *args, **kwargs):
+            return self
+
+        async def to_list(self, length):
+            return []
+
+    class FakeDatabase:
+        car_calendars = NoCalendars()
+
+    monkeypatch.setattr(repos, "persistent", True)
+    monkeypatch.setattr(server, "db", FakeDatabase())
+    response = client.get("/api/calendar", params={"car_ids": "car-1", "year": 9999, "month": 12})
+    assert response.status_code == 200, response.text
@@ -0,0 +1,30 @@
+import server
+
+
+def test_sanitize_captured_redacts_credentials_and_one_time_codes():
+    body = {
+        "email": "Renter@Example.com",
+        "otp": "123456",
+        "new_password": "hunter2",
+        "verification_code": 987654,
+        "pin": 1234,
+        "ticket": "abc",
+        "driver_license": "data:image/png;base64,AAAA",
+        "phone": "555-0100",
+        "rating": 5,
+        "location": "Austin, TX",
+    }
+    captured = server.sanitize_captured(body)
+    for key in ("otp", "new_password", "verification_code", "pin", "ticket", "driver_license", "phone"):
+        assert captured[key] == "redacted", key
+    assert captured["email"] == server.sanitize_captured({"email": "renter@example.com"})["email"] != body["email"]
+    assert (captured["rating"], captured["location"]) == (5, "Austin, TX")
+
+
+def test_reset_password_body_is_captured_without_the_otp(client, monkeypatch):
+    recorder = server.TrafficRecorder("capture.jsonl")
+    monkeypatch.setattr(server, "traffic_recorder", recorder)
+    monkeypatch.setattr(server, "TRAFFIC_CAPTURE_SAMPLE_RATE", 1.0)
+    client.post("/api/auth/reset-password", json={"email": "someone@example.com", "otp": "123456", "new_password": "hunter22"})
+    bodies = [entry.get("b") for entry in recorder.buffer]
+    assert bodies and all("123456" not in str(body) and "hunter22" not in str(body) for body in bodies)
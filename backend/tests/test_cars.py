@@ -0,0 +1,34 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import server
+
+
+def test_listing_embeds_only_the_first_review_page(client, repos, make_user, make_car):
+    host, _ = make_user("host@example.com", "host")
+    car_id = make_car(host)
+    other_id = make_car(host, make="Honda", model="Civic")
+    now = datetime.now(timezone.utc)
+    reviews = [
+        {"id": f"r{i:02d}", "car_id": car_id, "user_id": "someone", "user_name": "Sam", "booking_id": f"b{i}",
+         "rating": 5, "comment": "Nice", "created_at": now - timedelta(minutes=i)}
+        for i in range(server.REVIEW_PAGE_SIZE + 3)
+    ]
+    asyncio.run(repos.reviews.insert_many(reviews))
+
+    cars = {car["id"]: car for car in client.get("/api/cars").json()}
+    listed = cars[car_id]
+    assert [review["id"] for review in listed["reviews"]] == [f"r{i:02d}" for i in range(server.REVIEW_PAGE_SIZE)]
+    assert listed["reviews_next_cursor"] == client.get(f"/api/cars/{car_id}").json()["reviews_next_cursor"]
+    assert (cars[other_id]["reviews"], cars[other_id]["reviews_next_cursor"]) == ([], None)
+
+    rest = client.get(f"/api/reviews/car/{car_id}", params={"cursor": listed["reviews_next_cursor"]}).json()
+    assert [review["id"] for review in rest["reviews"]] == [f"r{i:02d}" for i in range(server.REVIEW_PAGE_SIZE, server.REVIEW_PAGE_SIZE + 3)]
+    assert rest["next_cursor"] is None
+
+
+def test_card_view_leaves_reviews_out(client, make_user, make_car):
+    host, _ = make_user("host@example.com", "host")
+    make_car(host)
+    card = client.get("/api/cars", params={"view": "card"}).json()[0]
+    assert set(card) == set(server.CAR_VIEWS["card"])
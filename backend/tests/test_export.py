@@ -0,0 +1,51 @@
+import asyncio
+import csv
+import io
+from datetime import datetime, timedelta
+
+import server
+
+
+def history_rows(*start_days):
+    async def stream():
+        for day in start_days:
+            yield {"id": f"b{day}", "start_date": datetime(2030, 1, day)}
+    return stream()
+
+
+def test_merge_by_start_date_interleaves_sorted_streams():
+    async def collect():
+        return [row["id"] async for row in server.merge_by_start_date(history_rows(1, 4, 9), history_rows(2, 3, 10), history_rows())]
+    assert asyncio.run(collect()) == ["b1", "b2", "b3", "b4", "b9", "b10"]
+
+
+def test_csv_export_lists_archived_and_live_bookings_oldest_first(client, repos, make_user, make_car):
+    host, host_id = make_user("host@example.com", "host")
+    renter, renter_id = make_user("renter@example.com")
+    car_id = make_car(host)
+
+    def booking(booking_id, start, status):
+        return {
+            "id": booking_id, "car_id": car_id, "host_id": host_id, "user_id": renter_id, "status": status,
+            "start_date": start, "end_date": start + timedelta(days=2), "total_amount": 300.0,
+            "driver_license": "D123", "created_at": start - timedelta(days=7),
+        }
+
+    asyncio.run(repos.bookings_archive.insert_many([booking("archived-1", datetime(2029, 1, 5), "completed"), booking("archived-2", datetime(2029, 6, 5), "cancelled")]))
+    asyncio.run(repos.bookings.insert_many([booking("live-1", datetime(2029, 3, 5), "active"), booking("live-2", datetime(2030, 1, 5), "confirmed")]))
+
+    for headers in (host, renter):
+        response = client.get("/api/bookings/export", headers=headers)
+        assert response.status_code == 200, response.text
+        rows = list(csv.DictReader(io.StringIO(response.text)))
+        assert [row["id"] for row in rows] == ["archived-1", "live-1", "archived-2", "live-2"]
+        assert rows[0]["car_make"] == "Tesla"
+        assert rows[0]["renter_email"] == "renter@example.com"
+
+
+def test_parquet_export_streams_a_readable_file(client, make_user):
+    host, _ = make_user("host@example.com", "host")
+    response = client.get("/api/bookings/export", params={"format": "parquet"}, headers=host)
+    assert response.status_code == 200
+    table = server.pq.read_table(io.BytesIO(response.content))
+    assert table.schema.names == list(server.BOOKING_EXPORT_COLUMNS)
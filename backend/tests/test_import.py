@@ -0,0 +1,61 @@
+import asyncio
+
+import server
+
+
+HEADER = b"make,model,year,color,price_per_day,description,image_url,location,features\r\n"
+
+
+def car_line(model: bytes) -> bytes:
+    return b"Tesla," + model + b",2022,red,100,Quiet,https://example.com/car.jpg,Austin TX,GPS;Bluetooth\r\n"
+
+
+def import_csv(client, headers, body: bytes):
+    response = client.post("/api/cars/import", params={"format": "csv"}, content=body, headers={**headers, "Content-Type": "text/csv"})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_csv_import_accepts_a_byte_order_mark(client, make_user):
+    host, _ = make_user("host@example.com", "host")
+    report = import_csv(client, host, b"\xef\xbb\xbf" + HEADER + car_line(b"Model 3") + car_line(b"Model Y"))
+    assert (report["inserted"], report["failed"]) == (2, 0)
+
+
+def test_csv_import_reports_lines_that_are_not_utf8(client, make_user):
+    host, _ = make_user("host@example.com", "host")
+    report = import_csv(client, host, HEADER + car_line(b"Model 3") + car_line(b"Caf\xe9") + car_line(b"Model Y"))
+    assert (report["processed"], report["inserted"], report["failed"]) == (3, 2, 1)
+    assert report["errors"][0]["row"] == 3
+    assert "UTF-8" in report["errors"][0]["errors"]
+
+
+def test_csv_import_caps_an_unterminated_quoted_field(client, make_user, monkeypatch):
+    monkeypatch.setattr(server, "CAR_IMPORT_MAX_RECORD_BYTES", 1024)
+    host, _ = make_user("host@example.com", "host")
+    runaway = b'Tesla,"Model 3\n' + b"more text\n" * 200
+    report = import_csv(client, host, HEADER + car_line(b"Model S") + runaway)
+    assert report["inserted"] == 1
+    assert any("longer than 1024 bytes" in str(error["errors"]) for error in report["errors"])
+
+
+def test_import_reports_a_line_that_is_too_long(client, make_user, monkeypatch):
+    monkeypatch.setattr(server, "CAR_IMPORT_MAX_RECORD_BYTES", 1024)
+    host, _ = make_user("host@example.com", "host")
+    report = import_csv(client, host, HEADER + car_line(b"X" * 5000) + car_line(b"Model Y"))
+    assert (report["inserted"], report["failed"]) == (1, 1)
+    assert report["errors"][0] == {"row": 2, "errors": "Line is longer than 1024 bytes"}
+
+
+def test_request_lines_drop_an_overlong_line_spread_over_chunks(monkeypatch):
+    monkeypatch.setattr(server, "CAR_IMPORT_MAX_RECORD_BYTES", 16)
+
+    class StreamedRequest:
+        async def stream(self):
+            for chunk in (b"short\nAAAAAAAAAA", b"AAAAAAAAAA", b"AAAA\nnext\n"):
+                yield chunk
+
+    async def collect():
+        return [line if isinstance(line, str) else repr(line) async for line in server.iter_request_lines(StreamedRequest())]
+
+    assert asyncio.run(collect()) == ["short", repr(ValueError("Line is longer than 16 bytes")), "next"]
@@ -0,0 +1,83 @@
+import asyncio
+from datetime import datetime, timezone
+
+from pymongo.errors import CollectionInvalid # type: ignore
+
+import server
+
+
+class TailCursor:
+    """Tailable cursor over a list: waits at the end until the collection is closed"""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.position = 0
+        self.alive = True
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while self.position >= len(self.collection.documents):
+            if self.collection.closed:
+                self.alive = False
+                raise StopAsyncIteration
+            await asyncio.sleep(0.01)
+        self.position += 1
+        return self.collection.documents[self.position - 1]
+
+
+class CappedCollection:
+    def __init__(self):
+        self.documents = []
+        self.closed = False
+
+    async def insert_one(self, document):
+        self.documents.append(dict(document))
+
+    def find(self, query, cursor_type=None):
+        return TailCursor(self)
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.collection = CappedCollection()
+
+    async def create_collection(self, *args, **kwargs):
+        raise CollectionInvalid("collection already exists")
+
+    def __getitem__(self, name):
+        return self.collection
+
+
+def event(origin, seq, car_id):
+    return {"origin": origin, "seq": seq, "entity": "car", "ids": [car_id], "at": datetime.now(timezone.utc)}
+
+
+def test_bus_applies_events_in_insertion_order_after_its_marker(monkeypatch):
+    database = FakeDatabase()
+    monkeypatch.setattr(server, "db", database)
+    # Written before the worker started: only noted, never applied
+    database.collection.documents += [event("a", 1, "old"), event("a", 2, "old")]
+
+    applied = []
+    async def reload(ids):
+        applied.extend(ids)
+
+    async def scenario():
+        bus = server.InvalidationBus()
+        bus.subscribe("car", reload)
+        task = asyncio.create_task(bus.run())
+        await asyncio.sleep(0.05)
+        # Insertion order, whatever the _ids of different workers would sort as
+        database.collection.documents += [event("b", 1, "b1"), event("a", 3, "a3")]
+        bus.publish("car", ["mine"])
+        await asyncio.sleep(0.05)
+        task.cancel()
+        return bus
+
+    bus = asyncio.run(scenario())
+    assert applied == ["b1", "a3"]
+    assert bus.last_seq == {"a": 3, "b": 1}
+    assert bus.dropped == 0
+    assert [doc.get("seq") for doc in database.collection.documents if doc["origin"] == bus.worker_id] == [None, 1]
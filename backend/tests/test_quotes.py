@@ -0,0 +1,43 @@
+from datetime import datetime, timezone
+
+import server
+
+
+def test_quote_prices_mixes_naive_and_aware_dates():
+    naive = datetime(2030, 3, 1)
+    aware = datetime(2030, 3, 4, tzinfo=timezone.utc)
+    quote = server.quote_prices([100.0], naive, aware)
+    assert quote["days"] == 4
+    assert quote == server.quote_prices([100.0], naive.replace(tzinfo=timezone.utc), aware)
+
+
+def test_quote_prices_converts_offsets_to_utc():
+    # 23:00 at -05:00 is already the next day in UTC
+    start = datetime.fromisoformat("2030-03-01T23:00:00-05:00")
+    end = datetime(2030, 3, 4, 4, tzinfo=timezone.utc)
+    assert server.quote_prices([100.0], start, end)["days"] == 3
+
+
+def test_quote_rejects_end_before_start(client, make_user, make_car):
+    host, _ = make_user("host@example.com", "host")
+    car_id = make_car(host)
+    response = client.get("/api/quote", params={"car_id": car_id, "start_date": "2030-03-04T00:00:00", "end_date": "2030-03-01T00:00:00Z"})
+    assert response.status_code == 400
+
+
+def test_mixed_timezone_dates_quote_list_and_book(client, make_user, make_car):
+    host, _ = make_user("host@example.com", "host")
+    renter, _ = make_user("renter@example.com")
+    car_id = make_car(host)
+    dates = {"start_date": "2030-03-01T00:00:00", "end_date": "2030-03-04T00:00:00Z"}
+
+    quote = client.get("/api/quote", params={"car_id": car_id, **dates})
+    assert quote.status_code == 200, quote.text
+    assert quote.json()["days"] == 4
+
+    listing = client.get("/api/cars", params=dates)
+    assert listing.status_code == 200, listing.text
+    assert listing.json()[0]["quote"]["total"] == quote.json()["total"]
+
+    booking = client.post("/api/bookings", json={"car_id": car_id, "total_amount": quote.json()["total"], "driver_license": "D123", **dates}, headers=renter)
+    assert booking.status_code == 200, booking.text
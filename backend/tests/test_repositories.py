@@ -0,0 +1,74 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from repositories import create_repositories
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_find_filters_sorts_limits_and_projects():
+    cars = create_repositories("memory").cars
+    run(cars.insert_many([
+        {"id": f"car-{i}", "make": "Tesla" if i % 2 else "Honda", "price_per_day": i * 10, "location": "Austin, TX"}
+        for i in range(5)
+    ]))
+    found = run(cars.find({"make": "Tesla", "price_per_day": {"$gte": 10}}, {"_id": 0, "id": 1}, sort=[("price_per_day", -1)], limit=1))
+    assert found == [{"id": "car-3"}]
+    assert run(cars.count({"make": "Honda"})) == 3
+    assert set(run(cars.get_many(["car-1", "car-2", "missing"], {"_id": 0, "make": 1}))) == {"car-1", "car-2"}
+
+
+def test_update_reports_matched_and_modified():
+    bookings = create_repositories("memory").bookings
+    run(bookings.insert({"id": "b1", "status": "confirmed"}))
+    assert run(bookings.update({"id": "b1", "status": "confirmed"}, {"$set": {"status": "active"}})) == (1, 1)
+    assert run(bookings.update({"id": "b1", "status": "confirmed"}, {"$set": {"status": "active"}})) == (0, 0)
+    assert run(bookings.update({"id": "b1"}, {"$set": {"status": "active"}})) == (1, 0)
+
+
+def test_find_one_and_update_returns_either_version():
+    bookings = create_repositories("memory").bookings
+    run(bookings.insert({"id": "b1", "status": "confirmed"}))
+    before = run(bookings.find_one_and_update({"id": "b1"}, {"$set": {"status": "active"}}, {"_id": 0}, return_new=False))
+    assert before["status"] == "confirmed"
+    after = run(bookings.find_one_and_update({"id": "b1"}, {"$set": {"status": "completed"}}, {"_id": 0}))
+    assert after["status"] == "completed"
+    assert run(bookings.find_one_and_update({"id": "missing"}, {"$set": {"status": "active"}})) is None
+
+
+def test_bulk_update_counts_only_matching_filters():
+    bookings = create_repositories("memory").bookings
+    run(bookings.insert_many([{"id": f"b{i}", "status": "confirmed"} for i in range(3)]))
+    run(bookings.update({"id": "b1"}, {"$set": {"status": "cancelled"}}))
+    modified = run(bookings.bulk_update([
+        ({"id": f"b{i}", "status": "confirmed"}, {"$set": {"status": "active"}}) for i in range(3)
+    ]))
+    assert modified == 2
+    assert run(bookings.get("b1"))["status"] == "cancelled"
+
+
+def test_find_overlapping_only_considers_given_statuses():
+    bookings = create_repositories("memory").bookings
+    start = datetime(2030, 1, 10, tzinfo=timezone.utc)
+    run(bookings.insert_many([
+        {"id": "cancelled", "car_id": "car-1", "status": "cancelled", "start_date": start, "end_date": start + timedelta(days=3)},
+        {"id": "live", "car_id": "car-1", "status": "confirmed", "start_date": start + timedelta(days=5), "end_date": start + timedelta(days=6)},
+    ]))
+    assert run(bookings.find_overlapping("car-1", start, start + timedelta(days=2), ["confirmed", "active"])) is None
+    overlapping = run(bookings.find_overlapping("car-1", start, start + timedelta(days=5), ["confirmed", "active"]))
+    assert overlapping["id"] == "live"
+
+
+def test_list_for_cars_returns_newest_reviews_per_car_up_to_the_limit():
+    repos = create_repositories("memory")
+    now = datetime(2030, 1, 1, tzinfo=timezone.utc)
+    run(repos.reviews.insert_many(
+        [{"id": f"a{i}", "car_id": "car-a", "rating": 5, "created_at": now - timedelta(hours=i)} for i in range(5)]
+        + [{"id": "b0", "car_id": "car-b", "rating": 3, "created_at": now}]
+    ))
+    grouped = run(repos.reviews.list_for_cars(["car-a", "car-b", "car-c"], repos.cars, 3))
+    assert [review["id"] for review in grouped["car-a"]] == ["a0", "a1", "a2"]
+    assert [review["id"] for review in grouped["car-b"]] == ["b0"]
+    assert grouped["car-c"] == []
@@ -1,4 +1,4 @@
-import React, { useState } from 'react';
+import React, { useState, useEffect } from 'react';
 import { useAuth } from '../contexts/AuthContext';
 import FileUpload from './FileUpload';
 
@@ -12,6 +12,32 @@ const BookingModal = ({ car, isOpen, onClose }) => {
   });
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState('');
+  const [quote, setQuote] = useState(null);
+
+  // Totals come from the server so weekend, seasonal and long-rental rules apply
+  useEffect(() => {
+    if (!car || !bookingData.start_date || !bookingData.end_date) {
+      setQuote(null);
+      return;
+    }
+    const params = new URLSearchParams({
+      car_id: car.id,
+      start_date: new Date(bookingData.start_date).toISOString(),
+      end_date: new Date(bookingData.end_date).toISOString()
+    });
+    let cancelled = false;
+    fetch(`${API_BASE}/api/quote?${params}`)
+      .then((response) => (response.ok ? response.json() : null))
+      .then((data) => {
+        if (!cancelled) setQuote(data);
+      })
+      .catch(() => {
+        if (!cancelled) setQuote(null);
+      });
+    return () => {
+      cancelled = true;
+    };
+  }, [car, bookingData.start_date, bookingData.end_date]);
 
   const handleSubmit = async (e) => {
     e.preventDefault();
@@ -19,16 +45,15 @@ const BookingModal = ({ car, isOpen, onClose }) => {
       setError('Please upload your driver license');
       return;
     }
+    if (!quote) {
+      setError('Please select valid rental dates');
+      return;
+    }
 
     setLoading(true);
     setError('');
 
     try {
-      const startDate = new Date(bookingData.start_date);
-      const endDate = new Date(bookingData.end_date);
-      const days = Math.ceil((endDate - startDate) / (1000 * 60 * 60 * 24)) + 1;
-      const totalAmount = days * car.price_per_day;
-
       const response = await fetch(`${API_BASE}/api/bookings`, {
         method: 'POST',
         headers: {
@@ -39,7 +64,7 @@ const BookingModal = ({ car, isOpen, onClose }) => {
           car_id: car.id,
           start_date: new Date(bookingData.start_date).toISOString(),
           end_date: new Date(bookingData.end_date).toISOString(),
-          total_amount: totalAmount,
+          total_amount: quote.total,
           driver_license: bookingData.driver_license,
           additional_notes: bookingData.additional_notes
         })
@@ -71,10 +96,8 @@ const BookingModal = ({ car, isOpen, onClose }) => {
 
   if (!isOpen) return null;
 
-  const startDate = bookingData.start_date ? new Date(bookingData.start_date) : null;
-  const endDate = bookingData.end_date ? new Date(bookingData.end_date) : null;
-  const days = startDate && endDate ? Math.ceil((endDate - startDate) / (1000 * 60 * 60 * 24)) + 1 : 0;
-  const totalAmount = days * car.price_per_day;
+  const days = quote ? quote.days : 0;
+  const totalAmount = quote ? quote.total : 0;
 
   return (
     <div className="fixed inset-0 bg-black bg-opacity-50 flex items-center justify-center z-50">
@@ -138,6 +161,11 @@ const BookingModal = ({ car, isOpen, onClose }) => {
               <p className="text-sm text-blue-800">
                 <strong>Duration:</strong> {days} day(s)<br />
                 <strong>Daily Rate:</strong> ${car.price_per_day}<br />
+                {quote.discount > 0 && (
+                  <>
+                    <strong>Long Rental Discount:</strong> {Math.round(quote.discount * 100)}%<br />
+                  </>
+                )}
                 <strong>Total Amount:</strong> ${totalAmount}
               </p>
             </div>
@@ -15,7 +15,7 @@ const CarGrid = () => {
 
   const fetchCars = async () => {
     try {
-      const response = await fetch(`${API_BASE}/api/cars`);
+      const response = await fetch(`${API_BASE}/api/cars?view=card`);
       if (response.ok) {
         const data = await response.json();
         setCars(data);
@@ -77,7 +77,9 @@ const CarGrid = () => {
                 {car.year} {car.make} {car.model}
               </h3>
               <p className="text-gray-600 mb-2">{car.location}</p>
-              <p className="text-gray-700 text-sm mb-4">{car.description}</p>
+              {car.description && (
+                <p className="text-gray-700 text-sm mb-4">{car.description}</p>
+              )}
               
               {car.average_rating > 0 && (
                 <div className="flex items-center mb-4">
@@ -99,25 +101,6 @@ const CarGrid = () => {
                   Book Now
                 </button>
               </div>
-              
-              {car.reviews && car.reviews.length > 0 && (
-                <div className="mt-4 pt-4 border-t border-gray-200">
-                  <h4 className="text-sm font-semibold text-gray-700 mb-2">Recent Reviews:</h4>
-                  <div className="space-y-2 max-h-24 overflow-y-auto">
-                    {car.reviews.slice(0, 2).map((review) => (
-                      <div key={review.id} className="text-xs">
-                        <div className="flex items-center">
-                          <span className="font-medium">{review.user_name}</span>
-                          <span className="ml-2 text-yellow-400">
-                            {'⭐'.repeat(review.rating)}
-                          </span>
-                        </div>
-                        <p className="text-gray-600 truncate">{review.comment}</p>
-                      </div>
-                    ))}
-                  </div>
-                </div>
-              )}
             </div>
           </div>
         ))}
@@ -3,7 +3,7 @@ import { useAuth } from "../contexts/AuthContext";
 
 // Host Dashboard Component
 const HostDashboard = () => {
-  const { user, API_BASE, token } = useAuth();
+  const { user, API_BASE, token, openBookingEvents } = useAuth();
   const [showAddCar, setShowAddCar] = useState(false);
   const [cars, setCars] = useState([]);
   const [bookings, setBookings] = useState([]);
@@ -31,6 +31,22 @@ const HostDashboard = () => {
     }
   }, [user]);
 
+  // Booking creations and status changes are pushed by the server
+  useEffect(() => {
+    if (user?.role !== "host" || !token) return;
+    return openBookingEvents({
+      "booking.status": (e) => {
+        const { booking } = JSON.parse(e.data);
+        setBookings((prev) =>
+          prev.map((b) => (b.id === booking.id ? { ...b, status: booking.status } : b))
+        );
+      },
+      "booking.created": () => {
+        fetchMyBookings();
+      },
+    });
+  }, [user, token]);
+
   // Close dropdown when clicking outside
   useEffect(() => {
     const handleClickOutside = (event) => {
@@ -141,7 +157,9 @@ const HostDashboard = () => {
       );
 
       if (response.ok) {
-        fetchMyBookings();
+        setBookings((prev) =>
+          prev.map((b) => (b.id === bookingId ? { ...b, status } : b))
+        );
       }
     } catch (error) {
       console.error("Error updating booking status:", error);
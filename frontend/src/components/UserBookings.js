@@ -4,7 +4,7 @@ import ReviewModal from './ReviewModel';
 
 // User Bookings Component
 const UserBookings = () => {
-  const { API_BASE, token } = useAuth();
+  const { API_BASE, token, openBookingEvents } = useAuth();
   const [bookings, setBookings] = useState([]);
   const [loading, setLoading] = useState(true);
   const [selectedBooking, setSelectedBooking] = useState(null);
@@ -14,9 +14,25 @@ const UserBookings = () => {
     fetchBookings();
   }, []);
 
+  // Status changes are pushed by the server instead of re-fetching the whole list
+  useEffect(() => {
+    if (!token) return;
+    return openBookingEvents({
+      'booking.status': (e) => {
+        const { booking } = JSON.parse(e.data);
+        setBookings((prev) =>
+          prev.map((b) => (b.id === booking.id ? { ...b, status: booking.status } : b))
+        );
+      },
+      'booking.created': () => {
+        fetchBookings();
+      },
+    });
+  }, [token]);
+
   const fetchBookings = async () => {
     try {
-      const response = await fetch(`${API_BASE}/api/bookings`, {
+      const response = await fetch(`${API_BASE}/api/bookings?view=card`, {
         headers: {
           'Authorization': `Bearer ${token}`
         }
@@ -46,7 +62,9 @@ const UserBookings = () => {
       });
 
       if (response.ok) {
-        fetchBookings();
+        setBookings((prev) =>
+          prev.map((b) => (b.id === bookingId ? { ...b, status: 'cancelled' } : b))
+        );
       }
     } catch (error) {
       console.error('Error cancelling booking:', error);
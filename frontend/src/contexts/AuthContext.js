@@ -166,6 +166,43 @@ const AuthProvider = ({ children }) => {
     }
   };
 
+  // EventSource cannot send the Authorization header, so each connection is opened
+  // with a short-lived single-use ticket; reconnects fetch a fresh one
+  const openBookingEvents = (listeners) => {
+    let events = null;
+    let retryTimer = null;
+    let closed = false;
+
+    const connect = async () => {
+      try {
+        const response = await fetch(`${API_BASE}/api/bookings/events/ticket`, {
+          method: 'POST',
+          headers: {
+            'Authorization': `Bearer ${token}`
+          }
+        });
+        if (!response.ok || closed) return;
+        const { ticket } = await response.json();
+        if (closed) return;
+        events = new EventSource(`${API_BASE}/api/bookings/events?ticket=${encodeURIComponent(ticket)}`);
+        Object.entries(listeners).forEach(([type, listener]) => events.addEventListener(type, listener));
+        events.onerror = () => {
+          events.close();
+          if (!closed) retryTimer = setTimeout(connect, 5000);
+        };
+      } catch (error) {
+        if (!closed) retryTimer = setTimeout(connect, 5000);
+      }
+    };
+
+    connect();
+    return () => {
+      closed = true;
+      clearTimeout(retryTimer);
+      if (events) events.close();
+    };
+  };
+
   const logout = () => {
     setToken(null);
     setUser(null);
@@ -182,6 +219,7 @@ const AuthProvider = ({ children }) => {
       verifyEmail,
       resendVerification,
       changeRole,
+      openBookingEvents,
       logout,
       API_BASE
     }}>